@@ -0,0 +1,79 @@
+import os
+import asyncio
+from typing import Callable, Dict, FrozenSet, NamedTuple, Optional
+from telethon import events, utils
+from telethon.tl import types
+from telethon.tl.types import ChannelParticipantsAdmins
+from cache import LRUCache
+
+# ---- Admin roster cache ----
+ADMIN_CACHE_TTL = float(os.environ.get("ADMIN_CACHE_TTL", 300))   # seconds
+ADMIN_CACHE_MAX = int(os.environ.get("ADMIN_CACHE_MAX", 20_000))
+
+
+class Roster(NamedTuple):
+    admin_ids: FrozenSet[int]
+    creator: bool   # the chat's ``creator`` flag, as the old per-call check used it
+
+
+class AdminCache:
+    """Per-chat admin sets with a TTL; concurrent misses for one chat share a fetch."""
+
+    def __init__(self, client, ttl: float = ADMIN_CACHE_TTL, max_items: int = ADMIN_CACHE_MAX):
+        self.client = client
+        self._cache = LRUCache(max_items=max_items, ttl=ttl)
+        self._inflight: Dict[int, asyncio.Future] = {}
+
+    async def _fetch(self, event) -> Roster:
+        participants, chat = await asyncio.gather(
+            self.client.get_participants(event.chat_id, filter=ChannelParticipantsAdmins),
+            event.get_chat(),
+        )
+        return Roster(frozenset(p.id for p in participants), bool(getattr(chat, "creator", False)))
+
+    async def roster(self, event) -> Roster:
+        chat_id = event.chat_id
+        cached = self._cache.get(chat_id)
+        if cached is not None:
+            return cached
+        fut = self._inflight.get(chat_id)
+        if fut is None:
+            fut = asyncio.ensure_future(self._fetch(event))
+            self._inflight[chat_id] = fut
+            try:
+                roster = await asyncio.shield(fut)
+            finally:
+                del self._inflight[chat_id]
+            self._cache.set(chat_id, roster)
+            return roster
+        return await asyncio.shield(fut)
+
+    async def is_admin(self, event, user_id: int) -> bool:
+        r = await self.roster(event)
+        return user_id in r.admin_ids or r.creator
+
+    def invalidate(self, chat_id: int):
+        self._cache.pop(chat_id)
+
+    def register(self, client, on_change: Optional[Callable[[int], None]] = None):
+        """Drop a chat's roster whenever Telegram reports an admin/membership change
+        (``on_change`` replaces the local invalidation, e.g. to notify another process)."""
+        invalidate = on_change or self.invalidate
+
+        @client.on(events.Raw(types=[types.UpdateChannelParticipant, types.UpdateChatParticipantAdmin,
+                                     types.UpdateChatParticipants]))
+        async def _on_admin_update(update):
+            if isinstance(update, types.UpdateChannelParticipant):
+                invalidate(utils.get_peer_id(types.PeerChannel(update.channel_id)))
+            elif isinstance(update, types.UpdateChatParticipantAdmin):
+                invalidate(utils.get_peer_id(types.PeerChat(update.chat_id)))
+            else:
+                invalidate(utils.get_peer_id(types.PeerChat(update.participants.chat_id)))
+
+        @client.on(events.ChatAction)
+        async def _on_chat_action(event):
+            if event.user_left or event.user_kicked or event.created:
+                invalidate(event.chat_id)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
@@ -0,0 +1,119 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, List, Optional
+
+
+class WriteBehindQueue:
+    """Buffer writes in memory and hand them to an async ``flush`` in batches.
+
+    A batch goes out when ``max_batch`` items are pending or ``max_delay``
+    seconds after the first pending item, whichever comes first. With ``key``
+    set, pending items are deduplicated by key (the latest item wins).
+    """
+
+    def __init__(self, flush: Callable[[List], Awaitable[None]], max_batch: int = 500,
+                 max_delay: float = 2.0, key: Optional[Callable[[object], Hashable]] = None,
+                 name: str = "writer"):
+        self._flush = flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._key = key
+        self.name = name
+        self._pending = {} if key else []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._stopping = False
+        self.flushed = 0
+        self.batches = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, item):
+        """Queue an item; never blocks and never touches the database."""
+        if self._key:
+            self._pending[self._key(item)] = item
+        else:
+            self._pending.append(item)
+        self._ensure_running()
+        if len(self._pending) >= self.max_batch or len(self._pending) == 1:
+            # wake the writer: either the batch is full or a new delay window starts
+            self._wakeup.set()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def _take(self) -> List:
+        if self._key:
+            items = list(self._pending.values())
+            self._pending = {}
+        else:
+            items, self._pending = self._pending, []
+        return items
+
+    def _requeue(self, items: List):
+        if self._key:
+            for item in items:
+                self._pending.setdefault(self._key(item), item)
+        else:
+            self._pending[:0] = items
+
+    async def flush(self) -> bool:
+        """Write out everything pending now; False if a batch failed and was requeued."""
+        async with self._lock:
+            while self._pending:
+                items = self._take()
+                batch, rest = items[:self.max_batch], items[self.max_batch:]
+                if rest:
+                    self._requeue(rest)
+                try:
+                    await self._flush(batch)
+                except asyncio.CancelledError:
+                    # the batch was already taken off the queue; don't lose it with the task
+                    self._requeue(batch)
+                    raise
+                except Exception as e:
+                    print(f"⚠️ {self.name}: flush of {len(batch)} item(s) failed: {e}")
+                    self._requeue(batch)
+                    return False
+                self.flushed += len(batch)
+                self.batches += 1
+        return True
+
+    async def _run(self):
+        while not self._stopping:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if len(self._pending) < self.max_batch and not self._stopping:
+                # give the batch time to fill, unless it fills up first
+                try:
+                    await asyncio.wait_for(self._until_full(), timeout=self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            if not await self.flush() and not self._stopping:
+                await asyncio.sleep(self.max_delay)   # back off, then retry the requeued items
+                self._wakeup.set()
+
+    async def _until_full(self):
+        while len(self._pending) < self.max_batch and not self._stopping:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+    async def stop(self):
+        """Stop the background writer and flush whatever is still pending.
+
+        The writer is not cancelled: a batch it is writing finishes first
+        (cancelling mid-write could lose it, or write it twice).
+        """
+        if self._task and not self._task.done():
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await self._task
+            except Exception:
+                pass
+        self._task = None
+        await self.flush()
@@ -0,0 +1,271 @@
+"""Offline load test: drive the real handlers through full games in many chats at once.
+
+    python bench/loadtest.py --chats 2000 --players 6
+    python bench/loadtest.py --chats 500 --api-latency 0.05 --db-latency 0.005
+    DATABASE_URL=postgresql://... python bench/loadtest.py --postgres
+    python bench/loadtest.py --chats 2000 --shards 4
+
+Each chat plays /startgame -> minutes -> mode -> /join x N -> /begin ->
+(discussion ends) -> every player votes. The Telegram client is
+offline.FakeClient; the database is bench/memdb.py unless --postgres is given.
+Reports throughput, p50/p99 latency per step and memory per running game.
+
+With --shards N the games run in N worker processes (SHARD_WORKERS=N) and
+this process plays the front: it forwards the updates and executes the
+workers' API calls. Only end-to-end throughput is reported then; compare it
+with --shards 0 on the same machine. Each worker uses its own memdb.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import itertools
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STEPS = ("startgame", "minutes", "mode", "join", "begin", "end_discussion", "vote")
+
+
+def percentile(sorted_values, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * p), len(sorted_values) - 1)]
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource   # peak, not current, outside Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def load_bot(args):
+    os.environ["BOT_OFFLINE"] = "1"
+    if not args.send_limits:
+        # measure the handlers, not Telegram's flood limits (which the outbox enforces)
+        for var in ("OUTBOX_GLOBAL_RATE", "OUTBOX_CHAT_RATE", "OUTBOX_CHAT_BURST"):
+            os.environ[var] = "1e9"
+    if args.shards:
+        os.environ["SHARD_WORKERS"] = str(args.shards)
+    if not args.postgres:
+        os.environ["MEMDB_LATENCY"] = str(args.db_latency)
+        os.environ["LOADTEST_MEMDB"] = "1"   # read by shard_worker
+        use_memdb()
+    import main
+    main.client.latency = args.api_latency
+    return main
+
+
+def use_memdb():
+    sys.path.insert(0, os.path.join(ROOT, "bench"))
+    import memdb
+    sys.modules["db"] = memdb
+
+
+def shard_worker(index: int, count: int, conn):
+    """Entry point of a --shards worker: main.run_shard_worker, with the countdown skipped."""
+    if os.environ.get("LOADTEST_MEMDB") == "1":
+        use_memdb()
+    import main
+    schedule = main.schedule_discussion
+
+    def instant(chat_id, s):
+        # the worker owns the timers, so end the discussion as soon as the roles are out
+        s.discussion_end = time.time()
+        schedule(chat_id, s)
+
+    main.schedule_discussion = instant
+    # in a real game minutes pass before the vote; don't let the host's mode tap throttle their vote
+    from ratelimit import Budget, KeyedRateLimiter
+    main.button_limiter = KeyedRateLimiter(Budget(2, main.BUTTON_COOLDOWN))
+    main.run_shard_worker(index, count, conn)
+
+
+class Run:
+    def __init__(self, main, args):
+        from offline import EventFactory
+        self.main = main
+        self.args = args
+        self.events = EventFactory(main.client)
+        self.latency = defaultdict(list)
+        self.calls = 0
+        self.gate = asyncio.Semaphore(args.concurrency)
+
+    async def step(self, name, handler, *args):
+        start = time.perf_counter()
+        await handler(*args)
+        self.latency[name].append(time.perf_counter() - start)
+        self.calls += 1
+
+    def players(self, chat_id):
+        return [chat_id * 100 + i for i in range(1, self.args.players + 1)]
+
+    async def lobby(self, chat_id):
+        """Everything up to a running discussion."""
+        m, ev = self.main, self.events
+        host = self.players(chat_id)[0]
+        async with self.gate:
+            await self.step("startgame", m.dispatch, ev.message(chat_id, host, "/startgame"))
+            await self.step("minutes", m.dispatch, ev.message(chat_id, host, "1"))
+            await self.step("mode", m.callback_handler, ev.callback(chat_id, host, b"mode:classic"))
+            for uid in self.players(chat_id):
+                await self.step("join", m.dispatch, ev.message(chat_id, uid, "/join"))
+            await self.step("begin", m.dispatch, ev.message(chat_id, host, "/begin"))
+
+    async def vote(self, chat_id):
+        """Skip the countdown, then every player votes (the last vote ends the game)."""
+        m, ev = self.main, self.events
+        players = self.players(chat_id)
+        async with self.gate:
+            m.timers.cancel_chat(chat_id)
+            await self.step("end_discussion", m.end_discussion, chat_id)
+            for i, uid in enumerate(players):
+                target = players[(i + 1) % len(players)] if i % 3 else players[0]
+                await self.step("vote", m.callback_handler, ev.callback(chat_id, uid, f"vote:{target}".encode()))
+
+
+async def run_sharded(args):
+    main = load_bot(args)
+    from db import init_db
+
+    await init_db()
+    r = Run(main, args)
+    chats = [-(1_000_000 + i) for i in range(args.chats)]
+    # the front sees no game state; follow the games through the messages it sends for the workers
+    voting = {c: asyncio.Event() for c in chats}
+    over = {c: asyncio.Event() for c in chats}
+    # one private chat per worker: its /help reply says the worker is up
+    from shard import shard_of
+    probes = {}
+    for uid in itertools.count(1):
+        probes.setdefault(shard_of(uid, args.shards), uid)
+        if len(probes) == args.shards:
+            break
+    up = {uid: asyncio.Event() for uid in probes.values()}
+
+    def on_send(entity, text):
+        if entity in up:
+            up[entity].set()
+        elif entity in voting:
+            if text.startswith("🗳️ Discussion ended"):
+                voting[entity].set()
+            elif text.startswith(("🎉 Civilians win", "😈 Spy wins", "⚠️ No votes")):
+                over[entity].set()
+
+    main.client.on_send = on_send
+    main.shard_router.start(shard_worker)
+    for uid in up:
+        await main.dispatch(r.events.message(uid, uid, "/help"))
+    await asyncio.gather(*(e.wait() for e in up.values()))
+
+    async def vote(chat_id):
+        await voting[chat_id].wait()
+        players = r.players(chat_id)
+        async with r.gate:
+            for i, uid in enumerate(players):
+                target = players[(i + 1) % len(players)] if i % 3 else players[0]
+                await r.step("vote", main.callback_handler, r.events.callback(chat_id, uid, f"vote:{target}".encode()))
+        await over[chat_id].wait()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(r.lobby(c) for c in chats))
+    await asyncio.gather(*(voting[c].wait() for c in chats))
+    t1 = time.perf_counter()
+    await asyncio.gather(*(vote(c) for c in chats))
+    t2 = time.perf_counter()
+    router = main.shard_router
+    main.shard_router.stop()
+
+    total = t2 - t0
+    print(f"chats={args.chats} players/chat={args.players} shards={args.shards} "
+          f"api_latency={args.api_latency * 1000:.0f}ms db={'postgres' if args.postgres else 'memdb'} "
+          f"cpus={os.cpu_count()}")
+    print(f"finished     {sum(e.is_set() for e in over.values())}/{args.chats} games")
+    print(f"lobby phase  {t1 - t0:7.2f}s   voting phase {t2 - t1:7.2f}s   total {total:7.2f}s")
+    print(f"throughput   {r.calls / total:9.0f} updates/s   {args.chats / total:7.1f} games/s")
+    print(f"front        forwarded={router.forwarded} worker api calls={router.calls} "
+          f"players known for inline queries={len(main.player_chats)}")
+    fake = main.client
+    print(f"api calls    sent={fake.sent} edited={fake.edited} answered={fake.answered} lookups={fake.lookups}")
+
+
+async def run(args):
+    if args.shards:
+        return await run_sharded(args)
+    main = load_bot(args)
+    from db import init_db
+    from locations import warm_location_cache
+    from users import flush_users
+    from checkpoint import flush_checkpoints
+    from history import flush_history, top_players
+
+    await init_db()
+    await warm_location_cache()
+    r = Run(main, args)
+    chats = [-(1_000_000 + i) for i in range(args.chats)]
+    rss_before = rss_bytes()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(r.lobby(c) for c in chats))
+    t1 = time.perf_counter()
+    running = sum(main.game_states[c].game_stage == "discussion" for c in chats if c in main.game_states)
+    state = main.state_memory()
+    rss_games = rss_bytes() - rss_before
+    # in a real game minutes pass before the vote; don't let the host's mode tap throttle their vote
+    from ratelimit import KeyedRateLimiter
+    main.button_limiter = KeyedRateLimiter(main.button_limiter.default, main.button_limiter.budgets)
+    await asyncio.gather(*(r.vote(c) for c in chats))
+    t2 = time.perf_counter()
+    await flush_users()
+    await flush_checkpoints()
+    await flush_history()
+    finished = args.chats - sum(c in main.game_states for c in chats)
+
+    total = t2 - t0
+    print(f"chats={args.chats} players/chat={args.players} concurrency={args.concurrency} "
+          f"api_latency={args.api_latency * 1000:.0f}ms db={'postgres' if args.postgres else 'memdb'} "
+          f"cpus={os.cpu_count()}")
+    print(f"games running after lobby: {running}/{args.chats}   finished after votes: {finished}/{args.chats}")
+    print(f"lobby phase  {t1 - t0:7.2f}s   voting phase {t2 - t1:7.2f}s   total {total:7.2f}s")
+    print(f"throughput   {r.calls / total:9.0f} handler calls/s   {args.chats / total:7.1f} games/s")
+    print(f"memory       ~{state['bytes_per_chat']} B game state per chat (state_memory), "
+          f"~{rss_games / max(running, 1) / 1024:.1f} KiB RSS per running game")
+    fake = main.client
+    print(f"throttled    commands={main.command_limiter.stats()['throttled']} "
+          f"buttons={main.button_limiter.stats()['throttled']}")
+    print(f"api calls    sent={fake.sent} edited={fake.edited} answered={fake.answered} lookups={fake.lookups}")
+    print(f"outbox       {main.outbox.stats()}")
+    print(f"leaderboard  {(await top_players())[:3]}")
+    print()
+    print(f"{'step':<15}{'calls':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name in STEPS:
+        values = sorted(r.latency[name])
+        if values:
+            print(f"{name:<15}{len(values):>8}{percentile(values, 0.5) * 1000:>10.2f}"
+                  f"{percentile(values, 0.99) * 1000:>10.2f}{values[-1] * 1000:>10.2f}")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--chats", type=int, default=1000, help="concurrent chats (games)")
+    p.add_argument("--players", type=int, default=6, help="players per game (>= 3)")
+    p.add_argument("--concurrency", type=int, default=1000, help="chats driven at the same time")
+    p.add_argument("--api-latency", type=float, default=0.0, help="simulated Telegram round trip (s)")
+    p.add_argument("--db-latency", type=float, default=0.0, help="simulated query round trip for memdb (s)")
+    p.add_argument("--postgres", action="store_true", help="use db.py against DATABASE_URL instead of memdb")
+    p.add_argument("--shards", type=int, default=0, help="run the games in this many worker processes")
+    p.add_argument("--send-limits", action="store_true",
+                   help="keep the outbox's per-chat/global send limits (OUTBOX_* env) instead of lifting them")
+    args = p.parse_args(argv)
+    if args.players < 3:
+        p.error("--players must be at least 3")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,193 @@
+"""In-process stand-in for db.py (same functions, plain dicts instead of Postgres).
+
+bench/loadtest.py installs it as ``sys.modules["db"]`` before importing the
+bot, so nothing needs a database server. ``MEMDB_LATENCY`` (seconds) adds a
+simulated round trip to every query.
+"""
+import os
+import json
+import asyncio
+from metrics import db_timed
+
+MEMDB_LATENCY = float(os.environ.get("MEMDB_LATENCY", 0))
+
+_users = set()
+_locations = {}     # chat_id -> {location.lower(): location}, like the (chat_id, lower(location)) key
+_broadcasts = {}    # id -> [owner_id, message, last_user_id, sent, failed, status]
+_checkpoints = {}   # chat_id -> state json text
+_sessions = {}      # name -> [state json text, {entity id: row}]
+_games = []         # game records, as sent to save_games
+_user_stats = {}    # user_id -> {column: count}
+_chat_stats = {}    # chat_id -> {column: count}
+_open = False
+
+
+async def _round_trip():
+    if MEMDB_LATENCY:
+        await asyncio.sleep(MEMDB_LATENCY)
+
+
+# ---------- POOL ----------
+async def open_pool():
+    global _open
+    _open = True
+
+async def close_pool():
+    global _open
+    _open = False
+
+def pool_stats() -> dict:
+    return {"pool_min": 1, "pool_max": 1, "pool_size": 1, "pool_available": 1} if _open else {}
+
+def pool_health() -> tuple:
+    return _open, {"open": _open, "memdb": True}
+
+@db_timed
+async def init_db():
+    await open_pool()
+
+# ---------- USERS ----------
+@db_timed
+async def add_user(user_id: int):
+    await _round_trip()
+    _users.add(user_id)
+
+@db_timed
+async def add_users(user_ids):
+    await _round_trip()
+    _users.update(user_ids)
+
+async def iter_user_ids(after: int = 0, itersize: int = 1000):
+    await _round_trip()
+    for uid in sorted(u for u in _users if u > after):
+        yield uid
+
+@db_timed
+async def count_users(after: int = 0) -> int:
+    await _round_trip()
+    return sum(u > after for u in _users)
+
+# ---------- LOCATIONS ----------
+@db_timed
+async def get_custom_locations_db(chat_id: int):
+    await _round_trip()
+    return sorted(_locations.get(chat_id, {}).values())
+
+@db_timed
+async def add_custom_locations_db(chat_id: int, names) -> list:
+    await _round_trip()
+    current = _locations.setdefault(chat_id, {})
+    added = []
+    for name in names:
+        if name.lower() not in current:
+            current[name.lower()] = name
+            added.append(name)
+    return added
+
+@db_timed
+async def remove_custom_location_db(chat_id: int, name: str):
+    await _round_trip()
+    ok = _locations.get(chat_id, {}).pop(name.lower(), None) is not None
+    return (ok, None if ok else "Not found among custom locations.")
+
+@db_timed
+async def reset_custom_locations_db(chat_id: int):
+    await _round_trip()
+    _locations.pop(chat_id, None)
+
+@db_timed
+async def get_custom_locations_grouped():
+    await _round_trip()
+    return {chat_id: sorted(locs.values()) for chat_id, locs in _locations.items() if locs}
+
+# ---------- BROADCASTS ----------
+@db_timed
+async def create_broadcast(owner_id: int, message: str) -> int:
+    await _round_trip()
+    broadcast_id = len(_broadcasts) + 1
+    _broadcasts[broadcast_id] = [owner_id, message, 0, 0, 0, "running"]
+    return broadcast_id
+
+@db_timed
+async def checkpoint_broadcast(broadcast_id: int, last_user_id: int, sent: int, failed: int,
+                               status: str = "running"):
+    await _round_trip()
+    _broadcasts[broadcast_id][2:] = [last_user_id, sent, failed, status]
+
+@db_timed
+async def get_running_broadcasts():
+    await _round_trip()
+    return [(i, *row[:5]) for i, row in sorted(_broadcasts.items()) if row[5] == "running"]
+
+# ---------- TELETHON SESSION ----------
+@db_timed
+async def load_session(name: str):
+    await _round_trip()
+    if name not in _sessions:
+        return None
+    state, rows = _sessions[name]
+    return json.loads(state), list(rows.values())
+
+@db_timed
+async def save_session(name: str, state_json: str, rows):
+    await _round_trip()
+    stored = _sessions.setdefault(name, [None, {}])
+    stored[0] = state_json
+    stored[1].update((row[0], tuple(row)) for row in rows)
+
+@db_timed
+async def delete_session(name: str):
+    await _round_trip()
+    _sessions.pop(name, None)
+
+# ---------- GAME HISTORY + STATS ----------
+USER_STAT_COLUMNS = ("games", "wins", "spy_games", "spy_wins", "correct_guesses")
+CHAT_STAT_COLUMNS = ("games", "spy_wins", "civilian_wins", "correct_guesses", "total_seconds")
+
+@db_timed
+async def save_games(games_json: str, user_deltas, chat_deltas) -> list:
+    await _round_trip()
+    _games.extend(json.loads(games_json))
+    for chat_id, *counts in chat_deltas:
+        stats = _chat_stats.setdefault(chat_id, dict.fromkeys(CHAT_STAT_COLUMNS, 0))
+        for column, n in zip(CHAT_STAT_COLUMNS, counts):
+            stats[column] += n
+    totals = []
+    for user_id, *counts in user_deltas:
+        stats = _user_stats.setdefault(user_id, dict.fromkeys(USER_STAT_COLUMNS, 0))
+        for column, n in zip(USER_STAT_COLUMNS, counts):
+            stats[column] += n
+        totals.append((user_id, stats["wins"], stats["games"]))
+    return totals
+
+@db_timed
+async def get_user_stats(user_id: int):
+    await _round_trip()
+    stats = _user_stats.get(user_id)
+    return dict(stats) if stats else None
+
+@db_timed
+async def get_chat_stats(chat_id: int):
+    await _round_trip()
+    stats = _chat_stats.get(chat_id)
+    return dict(stats) if stats else None
+
+@db_timed
+async def get_top_players(limit: int) -> list:
+    await _round_trip()
+    rows = sorted((-s["wins"], uid, s["games"]) for uid, s in _user_stats.items() if s["wins"] > 0)
+    return [(uid, -wins, games) for wins, uid, games in rows[:limit]]
+
+# ---------- GAME CHECKPOINTS ----------
+@db_timed
+async def save_game_checkpoints(upserts, deletes):
+    await _round_trip()
+    for chat_id, state in upserts:
+        _checkpoints[chat_id] = state
+    for chat_id in deletes:
+        _checkpoints.pop(chat_id, None)
+
+@db_timed
+async def load_game_checkpoints():
+    await _round_trip()
+    return [(chat_id, json.loads(state)) for chat_id, state in _checkpoints.items()]
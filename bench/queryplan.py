@@ -0,0 +1,117 @@
+"""Query plans before and after schema v2, on generated tables with millions of rows.
+
+    DATABASE_URL=postgresql://... python bench/queryplan.py
+    DATABASE_URL=postgresql://... python bench/queryplan.py --locations 5000000 --users 2000000
+
+Everything happens in a scratch schema (``--schema``, dropped at the end), so
+the bot's own tables are never touched. For each query the script prints
+EXPLAIN (ANALYZE, BUFFERS) without the v2 indexes, then with them:
+
+- case-insensitive location lookup / delete: the chat's whole primary-key range
+  filtered by lower() -> one probe of locations_chat_lower_key
+- add location: NOT EXISTS + INSERT -> INSERT ... ON CONFLICT on the same key
+- a 1000-row users page halfway through the table: OFFSET, which reads and
+  discards every earlier row -> keyset range scan on the users primary key
+  (how iter_user_ids pages broadcast recipients; needs no extra index)
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def queries(args):
+    """label -> (sql, params)."""
+    chat, name = args.locations // args.per_chat // 2, "Location 42"
+    deep = args.users // 2
+    return {
+        "lookup location": (
+            "SELECT location FROM locations WHERE chat_id=%s AND lower(location)=lower(%s)", (chat, name)),
+        "remove location": (
+            "DELETE FROM locations WHERE chat_id=%s AND lower(location)=lower(%s)", (chat, name)),
+        "add location (v1)": (
+            "INSERT INTO locations (chat_id, location) SELECT %s, %s WHERE NOT EXISTS ("
+            "SELECT 1 FROM locations WHERE chat_id=%s AND LOWER(location)=LOWER(%s))",
+            (chat, "new place", chat, "new place")),
+        "users page (OFFSET)": (
+            "SELECT user_id FROM users ORDER BY user_id OFFSET %s LIMIT 1000", (deep,)),
+        "users page (keyset)": (
+            "SELECT user_id FROM users WHERE user_id > %s ORDER BY user_id LIMIT 1000", (deep,)),
+    }
+
+
+V2_ADD = ("add location (v2)",
+          "INSERT INTO locations (chat_id, location) VALUES (%s, %s) "
+          "ON CONFLICT (chat_id, lower(location)) DO NOTHING RETURNING location")
+
+
+async def explain(conn, label, sql, params):
+    # ANALYZE executes the statement; roll back so before/after see the same data
+    async with conn.transaction(force_rollback=True):
+        start = time.perf_counter()
+        cur = await conn.execute("EXPLAIN (ANALYZE, BUFFERS, COSTS OFF) " + sql, params)
+        plan = [r[0] for r in await cur.fetchall()]
+        elapsed = time.perf_counter() - start
+    print(f"--- {label}  ({elapsed * 1000:.1f} ms round trip)")
+    for line in plan:
+        print("    " + line)
+
+
+async def run(args):
+    import psycopg
+    from db import _dsn
+
+    async with await psycopg.AsyncConnection.connect(_dsn(), autocommit=True) as conn:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE")
+        await conn.execute(f"CREATE SCHEMA {args.schema}")
+        await conn.execute(f"SET search_path TO {args.schema}")
+        try:
+            print(f"generating {args.locations:,} locations and {args.users:,} users ...")
+            # v1 tables
+            await conn.execute("CREATE TABLE users (user_id BIGINT PRIMARY KEY)")
+            await conn.execute(
+                "CREATE TABLE locations (chat_id BIGINT NOT NULL, location TEXT NOT NULL, "
+                "PRIMARY KEY (chat_id, location))")
+            await conn.execute(
+                "INSERT INTO locations SELECT i / %s, 'Location ' || (i %% %s) FROM generate_series(0, %s - 1) i",
+                (args.per_chat, args.per_chat, args.locations))
+            await conn.execute("INSERT INTO users SELECT i FROM generate_series(1, %s) i", (args.users,))
+            await conn.execute("VACUUM ANALYZE locations")
+            await conn.execute("VACUUM ANALYZE users")
+            plans = queries(args)
+            print("\n========== before (schema v1 indexes) ==========")
+            for label, (sql, params) in plans.items():
+                await explain(conn, label, sql, params)
+
+            await conn.execute(
+                "CREATE UNIQUE INDEX locations_chat_lower_key ON locations (chat_id, lower(location))")
+            await conn.execute("ANALYZE locations")
+            await conn.execute("ANALYZE users")
+
+            print("\n========== after (schema v2 indexes) ==========")
+            for label, (sql, params) in plans.items():
+                if label == "add location (v1)":
+                    label, sql = V2_ADD
+                    params = params[:2]
+                await explain(conn, label, sql, params)
+        finally:
+            if not args.keep:
+                await conn.execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--locations", type=int, default=3_000_000, help="rows in the scratch locations table")
+    p.add_argument("--per-chat", type=int, default=60, help="custom locations per chat")
+    p.add_argument("--users", type=int, default=2_000_000, help="rows in the scratch users table")
+    p.add_argument("--schema", default="spygame_queryplan", help="scratch schema (dropped and recreated)")
+    p.add_argument("--keep", action="store_true", help="leave the scratch schema in place afterwards")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
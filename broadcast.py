@@ -0,0 +1,190 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Optional
+from telethon import errors
+from ratelimit import TokenBucket
+from outbox import BULK
+from db import (
+    iter_user_ids, count_users,
+    create_broadcast, checkpoint_broadcast, get_running_broadcasts
+)
+
+# ---- Broadcast engine ----
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", 25))            # messages per second
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", 8))  # sends in flight
+BROADCAST_CHECKPOINT_EVERY = 5.0   # seconds between progress checkpoints
+BROADCAST_REPORT_EVERY = 10.0      # seconds between progress edits to the owner
+BROADCAST_MAX_RETRIES = 3          # FloodWait retries per recipient
+
+
+class Broadcast:
+    """One broadcast run: streams recipients, sends at a capped rate, checkpoints progress.
+
+    Delivery is at-least-once: recipients finished past the checkpointed
+    watermark when the process dies are sent to again on resume.
+    """
+
+    def __init__(self, client, broadcast_id: int, owner_id: int, message: str,
+                 last_user_id: int = 0, sent: int = 0, failed: int = 0):
+        self.client = client
+        self.id = broadcast_id
+        self.owner_id = owner_id
+        self.message = message
+        self.last_user_id = last_user_id   # every id <= this one has been handled
+        self.sent = sent
+        self.failed = failed
+        self.total: Optional[int] = None
+        self.started = time.monotonic()
+        self._start_done = sent + failed
+        self._bucket = TokenBucket(BROADCAST_RATE)
+        # ids handed to workers, in id order; id -> done flag
+        self._inflight = deque()
+        self._done = {}
+        self._status_msg = None
+        self._stopped = False
+        self.task: Optional[asyncio.Task] = None
+
+    # ---- progress ----
+    def _advance_watermark(self):
+        while self._inflight and self._done.get(self._inflight[0]):
+            uid = self._inflight.popleft()
+            del self._done[uid]
+            self.last_user_id = uid
+
+    def report(self) -> str:
+        done = self.sent + self.failed
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        rate = (done - self._start_done) / elapsed
+        text = f"📣 Broadcast #{self.id}\n📨 Sent: {self.sent}\n❌ Failed: {self.failed}\n⚡ {rate:.1f} msg/s"
+        if self.total is not None:
+            left = max(self.total - done, 0)
+            text += f"\n📊 {done}/{self.total}"
+            if rate > 0:
+                eta = int(left / rate)
+                text += f"\n⏳ ETA {eta // 60}m {eta % 60:02d}s"
+        return text
+
+    async def _report(self, final: str = ""):
+        text = self.report() + (f"\n\n{final}" if final else "")
+        try:
+            if self._status_msg is None:
+                self._status_msg = await self.client.send_message(self.owner_id, text)
+            else:
+                await self.client.edit_message(self.owner_id, self._status_msg, text)
+        except Exception:
+            pass
+
+    async def _checkpoint(self, status: str = "running"):
+        try:
+            await checkpoint_broadcast(self.id, self.last_user_id, self.sent, self.failed, status)
+        except Exception as e:
+            print(f"⚠️ Broadcast #{self.id} checkpoint failed: {e}")
+
+    async def _progress_loop(self):
+        last_report = 0.0
+        while True:
+            await asyncio.sleep(BROADCAST_CHECKPOINT_EVERY)
+            await self._checkpoint()
+            if time.monotonic() - last_report >= BROADCAST_REPORT_EVERY:
+                last_report = time.monotonic()
+                await self._report()
+
+    # ---- sending ----
+    async def _send(self, uid: int):
+        for _ in range(BROADCAST_MAX_RETRIES + 1):
+            await self._bucket.acquire()
+            try:
+                # behind all game traffic; FloodWaits surface here, since they hold every worker
+                await self.client.send_message(uid, self.message, priority=BULK, max_wait=0)
+                self.sent += 1
+                return
+            except errors.FloodWaitError as e:
+                # the limit is global to the bot: every worker waits it out
+                self._bucket.pause(e.seconds + 1)
+            except Exception:
+                break
+        self.failed += 1
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            uid = await queue.get()
+            try:
+                await self._send(uid)
+            finally:
+                self._done[uid] = True
+                self._advance_watermark()
+                queue.task_done()
+
+    async def run(self):
+        await self._report()
+        progress = asyncio.create_task(self._progress_loop())
+        queue: asyncio.Queue = asyncio.Queue(maxsize=BROADCAST_CONCURRENCY * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(BROADCAST_CONCURRENCY)]
+        try:
+            self.total = self.sent + self.failed + await count_users(self.last_user_id)
+            user_ids = iter_user_ids(self.last_user_id)
+            try:
+                async for uid in user_ids:
+                    if self._stopped:
+                        break
+                    self._inflight.append(uid)
+                    await queue.put(uid)
+            finally:
+                await user_ids.aclose()   # stop paging
+            await queue.join()
+        finally:
+            progress.cancel()
+            for w in workers:
+                w.cancel()
+
+        status = "stopped" if self._stopped else "done"
+        await self._checkpoint(status)
+        await self._report("🛑 Broadcast stopped." if self._stopped else "✅ Broadcast complete!")
+
+    def stop(self):
+        self._stopped = True
+
+
+# at most one broadcast runs at a time
+_current: Optional[Broadcast] = None
+
+
+def current_broadcast() -> Optional[Broadcast]:
+    return _current if _current and _current.task and not _current.task.done() else None
+
+
+def _launch(b: Broadcast) -> Broadcast:
+    global _current
+    _current = b
+
+    async def runner():
+        try:
+            await b.run()
+        except asyncio.CancelledError:
+            # shutdown: leave the row 'running' so the next start resumes it
+            await b._checkpoint()
+            raise
+        except Exception as e:
+            print(f"⚠️ Broadcast #{b.id} crashed: {e}")
+            await b._checkpoint()
+
+    b.task = asyncio.create_task(runner())
+    return b
+
+
+async def start_broadcast(client, owner_id: int, message: str) -> Broadcast:
+    broadcast_id = await create_broadcast(owner_id, message)
+    return _launch(Broadcast(client, broadcast_id, owner_id, message))
+
+
+async def resume_broadcasts(client):
+    """Continue a broadcast interrupted by a restart, from its last checkpoint."""
+    rows = await get_running_broadcasts()
+    for row in rows[:-1]:
+        # only the newest one is resumed; older leftovers are closed out
+        await checkpoint_broadcast(row[0], row[3], row[4], row[5], "stopped")
+    if rows:
+        bid, owner_id, message, last_user_id, sent, failed = rows[-1]
+        _launch(Broadcast(client, bid, owner_id, message, last_user_id, sent, failed))
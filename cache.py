@@ -0,0 +1,90 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+def approx_size(value) -> int:
+    """Rough deep size of a value made of strings/ints and flat containers."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sys.getsizeof(v) for v in value)
+    elif isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    return size
+
+
+class LRUCache:
+    """OrderedDict-backed LRU with an item cap, an optional memory cap (bytes)
+    and an optional per-entry TTL (seconds)."""
+
+    def __init__(self, max_items: int = 10000, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None, sizeof: Callable[[Any], int] = approx_size):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()   # key -> (value, size, expires)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        item = self._data.get(key)
+        return item is not None and not self._expired(key, item)
+
+    def _expired(self, key, item) -> bool:
+        if item[2] is not None and item[2] <= time.monotonic():
+            self.pop(key)
+            return True
+        return False
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None or self._expired(key, item):
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        size = self._sizeof(value) if self.max_bytes is not None else 0
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self._data[key] = (value, size, expires)
+        self.bytes += size
+        self._evict()
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        if item is None:
+            return default
+        self.bytes -= item[1]
+        return item[0]
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def _evict(self):
+        while self._data and (
+            len(self._data) > self.max_items
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            _, (_, size, _) = self._data.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "items": len(self._data), "bytes": self.bytes,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+        }
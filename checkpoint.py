@@ -0,0 +1,64 @@
+import os
+import json
+from typing import Callable, Optional
+from batcher import WriteBehindQueue
+from state import GameState, game_states, state_to_dict, state_from_dict
+from db import save_game_checkpoints, load_game_checkpoints
+
+# ---- Crash-safe game checkpoints ----
+CHECKPOINT_FLUSH_BATCH = int(os.environ.get("CHECKPOINT_FLUSH_BATCH", 200))
+CHECKPOINT_FLUSH_DELAY = float(os.environ.get("CHECKPOINT_FLUSH_DELAY", 1.0))
+
+
+async def _flush(items):
+    # items are (chat_id, GameState or None); states are serialized only now,
+    # so a chat changed ten times between flushes is encoded once
+    upserts, deletes = [], []
+    for chat_id, s in items:
+        if s is None:
+            deletes.append(chat_id)
+        else:
+            upserts.append((chat_id, json.dumps(state_to_dict(s))))
+    await save_game_checkpoints(upserts, deletes)
+
+
+_writer = WriteBehindQueue(
+    _flush, max_batch=CHECKPOINT_FLUSH_BATCH, max_delay=CHECKPOINT_FLUSH_DELAY,
+    key=lambda item: item[0], name="checkpoints"
+)
+
+
+def save_state(chat_id: int, s: GameState):
+    """Mark a chat's game as changed; written to Postgres shortly after."""
+    if s.game_started:
+        _writer.add((chat_id, s))
+    else:
+        _writer.add((chat_id, None))
+
+
+def forget_state(chat_id: int):
+    """The chat's game ended; remove its checkpoint."""
+    _writer.add((chat_id, None))
+
+
+async def flush_checkpoints():
+    await _writer.stop()
+
+
+async def restore_states(owns: Optional[Callable[[int], bool]] = None) -> list:
+    """Load checkpointed games back into game_states; returns the restored states as (chat_id, state).
+
+    ``owns`` limits the restore to some chats (a shard worker's share).
+    """
+    restored = []
+    for chat_id, data in await load_game_checkpoints():
+        if owns is not None and not owns(chat_id):
+            continue
+        try:
+            s = state_from_dict(data)
+        except Exception as e:
+            print(f"⚠️ Could not restore game in chat {chat_id}: {e}")
+            continue
+        game_states[chat_id] = s
+        restored.append((chat_id, s))
+    return restored
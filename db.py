@@ -1,87 +1,564 @@
 import os
-import psycopg
+import asyncio
+from typing import TYPE_CHECKING, Optional
+from metrics import DB_SECONDS, db_timed
 
-def _conn():
+if TYPE_CHECKING:
+    from psycopg_pool import AsyncConnectionPool
+
+# ---------- POOL ----------
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 10))
+DB_HEALTH_INTERVAL = float(os.environ.get("DB_HEALTH_INTERVAL", 60))   # seconds between idle checks
+
+def _prepare_threshold(raw: str) -> Optional[int]:
+    # psycopg prepares on first use for any negative threshold; only None turns it off
+    if raw.strip().lower() in ("", "none", "off"):
+        return None
+    value = int(raw)
+    return None if value < 0 else value
+
+# prepare server-side after N executions of the same query (0 = always, -1/none = never,
+# e.g. behind PgBouncer in transaction pooling mode)
+DB_PREPARE_THRESHOLD = _prepare_threshold(os.environ.get("DB_PREPARE_THRESHOLD", "1"))
+
+_pool: Optional["AsyncConnectionPool"] = None
+_health_task: Optional[asyncio.Task] = None
+_last_check_error: Optional[str] = None   # result of the latest background check
+
+
+def _dsn():
     url = os.environ.get("DATABASE_URL")
     if not url:
         raise RuntimeError("DATABASE_URL not set")
     # sslmode ensure
     if "sslmode=" not in url:
         url = url + ("&" if "?" in url else "?") + "sslmode=require"
-    return psycopg.connect(url, autocommit=True)
-
-def init_db():
-    with _conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY
-            )
-            """)
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS locations (
-                chat_id BIGINT NOT NULL,
-                location TEXT NOT NULL,
-                PRIMARY KEY (chat_id, location)
-            )
-            """)
+    return url
 
-# ---------- USERS ----------
-def add_user(user_id: int):
-    with _conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "INSERT INTO users (user_id) VALUES (%s) ON CONFLICT DO NOTHING",
-                (user_id,)
+
+async def _health_loop(pool: "AsyncConnectionPool"):
+    """Validate idle connections in the background so borrowing never pays for a ping."""
+    global _last_check_error
+    while True:
+        await asyncio.sleep(DB_HEALTH_INTERVAL)
+        try:
+            await pool.check()
+            _last_check_error = None
+        except Exception as e:
+            _last_check_error = str(e)
+            print(f"⚠️ DB health check failed: {e}")
+
+
+async def open_pool() -> "AsyncConnectionPool":
+    """Open the shared pool once; later calls return the same pool."""
+    global _pool, _health_task
+    if _pool is None:
+        from psycopg_pool import AsyncConnectionPool   # heavy import, only when a DB is used
+        pool = AsyncConnectionPool(
+            _dsn(),
+            min_size=DB_POOL_MIN,
+            max_size=DB_POOL_MAX,
+            max_idle=300,
+            max_lifetime=3600,
+            kwargs={"autocommit": True, "prepare_threshold": DB_PREPARE_THRESHOLD},
+            name="spygame",
+            open=False,
+        )
+        await pool.open(wait=True, timeout=30)
+        _pool = pool
+        _health_task = asyncio.create_task(_health_loop(pool))
+    return _pool
+
+
+async def close_pool():
+    global _pool, _health_task
+    if _health_task:
+        _health_task.cancel()
+        _health_task = None
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def _get_pool() -> "AsyncConnectionPool":
+    if _pool is None:
+        raise RuntimeError("Database pool is not open (call open_pool() first)")
+    return _pool
+
+
+def pool_stats() -> dict:
+    return _pool.get_stats() if _pool is not None else {}
+
+
+def pool_health() -> tuple:
+    """(ok, details) for the health endpoint, from pool state only (no query)."""
+    if _pool is None or _pool.closed:
+        return False, {"open": False}
+    stats = _pool.get_stats()
+    details = {
+        "open": True,
+        "size": stats.get("pool_size", 0),
+        "available": stats.get("pool_available", 0),
+        "waiting": stats.get("requests_waiting", 0),
+        "last_check_error": _last_check_error,
+    }
+    return _last_check_error is None, details
+
+
+# ---------- SCHEMA ----------
+# (version, statements); append new versions, never edit applied ones
+MIGRATIONS = [
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS locations (
+            chat_id BIGINT NOT NULL,
+            location TEXT NOT NULL,
+            PRIMARY KEY (chat_id, location)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id BIGSERIAL PRIMARY KEY,
+            owner_id BIGINT NOT NULL,
+            message TEXT NOT NULL,
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'running',
+            started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS game_checkpoints (
+            chat_id BIGINT PRIMARY KEY,
+            state JSONB NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """,
+    ]),
+    (2, [
+        # case-insensitive uniqueness: keep one spelling of any duplicate first
+        """
+        DELETE FROM locations a USING locations b
+        WHERE a.chat_id = b.chat_id AND lower(a.location) = lower(b.location) AND a.location > b.location
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS locations_chat_lower_key ON locations (chat_id, lower(location))",
+        # non-volatile default: no table rewrite, existing rows read as the migration time
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+        "CREATE INDEX IF NOT EXISTS users_created_at_idx ON users (created_at, user_id)",
+    ]),
+    (3, [
+        # Telethon session (SESSION_BACKEND=postgres): login, update state and known entities
+        """
+        CREATE TABLE IF NOT EXISTS telethon_sessions (
+            name TEXT PRIMARY KEY,
+            state JSONB NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS telethon_entities (
+            session TEXT NOT NULL,
+            id BIGINT NOT NULL,
+            hash BIGINT NOT NULL,
+            username TEXT,
+            phone TEXT,
+            name TEXT,
+            PRIMARY KEY (session, id)
+        )
+        """,
+    ]),
+    (4, [
+        # finished games, append-only
+        """
+        CREATE TABLE IF NOT EXISTS games (
+            id BIGSERIAL PRIMARY KEY,
+            chat_id BIGINT NOT NULL,
+            mode TEXT,
+            location TEXT,
+            winner TEXT NOT NULL,
+            reason TEXT NOT NULL,
+            guessed_by BIGINT,
+            roles JSONB NOT NULL,
+            votes JSONB NOT NULL,
+            started_at TIMESTAMPTZ,
+            ended_at TIMESTAMPTZ NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS games_chat_idx ON games (chat_id, ended_at)",
+        # aggregates, updated in the same transaction as the games they count
+        """
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id BIGINT PRIMARY KEY,
+            games INTEGER NOT NULL DEFAULT 0,
+            wins INTEGER NOT NULL DEFAULT 0,
+            spy_games INTEGER NOT NULL DEFAULT 0,
+            spy_wins INTEGER NOT NULL DEFAULT 0,
+            correct_guesses INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS user_stats_wins_idx ON user_stats (wins DESC, user_id)",
+        """
+        CREATE TABLE IF NOT EXISTS chat_stats (
+            chat_id BIGINT PRIMARY KEY,
+            games INTEGER NOT NULL DEFAULT 0,
+            spy_wins INTEGER NOT NULL DEFAULT 0,
+            civilian_wins INTEGER NOT NULL DEFAULT 0,
+            correct_guesses INTEGER NOT NULL DEFAULT 0,
+            total_seconds BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """,
+    ]),
+    (5, [
+        # nothing pages users in sign-up order: recipients are paged by the primary key
+        # (iter_user_ids), so the v2 column and index only cost every user insert
+        "DROP INDEX IF EXISTS users_created_at_idx",
+        "ALTER TABLE users DROP COLUMN IF EXISTS created_at",
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+_MIGRATION_LOCK = 0x5079_6761   # pg_advisory_xact_lock key: one migrator at a time
+
+
+async def _schema_version(conn) -> int:
+    from psycopg import errors
+    try:
+        cur = await conn.execute("SELECT coalesce(max(version), 0) FROM schema_version")
+    except errors.UndefinedTable:
+        return 0   # database predates versioned migrations (or is empty)
+    return (await cur.fetchone())[0]
+
+
+@db_timed
+async def migrate() -> list:
+    """Bring the schema up to SCHEMA_VERSION; returns the versions applied.
+
+    A current schema costs one query and no DDL.
+    """
+    applied = []
+    async with _get_pool().connection() as conn:
+        if await _schema_version(conn) >= SCHEMA_VERSION:
+            return applied
+        async with conn.transaction():
+            # concurrent starters wait here, then see the versions the first one applied
+            await conn.execute("SELECT pg_advisory_xact_lock(%s)", (_MIGRATION_LOCK,))
+            await conn.execute(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                "version INTEGER PRIMARY KEY, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
             )
+            current = await _schema_version(conn)
+            for version, statements in MIGRATIONS:
+                if version <= current:
+                    continue
+                for sql in statements:
+                    await conn.execute(sql)
+                await conn.execute("INSERT INTO schema_version (version) VALUES (%s)", (version,))
+                applied.append(version)
+    return applied
 
-def get_all_users():
-    with _conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT user_id FROM users")
-            rows = cur.fetchall()
-            return [r[0] for r in rows]   # row[0] because no RealDictCursor
+
+async def init_db() -> list:
+    """Open the pool and apply pending migrations."""
+    await open_pool()
+    return await migrate()
+
+# ---------- USERS ----------
+@db_timed
+async def add_user(user_id: int):
+    async with _get_pool().connection() as conn:
+        await conn.execute(
+            "INSERT INTO users (user_id) VALUES (%s) ON CONFLICT DO NOTHING",
+            (user_id,)
+        )
 
 # ---------- LOCATIONS (custom per chat) ----------
-def get_custom_locations_db(chat_id: int):
-    with _conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT location FROM locations WHERE chat_id = %s ORDER BY location ASC",
-                (chat_id,)
+@db_timed
+async def get_custom_locations_db(chat_id: int):
+    async with _get_pool().connection() as conn:
+        cur = await conn.execute(
+            "SELECT location FROM locations WHERE chat_id = %s ORDER BY location ASC",
+            (chat_id,)
+        )
+        rows = await cur.fetchall()
+        return [r[0] for r in rows]
+
+@db_timed
+async def add_custom_locations_db(chat_id: int, names) -> list:
+    """Insert many (already validated) names in one statement; returns the ones added.
+
+    Names already present for the chat, in any letter case, are skipped.
+    """
+    async with _get_pool().connection() as conn:
+        cur = await conn.execute(
+            """
+            INSERT INTO locations (chat_id, location)
+            SELECT %s, t.name FROM unnest(%s::text[]) AS t(name)
+            ON CONFLICT (chat_id, lower(location)) DO NOTHING
+            RETURNING location
+            """,
+            (chat_id, list(names))
+        )
+        return [r[0] for r in await cur.fetchall()]
+
+@db_timed
+async def remove_custom_location_db(chat_id: int, name: str):
+    async with _get_pool().connection() as conn:
+        # same expression as locations_chat_lower_key, so this is an index lookup
+        cur = await conn.execute(
+            "DELETE FROM locations WHERE chat_id=%s AND lower(location)=lower(%s)",
+            (chat_id, name)
+        )
+        ok = cur.rowcount > 0
+        return (ok, None if ok else "Not found among custom locations.")
+
+@db_timed
+async def reset_custom_locations_db(chat_id: int):
+    async with _get_pool().connection() as conn:
+        await conn.execute("DELETE FROM locations WHERE chat_id=%s", (chat_id,))
+
+@db_timed
+async def get_custom_locations_grouped():
+    """All custom locations in one grouped query: {chat_id: [location, ...]}."""
+    async with _get_pool().connection() as conn:
+        cur = await conn.execute(
+            "SELECT chat_id, array_agg(location ORDER BY location) FROM locations GROUP BY chat_id"
+        )
+        rows = await cur.fetchall()
+        return {r[0]: r[1] for r in rows}
+
+@db_timed
+async def add_users(user_ids):
+    """Register many users with one multi-row insert."""
+    async with _get_pool().connection() as conn:
+        await conn.execute(
+            "INSERT INTO users (user_id) SELECT unnest(%s::bigint[]) ON CONFLICT DO NOTHING",
+            (list(user_ids),)
+        )
+
+async def iter_user_ids(after: int = 0, itersize: int = 1000):
+    """Stream user ids above ``after`` in ascending order, one primary-key page at a time.
+
+    Each page borrows a connection only for its own query, so a broadcast
+    paced over hours holds no connection or transaction between pages.
+    """
+    while True:
+        # timed per page, not across the consumer's work between pages
+        with DB_SECONDS.time("iter_user_ids"):
+            async with _get_pool().connection() as conn:
+                cur = await conn.execute(
+                    "SELECT user_id FROM users WHERE user_id > %s ORDER BY user_id LIMIT %s",
+                    (after, itersize)
+                )
+                rows = await cur.fetchall()
+        for row in rows:
+            yield row[0]
+        if len(rows) < itersize:
+            return
+        after = rows[-1][0]
+
+@db_timed
+async def count_users(after: int = 0) -> int:
+    async with _get_pool().connection() as conn:
+        cur = await conn.execute("SELECT count(*) FROM users WHERE user_id > %s", (after,))
+        return (await cur.fetchone())[0]
+
+# ---------- BROADCASTS ----------
+@db_timed
+async def create_broadcast(owner_id: int, message: str) -> int:
+    async with _get_pool().connection() as conn:
+        cur = await conn.execute(
+            "INSERT INTO broadcasts (owner_id, message) VALUES (%s, %s) RETURNING id",
+            (owner_id, message)
+        )
+        return (await cur.fetchone())[0]
+
+@db_timed
+async def checkpoint_broadcast(broadcast_id: int, last_user_id: int, sent: int, failed: int,
+                               status: str = "running"):
+    async with _get_pool().connection() as conn:
+        await conn.execute(
+            """
+            UPDATE broadcasts
+            SET last_user_id=%s, sent=%s, failed=%s, status=%s, updated_at=now()
+            WHERE id=%s
+            """,
+            (last_user_id, sent, failed, status, broadcast_id)
+        )
+
+@db_timed
+async def get_running_broadcasts():
+    """Broadcasts interrupted mid-run: [(id, owner_id, message, last_user_id, sent, failed)]."""
+    async with _get_pool().connection() as conn:
+        cur = await conn.execute(
+            "SELECT id, owner_id, message, last_user_id, sent, failed "
+            "FROM broadcasts WHERE status='running' ORDER BY id"
+        )
+        return await cur.fetchall()
+
+# ---------- TELETHON SESSION ----------
+@db_timed
+async def load_session(name: str):
+    """(state dict, [(id, hash, username, phone, name)]) of a stored session, or None."""
+    async with _get_pool().connection() as conn:
+        cur = await conn.execute("SELECT state FROM telethon_sessions WHERE name=%s", (name,))
+        row = await cur.fetchone()
+        if row is None:
+            return None
+        cur = await conn.execute(
+            "SELECT id, hash, username, phone, name FROM telethon_entities WHERE session=%s", (name,)
+        )
+        return row[0], await cur.fetchall()
+
+@db_timed
+async def save_session(name: str, state_json: str, rows):
+    """Store the session state and upsert changed entities in one transaction."""
+    async with _get_pool().connection() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                INSERT INTO telethon_sessions (name, state, updated_at) VALUES (%s, %s::jsonb, now())
+                ON CONFLICT (name) DO UPDATE SET state=EXCLUDED.state, updated_at=now()
+                """,
+                (name, state_json)
             )
-            rows = cur.fetchall()
-            return [r[0] for r in rows]
-
-def add_custom_location_db(chat_id: int, name: str):
-    name = name.strip()
-    if not name:
-        return False, "Name cannot be empty."
-    with _conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT 1 FROM locations WHERE chat_id=%s AND LOWER(location)=LOWER(%s)",
-                (chat_id, name)
+            if rows:
+                await conn.execute(
+                    """
+                    INSERT INTO telethon_entities (session, id, hash, username, phone, name)
+                    SELECT %s, i, h, u, p, n
+                    FROM unnest(%s::bigint[], %s::bigint[], %s::text[], %s::text[], %s::text[]) AS t(i, h, u, p, n)
+                    ON CONFLICT (session, id) DO UPDATE
+                    SET hash=EXCLUDED.hash, username=EXCLUDED.username, phone=EXCLUDED.phone, name=EXCLUDED.name
+                    """,
+                    (name, *([r[k] for r in rows] for k in range(5)))
+                )
+
+@db_timed
+async def delete_session(name: str):
+    async with _get_pool().connection() as conn:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM telethon_entities WHERE session=%s", (name,))
+            await conn.execute("DELETE FROM telethon_sessions WHERE name=%s", (name,))
+
+# ---------- GAME HISTORY + STATS ----------
+USER_STAT_COLUMNS = ("games", "wins", "spy_games", "spy_wins", "correct_guesses")
+CHAT_STAT_COLUMNS = ("games", "spy_wins", "civilian_wins", "correct_guesses", "total_seconds")
+
+@db_timed
+async def save_games(games_json: str, user_deltas, chat_deltas) -> list:
+    """Append finished games and add their counts to the aggregates, in one transaction.
+
+    ``games_json`` is a JSON array of game records; ``user_deltas`` is
+    [(user_id, *USER_STAT_COLUMNS)] and ``chat_deltas`` [(chat_id, *CHAT_STAT_COLUMNS)],
+    one row per id. Returns the new [(user_id, wins, games)] of every user touched.
+    """
+    async with _get_pool().connection() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                INSERT INTO games (chat_id, mode, location, winner, reason, guessed_by, roles, votes, started_at, ended_at)
+                SELECT chat_id, mode, location, winner, reason, guessed_by, roles, votes,
+                       to_timestamp(started_at), to_timestamp(ended_at)
+                FROM jsonb_to_recordset(%s::jsonb) AS g(
+                    chat_id bigint, mode text, location text, winner text, reason text, guessed_by bigint,
+                    roles jsonb, votes jsonb, started_at double precision, ended_at double precision)
+                """,
+                (games_json,)
             )
-            if cur.fetchone():
-                return False, "Already added."
-            cur.execute(
-                "INSERT INTO locations (chat_id, location) VALUES (%s, %s)",
-                (chat_id, name)
+            await conn.execute(
+                """
+                INSERT INTO chat_stats (chat_id, games, spy_wins, civilian_wins, correct_guesses, total_seconds)
+                SELECT * FROM unnest(%s::bigint[], %s::int[], %s::int[], %s::int[], %s::int[], %s::bigint[])
+                ON CONFLICT (chat_id) DO UPDATE SET
+                    games = chat_stats.games + EXCLUDED.games,
+                    spy_wins = chat_stats.spy_wins + EXCLUDED.spy_wins,
+                    civilian_wins = chat_stats.civilian_wins + EXCLUDED.civilian_wins,
+                    correct_guesses = chat_stats.correct_guesses + EXCLUDED.correct_guesses,
+                    total_seconds = chat_stats.total_seconds + EXCLUDED.total_seconds,
+                    updated_at = now()
+                """,
+                tuple([r[k] for r in chat_deltas] for k in range(6))
             )
-            return True, None
-
-def remove_custom_location_db(chat_id: int, name: str):
-    with _conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "DELETE FROM locations WHERE chat_id=%s AND LOWER(location)=LOWER(%s)",
-                (chat_id, name)
+            cur = await conn.execute(
+                """
+                INSERT INTO user_stats (user_id, games, wins, spy_games, spy_wins, correct_guesses)
+                SELECT * FROM unnest(%s::bigint[], %s::int[], %s::int[], %s::int[], %s::int[], %s::int[])
+                ON CONFLICT (user_id) DO UPDATE SET
+                    games = user_stats.games + EXCLUDED.games,
+                    wins = user_stats.wins + EXCLUDED.wins,
+                    spy_games = user_stats.spy_games + EXCLUDED.spy_games,
+                    spy_wins = user_stats.spy_wins + EXCLUDED.spy_wins,
+                    correct_guesses = user_stats.correct_guesses + EXCLUDED.correct_guesses,
+                    updated_at = now()
+                RETURNING user_id, wins, games
+                """,
+                tuple([r[k] for r in user_deltas] for k in range(6))
             )
-            ok = cur.rowcount > 0
-            return (ok, None if ok else "Not found among custom locations.")
+            return await cur.fetchall()
+
+@db_timed
+async def get_user_stats(user_id: int) -> Optional[dict]:
+    async with _get_pool().connection() as conn:
+        cur = await conn.execute(
+            f"SELECT {', '.join(USER_STAT_COLUMNS)} FROM user_stats WHERE user_id=%s", (user_id,)
+        )
+        row = await cur.fetchone()
+        return dict(zip(USER_STAT_COLUMNS, row)) if row else None
+
+@db_timed
+async def get_chat_stats(chat_id: int) -> Optional[dict]:
+    async with _get_pool().connection() as conn:
+        cur = await conn.execute(
+            f"SELECT {', '.join(CHAT_STAT_COLUMNS)} FROM chat_stats WHERE chat_id=%s", (chat_id,)
+        )
+        row = await cur.fetchone()
+        return dict(zip(CHAT_STAT_COLUMNS, row)) if row else None
+
+@db_timed
+async def get_top_players(limit: int) -> list:
+    """[(user_id, wins, games)] by wins, from the top of user_stats_wins_idx."""
+    async with _get_pool().connection() as conn:
+        cur = await conn.execute(
+            "SELECT user_id, wins, games FROM user_stats WHERE wins > 0 ORDER BY wins DESC, user_id LIMIT %s",
+            (limit,)
+        )
+        return await cur.fetchall()
+
+# ---------- GAME CHECKPOINTS ----------
+@db_timed
+async def save_game_checkpoints(upserts, deletes):
+    """Apply a batch of checkpoint writes in one transaction.
+
+    ``upserts`` is [(chat_id, state_json_text)], ``deletes`` is [chat_id].
+    """
+    async with _get_pool().connection() as conn:
+        async with conn.transaction():
+            if upserts:
+                await conn.execute(
+                    """
+                    INSERT INTO game_checkpoints (chat_id, state, updated_at)
+                    SELECT c, s::jsonb, now() FROM unnest(%s::bigint[], %s::text[]) AS t(c, s)
+                    ON CONFLICT (chat_id) DO UPDATE SET state=EXCLUDED.state, updated_at=now()
+                    """,
+                    ([c for c, _ in upserts], [st for _, st in upserts])
+                )
+            if deletes:
+                await conn.execute(
+                    "DELETE FROM game_checkpoints WHERE chat_id = ANY(%s)", (list(deletes),)
+                )
 
-def reset_custom_locations_db(chat_id: int):
-    with _conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute("DELETE FROM locations WHERE chat_id=%s", (chat_id,))
\ No newline at end of file
+@db_timed
+async def load_game_checkpoints():
+    """[(chat_id, state dict)] for every game that was running at the last checkpoint."""
+    async with _get_pool().connection() as conn:
+        cur = await conn.execute("SELECT chat_id, state FROM game_checkpoints")
+        return await cur.fetchall()
@@ -0,0 +1,82 @@
+import os
+import asyncio
+from typing import Dict, Iterable, List, NamedTuple
+from cache import LRUCache
+
+# ---- User entity / mention cache ----
+ENTITY_CACHE_TTL = float(os.environ.get("ENTITY_CACHE_TTL", 3600))   # seconds
+ENTITY_CACHE_MAX = int(os.environ.get("ENTITY_CACHE_MAX", 50_000))
+
+
+class CachedUser(NamedTuple):
+    """The parts of a Telegram user the game renders, with the mention pre-built."""
+    id: int
+    first_name: str
+    mention: str
+
+
+def mention_name(user):
+    return f"<a href='tg://user?id={user.id}'>{user.first_name}</a>"
+
+
+def _compact(user) -> CachedUser:
+    first = getattr(user, "first_name", None) or getattr(user, "title", None) or "Unknown"
+    light = CachedUser(user.id, first, "")
+    return light._replace(mention=mention_name(light))
+
+
+class EntityCache:
+    """TTL/LRU cache of resolved users, filled from incoming senders and
+    resolving misses in one batched ``get_entity`` call."""
+
+    def __init__(self, client, ttl: float = ENTITY_CACHE_TTL, max_items: int = ENTITY_CACHE_MAX):
+        self.client = client
+        self._cache = LRUCache(max_items=max_items, ttl=ttl)
+
+    def remember(self, user):
+        """Store a user object we already have (e.g. an event's sender); no API call."""
+        if user is not None and getattr(user, "id", None) is not None:
+            self._cache.set(user.id, _compact(user))
+
+    def peek(self, user_id: int):
+        return self._cache.get(user_id)
+
+    async def get(self, user_id: int) -> CachedUser:
+        return (await self.get_many([user_id]))[user_id]
+
+    async def get_many(self, user_ids: Iterable[int]) -> Dict[int, CachedUser]:
+        """Resolve every id; cache misses cost at most one batched request.
+
+        Users that cannot be resolved come back as an uncached "Unknown".
+        """
+        out: Dict[int, CachedUser] = {}
+        misses: List[int] = []
+        for uid in user_ids:
+            hit = self._cache.get(uid)
+            if hit is not None:
+                out[uid] = hit
+            elif uid not in out:
+                misses.append(uid)
+        misses = list(dict.fromkeys(misses))
+        if misses:
+            try:
+                resolved = await self.client.get_entity(misses)
+            except Exception:
+                # one bad id fails the whole batch; fall back to individual lookups
+                resolved = await asyncio.gather(
+                    *(self.client.get_entity(uid) for uid in misses), return_exceptions=True
+                )
+            for uid, ent in zip(misses, resolved):
+                if isinstance(ent, BaseException) or ent is None:
+                    out[uid] = CachedUser(uid, "Unknown", f"<a href='tg://user?id={uid}'>Unknown</a>")
+                else:
+                    self.remember(ent)
+                    out[uid] = self._cache.get(ent.id) or _compact(ent)
+        return out
+
+    async def mentions(self, user_ids: List[int]) -> List[str]:
+        users = await self.get_many(user_ids)
+        return [users[uid].mention for uid in user_ids]
+
+    def stats(self) -> dict:
+        return self._cache.stats()
@@ -0,0 +1,121 @@
+import os
+import time
+import asyncio
+from typing import Callable, Dict, Optional
+from metrics import Observed, metrics_handler
+
+# ---- Health endpoint + keep-alive (served from the bot's own event loop) ----
+HEALTH_PORT = int(os.environ.get("PORT", 10000))
+HEALTH_MAX_LAG = float(os.environ.get("HEALTH_MAX_LAG", 5.0))   # seconds of loop lag before reporting unhealthy
+KEEP_ALIVE_URL = os.environ.get("KEEP_ALIVE_URL", "https://spygame-bjok.onrender.com")
+KEEP_ALIVE_INTERVAL = 300   # seconds
+
+
+class LoopLagProbe:
+    """Wakes every ``interval`` and records how late it woke: the loop's scheduling lag."""
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag = max(loop.time() - expected, 0.0)
+            self.max_lag = max(self.max_lag, self.lag)
+
+
+lag_probe = LoopLagProbe()
+Observed("spygame_loop_lag_seconds", "Event loop lag at the last probe.", lambda: lag_probe.lag)
+
+
+class HealthServer:
+    """aiohttp app on the running loop: ``/`` and ``/health`` report liveness, ``/metrics`` the metrics.
+
+    ``checks`` maps a name to a callable returning ``(ok, details)``; the
+    response is 503 as soon as one check fails.
+    """
+
+    def __init__(self, checks: Dict[str, Callable[[], tuple]]):
+        self.checks = checks
+        self.started = time.time()
+        self._runner = None   # aiohttp AppRunner once started
+
+    def report(self) -> tuple:
+        ok = lag_probe.lag <= HEALTH_MAX_LAG
+        body = {
+            "uptime": round(time.time() - self.started),
+            "loop_lag_ms": round(lag_probe.lag * 1000, 1),
+            "loop_lag_max_ms": round(lag_probe.max_lag * 1000, 1),
+        }
+        for name, check in self.checks.items():
+            try:
+                passed, details = check()
+            except Exception as e:
+                passed, details = False, f"{type(e).__name__}: {e}"
+            ok = ok and passed
+            body[name] = details
+        body["status"] = "ok" if ok else "degraded"
+        return ok, body
+
+    async def _health(self, request):
+        from aiohttp import web
+        ok, body = self.report()
+        return web.json_response(body, status=200 if ok else 503)
+
+    async def start(self, port: int = HEALTH_PORT):
+        from aiohttp import web   # imported on first use, off the import path of main.py
+        lag_probe.start()
+        app = web.Application()
+        app.router.add_get("/", self._health)
+        app.router.add_get("/health", self._health)
+        app.router.add_get("/metrics", metrics_handler)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "0.0.0.0", port).start()
+
+    async def stop(self):
+        lag_probe.stop()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class KeepAlive:
+    """Pings the public URL so the host doesn't idle the service, over one reused session."""
+
+    def __init__(self, url: str = KEEP_ALIVE_URL, interval: float = KEEP_ALIVE_INTERVAL):
+        self.url = url
+        self.interval = interval
+        self._session = None   # one aiohttp ClientSession, created by run()
+
+    async def run(self):
+        import aiohttp
+        # one connector for the process lifetime: DNS, TCP and TLS are reused between pings
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        while True:
+            try:
+                async with self._session.get(self.url) as resp:
+                    await resp.read()
+                print("🌍 Keep-alive ping sent!")
+            except Exception as e:
+                print(f"⚠️ Keep-alive failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
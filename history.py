@@ -0,0 +1,122 @@
+import os
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+from batcher import WriteBehindQueue
+from state import GameState
+from db import save_games, get_top_players
+
+# ---- Game history + leaderboard ----
+HISTORY_FLUSH_BATCH = int(os.environ.get("HISTORY_FLUSH_BATCH", 200))
+HISTORY_FLUSH_DELAY = float(os.environ.get("HISTORY_FLUSH_DELAY", 2.0))
+LEADERBOARD_SIZE = 10
+LEADERBOARD_TTL = 300   # seconds before the top list is re-read (picks up other processes' games)
+
+SPY_TEAM = ("Spy",)   # everyone else ("Civilian", "Fake Civilian") plays for the civilians
+
+
+class TopK:
+    """The best ``size`` players by (wins, then lowest user id), kept current as games are written.
+
+    Wins only ever go up and every write returns the new totals of the
+    players it touched, so feeding those totals in keeps the list exact
+    without re-sorting user_stats. Games written by other processes only
+    show up on the next reload, at most ``ttl`` seconds later.
+    """
+
+    def __init__(self, size: int = LEADERBOARD_SIZE, ttl: float = LEADERBOARD_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._rows: Dict[int, Tuple[int, int]] = {}   # user_id -> (wins, games)
+        self._loaded_at: Optional[float] = None
+
+    def _trim(self):
+        if len(self._rows) > self.size:
+            keep = sorted(self._rows.items(), key=lambda r: (-r[1][0], r[0]))[:self.size]
+            self._rows = dict(keep)
+
+    def offer(self, totals):
+        """New (user_id, wins, games) totals straight from the database."""
+        if self._loaded_at is None:
+            return   # nothing to keep current yet; the first read loads the list
+        for user_id, wins, games in totals:
+            if wins > 0:
+                self._rows[user_id] = (wins, games)
+        self._trim()
+
+    async def get(self) -> List[Tuple[int, int, int]]:
+        """[(user_id, wins, games)], best first."""
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            rows = await get_top_players(self.size)
+            self._rows = {user_id: (wins, games) for user_id, wins, games in rows}
+            self._loaded_at = time.monotonic()
+        ranked = sorted(self._rows.items(), key=lambda r: (-r[1][0], r[0]))
+        return [(user_id, wins, games) for user_id, (wins, games) in ranked]
+
+
+leaderboard = TopK()
+
+
+def _deltas(records: List[dict]):
+    """Per-user and per-chat counts of a batch, one row per id (a statement can't touch a row twice)."""
+    users: Dict[int, List[int]] = {}   # user_id -> [games, wins, spy_games, spy_wins, correct_guesses]
+    chats: Dict[int, List[int]] = {}   # chat_id -> [games, spy_wins, civilian_wins, correct_guesses, seconds]
+    for g in records:
+        spy_won = g["winner"] == "spy"
+        guessed = g["reason"] == "guess"
+        for user_id, role in g["roles"].items():
+            spy = role in SPY_TEAM
+            row = users.setdefault(int(user_id), [0, 0, 0, 0, 0])
+            row[0] += 1
+            row[1] += spy == spy_won
+            row[2] += spy
+            row[3] += spy and spy_won
+            row[4] += guessed and g["guessed_by"] == int(user_id)
+        row = chats.setdefault(g["chat_id"], [0, 0, 0, 0, 0])
+        row[0] += 1
+        row[1] += spy_won
+        row[2] += not spy_won
+        row[3] += guessed
+        if g["started_at"]:
+            row[4] += max(0, int(g["ended_at"] - g["started_at"]))
+    return ([(uid, *c) for uid, c in users.items()], [(cid, *c) for cid, c in chats.items()])
+
+
+async def _flush(records: List[dict]):
+    user_deltas, chat_deltas = _deltas(records)
+    totals = await save_games(json.dumps(records), user_deltas, chat_deltas)
+    leaderboard.offer(totals)
+
+
+_writer = WriteBehindQueue(
+    _flush, max_batch=HISTORY_FLUSH_BATCH, max_delay=HISTORY_FLUSH_DELAY, name="history"
+)
+
+
+def record_game(chat_id: int, s: GameState, winner: str, reason: str, guessed_by: Optional[int] = None):
+    """Queue a finished game for the history table and the stats.
+
+    ``winner`` is "spy" or "civilians"; ``reason`` is "vote", "guess" or
+    "no_votes". Call before the game state is reset.
+    """
+    _writer.add({
+        "chat_id": chat_id,
+        "mode": s.game_mode,
+        "location": s.current_location,
+        "winner": winner,
+        "reason": reason,
+        "guessed_by": guessed_by,
+        "roles": {str(uid): role for uid, role in s.roles.items()},
+        "votes": {str(voter): target for voter, target in s.votes.items()},
+        "started_at": s.started_at,
+        "ended_at": time.time(),
+    })
+
+
+async def top_players() -> List[Tuple[int, int, int]]:
+    return await leaderboard.get()
+
+
+async def flush_history():
+    """Write pending games and stop the writer (call on shutdown)."""
+    await _writer.stop()
@@ -0,0 +1,325 @@
+import os
+import io
+import csv
+import heapq
+import bisect
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from cache import LRUCache
+from db import (
+    get_custom_locations_db, get_custom_locations_grouped,
+    add_custom_locations_db, remove_custom_location_db, reset_custom_locations_db
+)
+
+# ---- Locations (persistent, per-group) ----
+DEFAULT_LOCATIONS = [
+    "Hospital 🏥", "Airport ✈️", "Cinema 🎬", "Beach 🏖️", "School 🏫",
+    "Restaurant 🍽️", "Museum 🖼️", "Train Station 🚉", "Library 📚", "Park 🌳",
+    "Hotel 🏨", "Supermarket 🛒", "Bank 🏦", "Bus Station 🚌", "Church ⛪",
+    "Police Station 👮", "Fire Station 🚒", "Shopping Mall 🛍️", "Stadium 🏟️",
+    "Zoo 🦁", "Amusement Park 🎡", "Aquarium 🐠", "Factory 🏭", "Farm 🚜",
+    "Harbor ⚓", "Office 💼", "Post Office 📮", "Gas Station ⛽", "Theater 🎭",
+    "Bowling Alley 🎳", "Gym 🏋️", "Cafe ☕", "Casino 🎰", "Prison 🔒",
+    "Concert Hall 🎤", "Race Track 🏎️", "Mountain 🏔️", "Forest 🌲",
+    "Cave 🕳️", "Desert 🏜️", "Ice Rink ⛸️", "Volcano 🌋", "Bridge 🌉",
+    "Space Station 🛰️", "Castle 🏰", "Palace 👑", "Cemetery ⚰️",
+    "Underground Bunker 🛡️", "Laboratory 🔬", "Military Base 🎖️",
+    "Courtroom ⚖️", "Ship 🚢", "Submarine 🚤", "Jungle 🐒",
+    "Market Bazaar 🕌", "Village 🏘️"
+]
+
+# Shared by every chat that has no custom locations (never copied)
+DEFAULT_POOL: Tuple[str, ...] = tuple(DEFAULT_LOCATIONS)
+_DEFAULT_SET = frozenset(DEFAULT_LOCATIONS)
+
+LOCATION_CACHE_MAX_CHATS = int(os.environ.get("LOCATION_CACHE_MAX_CHATS", 5000))
+LOCATION_CACHE_MAX_BYTES = int(os.environ.get("LOCATION_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+
+# chat_id -> merged pool (defaults + customs), only for chats that have customs
+_pool_cache = LRUCache(max_items=LOCATION_CACHE_MAX_CHATS, max_bytes=LOCATION_CACHE_MAX_BYTES)
+# chats known to have at least one custom location (valid once warmed)
+_custom_chats: Set[int] = set()
+_warmed = False
+# called with the chat_id after a chat's custom locations change (sharded mode tells the front)
+_change_listeners: List[Callable[[int], None]] = []
+
+
+def _merge(custom) -> Tuple[str, ...]:
+    """Defaults first, then customs not already in the defaults (set lookup, not list scan)."""
+    extra = [loc for loc in custom if loc not in _DEFAULT_SET]
+    if not extra:
+        return DEFAULT_POOL
+    return DEFAULT_POOL + tuple(extra)
+
+
+async def warm_location_cache():
+    """Load every chat's custom locations with one grouped query (run at startup)."""
+    global _warmed
+    grouped = await get_custom_locations_grouped()
+    _custom_chats.clear()
+    _custom_chats.update(grouped)
+    for chat_id, custom in grouped.items():
+        _pool_cache.set(chat_id, _merge(custom))
+    _warmed = True
+    return len(grouped)
+
+
+async def build_locations_for_chat(chat_id: int) -> Tuple[str, ...]:
+    pool = _pool_cache.get(chat_id)
+    if pool is not None:
+        return pool
+    # after warm-up, a chat we never saw a custom location for uses the defaults
+    if _warmed and chat_id not in _custom_chats:
+        return DEFAULT_POOL
+    pool = _merge(await get_custom_locations_db(chat_id))
+    if pool is DEFAULT_POOL:
+        _custom_chats.discard(chat_id)
+    else:
+        _custom_chats.add(chat_id)
+        _pool_cache.set(chat_id, pool)
+    return pool
+
+
+def on_locations_changed(fn: Callable[[int], None]):
+    _change_listeners.append(fn)
+
+
+def _changed(chat_id: int):
+    for fn in _change_listeners:
+        fn(chat_id)
+
+
+def forget_chat_locations(chat_id: int):
+    """Another process changed this chat's customs: reload them from the DB on next use."""
+    _pool_cache.pop(chat_id)
+    _custom_chats.add(chat_id)   # until the reload says otherwise
+
+
+# ---- Write-through helpers (DB first, then cache) ----
+async def add_custom_location(chat_id: int, name: str):
+    # same path as an import of one name: checked against the pool (defaults included)
+    # ignoring case, and cached only if the insert returned it
+    name = name.strip()
+    if not name:
+        return False, "Name cannot be empty."
+    added, _ = await import_custom_locations(chat_id, [name])
+    if not added:
+        return False, "Already added."
+    return True, None
+
+
+async def import_custom_locations(chat_id: int, names: List[str]) -> Tuple[List[str], int]:
+    """Add many names with one statement; returns (added, skipped as already present)."""
+    pool = await build_locations_for_chat(chat_id)
+    present = {loc.lower() for loc in pool}
+    fresh = [name for name in names if name.lower() not in present]
+    if not fresh:
+        return [], len(names)
+    added = await add_custom_locations_db(chat_id, fresh)
+    if added:
+        _custom_chats.add(chat_id)
+        _pool_cache.set(chat_id, pool + tuple(added))
+        _changed(chat_id)
+    return added, len(names) - len(added)
+
+
+async def remove_custom_location(chat_id: int, name: str):
+    ok, err = await remove_custom_location_db(chat_id, name)
+    if ok:
+        # matched case-insensitively in the DB, so reload lazily on next use;
+        # the chat stays marked until that reload shows no customs are left
+        _pool_cache.pop(chat_id)
+        _changed(chat_id)
+    return ok, err
+
+
+async def reset_custom_locations(chat_id: int):
+    await reset_custom_locations_db(chat_id)
+    _pool_cache.pop(chat_id)
+    _custom_chats.discard(chat_id)
+    _changed(chat_id)
+
+
+# ---- Location files (/importlocations, /exportlocations) ----
+LOCATION_FILE_MAX_BYTES = 256 * 1024
+LOCATION_IMPORT_MAX = 1000   # names taken from one file
+LOCATION_NAME_MAX = 64       # characters
+_CSV_HEADERS = {"location", "locations", "name"}
+
+
+def parse_location_file(data: bytes, filename: str = "") -> Tuple[List[str], int]:
+    """Names from a text file (one per line) or CSV (first column); returns (names, rejected).
+
+    Names are trimmed and single-spaced; empty, overlong and case-insensitive
+    duplicate names are rejected, as is anything past LOCATION_IMPORT_MAX.
+    """
+    text = data.decode("utf-8-sig", errors="replace")
+    if filename.lower().endswith(".csv"):
+        cells = [row[0] if row else "" for row in csv.reader(io.StringIO(text))]
+        if cells and cells[0].strip().lower() in _CSV_HEADERS:
+            cells = cells[1:]
+    else:
+        cells = text.splitlines()
+    names, seen, rejected = [], set(), 0
+    for cell in cells:
+        name = " ".join(cell.split())
+        if not name:
+            continue
+        if len(name) > LOCATION_NAME_MAX or name.lower() in seen or len(names) >= LOCATION_IMPORT_MAX:
+            rejected += 1
+            continue
+        seen.add(name.lower())
+        names.append(name)
+    return names, rejected
+
+
+def export_location_file(pool) -> io.BytesIO:
+    """The pool as a UTF-8 text file (one per line), ready to re-import."""
+    buf = io.BytesIO(("\n".join(pool) + "\n").encode())
+    buf.name = "locations.txt"
+    return buf
+
+
+def location_cache_stats() -> dict:
+    return {**_pool_cache.stats(), "custom_chats": len(_custom_chats), "warmed": _warmed}
+
+
+# ---- Location index (/guess resolution + inline autocomplete) ----
+LOCATION_INDEX_MAX_CHATS = int(os.environ.get("LOCATION_INDEX_MAX_CHATS", 1000))
+GUESS_MIN_PREFIX = 3        # shortest guess resolved by a unique prefix
+GUESS_FUZZY_MIN = 0.6       # trigram similarity a typo'd guess needs to count
+SUGGEST_FUZZY_MIN = 0.3     # ... and to be offered as a suggestion
+
+_IGNORED_MARKS = {"\ufe0e", "\ufe0f"}   # emoji/text presentation selectors
+
+
+def normalize_location(name: str) -> str:
+    """Comparison key: emoji and punctuation dropped, casefolded, single-spaced.
+
+    "Hospital 🏥" -> "hospital", "  train-STATION " -> "train station".
+    """
+    chars = []
+    for ch in unicodedata.normalize("NFKC", name).casefold():
+        cat = unicodedata.category(ch)
+        if cat[0] in "LN" or (cat[0] == "M" and ch not in _IGNORED_MARKS):
+            chars.append(ch)
+        else:
+            chars.append(" ")
+    return " ".join("".join(chars).split())
+
+
+def _trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class LocationIndex:
+    """Normalized lookups over one chat's location pool.
+
+    Exact keys are a dict; prefixes (of the whole name or of any word in it)
+    are a bisect over sorted suffix keys; typos are scored by trigram overlap
+    (Dice coefficient) using per-trigram posting lists.
+    """
+
+    __slots__ = ("names", "_exact", "_suffixes", "_suffix_ids", "_grams", "_gram_counts")
+
+    def __init__(self, names):
+        self.names: Tuple[str, ...] = tuple(names)
+        self._exact: Dict[str, int] = {}
+        self._grams: Dict[str, List[int]] = defaultdict(list)
+        self._gram_counts: List[int] = []
+        suffixes = []
+        for i, name in enumerate(self.names):
+            key = normalize_location(name)
+            grams = _trigrams(key) if key and key not in self._exact else ()
+            self._gram_counts.append(len(grams))
+            if not grams:
+                continue   # empty or duplicate key: the first name keeps it
+            self._exact[key] = i
+            start = 0
+            for word in key.split(" "):
+                # (suffix, 0 for the whole name / 1 for a later word, id)
+                suffixes.append((key[start:], 1 if start else 0, i))
+                start += len(word) + 1
+            for gram in grams:
+                self._grams[gram].append(i)
+        suffixes.sort()
+        self._suffixes = [s for s, _, _ in suffixes]
+        self._suffix_ids = [(rank, i) for _, rank, i in suffixes]
+        self._grams = dict(self._grams)
+
+    def __len__(self):
+        return len(self._exact)
+
+    def _prefix_ids(self, key: str, limit: int) -> List[int]:
+        lo = bisect.bisect_left(self._suffixes, key)
+        hi = bisect.bisect_right(self._suffixes, key + "\U0010ffff", lo)
+        # whole-name matches before word matches, each in alphabetical order
+        ranked = sorted(range(lo, hi), key=lambda j: self._suffix_ids[j][0])
+        out: List[int] = []
+        for j in ranked:
+            i = self._suffix_ids[j][1]
+            if i not in out:
+                out.append(i)
+                if len(out) == limit:
+                    break
+        return out
+
+    def _fuzzy(self, key: str, limit: int) -> List[Tuple[float, int]]:
+        grams = _trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._grams.get(gram, ()))
+        n = len(grams)
+        return heapq.nlargest(limit, ((2 * c / (n + self._gram_counts[i]), -i) for i, c in shared.items()))
+
+    def resolve(self, guess: str) -> Optional[str]:
+        """The one location ``guess`` means, or None if unknown or ambiguous."""
+        key = normalize_location(guess)
+        if not key:
+            return None
+        i = self._exact.get(key)
+        if i is not None:
+            return self.names[i]
+        if len(key) >= GUESS_MIN_PREFIX:
+            ids = self._prefix_ids(key, 2)
+            if len(ids) == 1:
+                return self.names[ids[0]]
+            if ids:
+                return None   # several names start this way: don't pick one
+        best = self._fuzzy(key, 2)
+        if best and best[0][0] >= GUESS_FUZZY_MIN and (len(best) == 1 or best[1][0] < best[0][0]):
+            return self.names[-best[0][1]]
+        return None
+
+    def suggest(self, query: str, limit: int = 10) -> List[str]:
+        """Autocomplete: prefix matches first, then close spellings."""
+        key = normalize_location(query)
+        if not key:
+            return list(self.names[:limit])
+        ids = self._prefix_ids(key, limit)
+        if len(ids) < limit:
+            for score, neg in self._fuzzy(key, limit):
+                if score < SUGGEST_FUZZY_MIN or len(ids) == limit:
+                    break
+                if -neg not in ids:
+                    ids.append(-neg)
+        return [self.names[i] for i in ids]
+
+
+DEFAULT_INDEX = LocationIndex(DEFAULT_POOL)
+# chat_id -> (pool the index was built from, index); rebuilt when the pool changes
+_index_cache = LRUCache(max_items=LOCATION_INDEX_MAX_CHATS, sizeof=lambda v: 0)
+
+
+async def location_index_for_chat(chat_id: int) -> LocationIndex:
+    pool = await build_locations_for_chat(chat_id)
+    if pool is DEFAULT_POOL:
+        return DEFAULT_INDEX
+    cached = _index_cache.get(chat_id)
+    if cached is not None and cached[0] is pool:
+        return cached[1]
+    index = LocationIndex(pool)
+    _index_cache.set(chat_id, (pool, index))
+    return index
@@ -1,21 +1,40 @@
-from telethon import TelegramClient, events, Button
-from telethon.tl.types import ChannelParticipantsAdmins
-import random, asyncio, json, os
-from dataclasses import dataclass, field
-from typing import Optional, Dict
-import threading
-from flask import Flask
-from db import (
-    init_db,
-    add_user, get_all_users,
-    get_custom_locations_db,
-    add_custom_location_db, remove_custom_location_db, reset_custom_locations_db
+import time
+BOOT = time.perf_counter()   # startup phases are logged relative to this
+
+from telethon import TelegramClient, events, errors, Button
+import random, asyncio, json, os, math, html
+from typing import Dict
+from db import init_db, open_pool, close_pool, pool_stats, pool_health, get_user_stats, get_chat_stats
+from users import register_user, flush_users
+from broadcast import start_broadcast, resume_broadcasts, current_broadcast
+from entities import ENTITY_CACHE_MAX, EntityCache, mention_name
+from admins import AdminCache
+from timers import TimerScheduler
+from state import (
+    GameState, game_states, get_state, drop_state, sweep_states, state_memory,
+    record_vote, clear_votes
 )
+from checkpoint import save_state, forget_state, flush_checkpoints, restore_states
+from history import record_game, top_players, flush_history, LEADERBOARD_SIZE
+from ratelimit import Budget, KeyedRateLimiter
+from metrics import HANDLER_SECONDS, HANDLER_ERRORS, Observed, timed, instrument_client
+from health import HEALTH_PORT, HealthServer, KeepAlive
+from profiling import (
+    LOOP_BLOCK_THRESHOLD_MS, PROFILE_MAX_SECONDS, BlockWatchdog, SamplingProfiler, profile_memory
+)
+from shard import SHARD_WORKERS, SHARD_WORKER, ShardRouter, WorkerClient, shard_of
+from offline import BOT_OFFLINE, FakeClient
+from outbox import Outbox, URGENT, NOTICE
+from session import SESSION_BACKEND, CachedSession, PostgresStore, make_session
+from locations import (
+    build_locations_for_chat, warm_location_cache,
+    add_custom_location, remove_custom_location, reset_custom_locations, location_cache_stats,
+    import_custom_locations, parse_location_file, export_location_file, LOCATION_FILE_MAX_BYTES,
+    DEFAULT_INDEX, location_index_for_chat, normalize_location, on_locations_changed, forget_chat_locations
+)
+from cache import LRUCache
 
 
-# Initialize database tables
-init_db()
-
 # ---------------- CONFIG ----------------
 API_ID = int(os.environ.get("API_ID", 0))
 API_HASH = os.environ.get("API_HASH", "")
@@ -24,109 +43,121 @@ OWNER_ID = int(os.environ.get("OWNER_ID", 0))
 
 BOT_USERNAME = "agentamongus_bot"
 
-client = TelegramClient('game_bot', API_ID, API_HASH).start(bot_token=BOT_TOKEN)
-
-# ---- Per-Chat Game State ----
-@dataclass
-class GameState:
-    players: list = field(default_factory=list)
-    roles: dict = field(default_factory=dict)
-    votes: dict = field(default_factory=dict)
-    game_started: bool = False
-    discussion_time: int = 60
-    game_mode: Optional[str] = None
-    setup_state: Optional[str] = None
-    game_stage: str = "waiting"
-    game_starter: Optional[int] = None
-    current_location: Optional[str] = None
-    discussion_task: Optional[asyncio.Task] = None
-
-# chat_id -> GameState
-game_states: Dict[int, GameState] = {}
-
-def get_state(chat_id: int) -> GameState:
-    if chat_id not in game_states:
-        game_states[chat_id] = GameState()
-    return game_states[chat_id]
-
-
-# ---- Locations (persistent, per-group) ----
-DEFAULT_LOCATIONS = [
-    "Hospital 🏥", "Airport ✈️", "Cinema 🎬", "Beach 🏖️", "School 🏫",
-    "Restaurant 🍽️", "Museum 🖼️", "Train Station 🚉", "Library 📚", "Park 🌳",
-    "Hotel 🏨", "Supermarket 🛒", "Bank 🏦", "Bus Station 🚌", "Church ⛪",
-    "Police Station 👮", "Fire Station 🚒", "Shopping Mall 🛍️", "Stadium 🏟️",
-    "Zoo 🦁", "Amusement Park 🎡", "Aquarium 🐠", "Factory 🏭", "Farm 🚜",
-    "Harbor ⚓", "Office 💼", "Post Office 📮", "Gas Station ⛽", "Theater 🎭",
-    "Bowling Alley 🎳", "Gym 🏋️", "Cafe ☕", "Casino 🎰", "Prison 🔒",
-    "Concert Hall 🎤", "Race Track 🏎️", "Mountain 🏔️", "Forest 🌲",
-    "Cave 🕳️", "Desert 🏜️", "Ice Rink ⛸️", "Volcano 🌋", "Bridge 🌉",
-    "Space Station 🛰️", "Castle 🏰", "Palace 👑", "Cemetery ⚰️",
-    "Underground Bunker 🛡️", "Laboratory 🔬", "Military Base 🎖️",
-    "Courtroom ⚖️", "Ship 🚢", "Submarine 🚤", "Jungle 🐒",
-    "Market Bazaar 🕌", "Village 🏘️"
-]
-
-
-def build_locations_for_chat(chat_id: int):
-    base = DEFAULT_LOCATIONS.copy()
-    custom = get_custom_locations_db(chat_id)
-    for loc in custom:
-        if loc not in base:
-            base.append(loc)
-    return base
-
-
+if SHARD_WORKER:
+    # shard worker process: API calls are executed by the front process
+    client = WorkerClient()
+elif BOT_OFFLINE:
+    # no Telegram at all: the caller (e.g. bench/loadtest.py) feeds events to the handlers
+    client = FakeClient()
+else:
+    # connected and authorized in startup(), not at import; session storage per SESSION_BACKEND
+    client = TelegramClient(make_session(), API_ID, API_HASH)
+
+# time send_message/edit_message/get_entity/get_participants (respond() included)
+instrument_client(client)
+
+# Every send_message (respond()/reply() included) is queued per chat, rate-limited
+# and prioritised; a shard worker's sends go through the front process's outbox
+outbox = Outbox(client).install() if not SHARD_WORKER else None
+
+# Front process of sharded mode: forwards updates to SHARD_WORKERS processes
+shard_router = ShardRouter(client, SHARD_WORKERS) if SHARD_WORKERS and not SHARD_WORKER else None
+
+# Resolved users + pre-rendered mentions (filled from incoming senders)
+entity_cache = EntityCache(client)
+
+# Admin sets per chat (invalidated by admin/membership updates)
+admin_cache = AdminCache(client)
+if shard_router:
+    # rosters live in the workers; tell the owning worker to drop its copy
+    admin_cache.register(client, on_change=lambda chat_id: shard_router.control(chat_id, "invalidate_admins", chat_id))
+else:
+    admin_cache.register(client)
 
 # ---- Anti-Spam / Throttling ----
 COMMAND_COOLDOWN = 1.5   # seconds between command presses per user
 BUTTON_COOLDOWN  = 0.75  # seconds between inline button taps per user
 
-_user_cooldowns_cmd = {}
-_user_cooldowns_cb  = {}
+# per-command overrides of the default one-press-per-cooldown budget
+COMMAND_BUDGETS = {
+    "startgame": Budget(burst=1, interval=5.0),
+    "begin": Budget(burst=1, interval=5.0),
+    "join": Budget(burst=2, interval=COMMAND_COOLDOWN),
+    "broadcast": Budget(burst=1, interval=10.0),
+}
 
-def _now():
-    # monotonic clock via event loop
-    return asyncio.get_event_loop().time()
+# keyed by (command, (chat_id, user_id)); idle entries expire on their own
+command_limiter = KeyedRateLimiter(Budget(1, COMMAND_COOLDOWN), COMMAND_BUDGETS)
+button_limiter = KeyedRateLimiter(Budget(1, BUTTON_COOLDOWN))
 
-async def throttle(event, key: str, cooldown: float = COMMAND_COOLDOWN, reply=True):
+async def throttle(event, key: str, reply=True):
     """Return True if user is throttled (and already notified)."""
-    uid = event.sender_id
-    k = (getattr(event, "chat_id", None), uid, key)
-    last = _user_cooldowns_cmd.get(k, 0)
-    t = _now()
-    if t - last < cooldown:
-        if reply:
-            try:
-                await event.respond("⚠️ Slow down a bit.")
-            except:
-                pass
-        return True
-    _user_cooldowns_cmd[k] = t
-    return False
-
-async def throttle_cb(event, key: str, cooldown: float = BUTTON_COOLDOWN):
-    """Throttle inline button taps."""
-    uid = event.sender_id
-    k = (getattr(event, "chat_id", None), uid, key)
-    last = _user_cooldowns_cb.get(k, 0)
-    t = _now()
-    if t - last < cooldown:
+    if command_limiter.hit(key, (getattr(event, "chat_id", None), event.sender_id)):
+        return False
+    if reply:
         try:
-            await event.answer("⏳ Easy there…", alert=False)
+            await event.respond("⚠️ Slow down a bit.", priority=NOTICE, coalesce=True)
         except:
             pass
-        return True
-    _user_cooldowns_cb[k] = t
-    return False
-
+    return True
 
-def mention_name(user):
-    return f"<a href='tg://user?id={user.id}'>{user.first_name}</a>"
+async def throttle_cb(event, key: str):
+    """Throttle inline button taps."""
+    if button_limiter.hit(key, (getattr(event, "chat_id", None), event.sender_id)):
+        return False
+    try:
+        await event.answer("⏳ Easy there…", alert=False)
+    except:
+        pass
+    return True
 
 
 # ---------------- HANDLERS ----------------
-@client.on(events.NewMessage(pattern=fr"^/start(@{BOT_USERNAME})?$"))
+# ---- Command router ----
+# name -> (handler, accepts arguments)
+COMMANDS = {}
+
+def command(name: str, args: bool = False):
+    """Register a /command handler with the front dispatcher."""
+    def register(fn):
+        COMMANDS[name] = (timed(HANDLER_SECONDS, name, HANDLER_ERRORS)(fn), args)
+        return fn
+    return register
+
+
+@client.on(events.NewMessage(incoming=True))
+async def dispatch(event):
+    """Single entry point for messages: parse the command once, look it up, run it."""
+    if first_update_pending:
+        note_first_update()
+    if shard_router:
+        # only commands and possible minute answers are worth the hop to a worker
+        if event.raw_text.startswith("/") or _is_int(event.raw_text):
+            shard_router.forward(event)
+        return
+
+    # sender arrives with the update, so caching it costs no API call
+    entity_cache.remember(event.sender)
+
+    text = event.raw_text
+    if text.startswith("/"):
+        head, sep, _ = text.partition(" ")
+        name, at, target = head[1:].partition("@")
+        if at and target.lower() != BOT_USERNAME.lower():
+            return   # addressed to another bot
+        entry = COMMANDS.get(name)
+        if entry is not None and (entry[1] or not sep):
+            await entry[0](event)
+        return
+
+    # plain chatter only matters while this chat waits for a setup answer;
+    # look it up without creating state for chats that never played
+    s = game_states.get(event.chat_id)
+    if s is not None and s.setup_state == "waiting_time":
+        await catch_minutes(event, s)
+
+
+@command("start")
 async def start_cmd(event):
     if await throttle(event, 'start'): return
     if event.is_private:
@@ -165,12 +196,11 @@ async def start_cmd(event):
         )
         await event.respond(text, parse_mode="markdown")
 
-    # Save user id (persistent in Postgres)
-    uid = event.sender_id
-    await asyncio.to_thread(add_user, uid)
+    # Save user id (queued, written to Postgres in batches)
+    register_user(event.sender_id)
 
 
-@client.on(events.NewMessage(pattern=fr"^/startgame(@{BOT_USERNAME})?$"))
+@command("startgame")
 async def start_game(event):
     if await throttle(event, 'startgame'): return
     s = get_state(event.chat_id)
@@ -180,7 +210,7 @@ async def start_game(event):
 
     s.players.clear()
     s.roles.clear()
-    s.votes.clear()
+    clear_votes(s)
     s.game_started = True
     s.game_mode = None
     s.setup_state = "waiting_time"
@@ -188,10 +218,10 @@ async def start_game(event):
     s.game_stage = "joining"
     s.current_location = None
     s.discussion_time = 60
-    if s.discussion_task:
-        try: s.discussion_task.cancel()
-        except: pass
-        s.discussion_task = None
+    s.discussion_end = None
+    s.voting_end = None
+    timers.cancel_chat(event.chat_id)
+    save_state(event.chat_id, s)
 
     await event.respond(
         "🎮 New Spy x Civilian Game Started!\n\n"
@@ -200,7 +230,7 @@ async def start_game(event):
     )
 
 
-@client.on(events.NewMessage(pattern=fr"^/help(@{BOT_USERNAME})?$"))
+@command("help")
 async def help_cmd(event):
     if await throttle(event, 'help'): return
     text = (
@@ -215,6 +245,8 @@ async def help_cmd(event):
         "/remove @username - Remove a player (admins/host only)\n"
         "/stopgame - Force end the game (admins/host only)\n"
         "/rules - Show game rules\n"
+        "/stats - Your stats (and this group's)\n"
+        "/leaderboard - Top players by wins\n"
         "\n"
         "🧭 **Custom Locations** (per group):\n"
         "/addlocation <name> - Add a custom location (admins only)\n"
@@ -226,7 +258,7 @@ async def help_cmd(event):
     await event.respond(text, parse_mode="markdown")
 
 
-@client.on(events.NewMessage(pattern=fr"^/rules(@{BOT_USERNAME})?$"))
+@command("rules")
 async def rules_cmd(event):
     if await throttle(event, 'rules'): return
     rules = (
@@ -242,7 +274,7 @@ async def rules_cmd(event):
     await event.respond(rules, parse_mode="markdown")
 
 
-@client.on(events.NewMessage(pattern=fr'^/addlocation(@{BOT_USERNAME})?($| )'))
+@command("addlocation", args=True)
 async def addlocation_cmd(event):
     # Anti-spam
     if await throttle(event, 'addlocation'): return
@@ -257,13 +289,13 @@ async def addlocation_cmd(event):
         await event.respond("⚠️ Usage: /addlocation <name>")
         return
 
-    ok, err = add_custom_location_db(event.chat_id, args[1].strip())
+    ok, err = await add_custom_location(event.chat_id, args[1].strip())
     if ok:
         await event.respond(f"✅ Added location: *{args[1].strip()}*", parse_mode="markdown")
     else:
         await event.respond(f"⚠️ {err}")
 
-@client.on(events.NewMessage(pattern=fr'^/removelocation(@{BOT_USERNAME})?($| )'))
+@command("removelocation", args=True)
 async def removelocation_cmd(event):
     if await throttle(event, 'removelocation'): return
 
@@ -276,17 +308,17 @@ async def removelocation_cmd(event):
         await event.respond("⚠️ Usage: /removelocation <name>")
         return
 
-    ok, err = remove_custom_location_db(event.chat_id, args[1].strip())
+    ok, err = await remove_custom_location(event.chat_id, args[1].strip())
     if ok:
         await event.respond(f"✅ Removed location: *{args[1].strip()}*", parse_mode="markdown")
     else:
         await event.respond(f"⚠️ {err}")
 
-@client.on(events.NewMessage(pattern=fr"^/listlocations(@{BOT_USERNAME})?$"))
+@command("listlocations")
 async def listlocations_cmd(event):
     if await throttle(event, 'listlocations'): return
 
-    pool = build_locations_for_chat(event.chat_id)
+    pool = await build_locations_for_chat(event.chat_id)
     if not pool:
         await event.respond("ℹ️ No locations available.")
         return
@@ -294,7 +326,7 @@ async def listlocations_cmd(event):
     out = "🧭 **Locations for this chat:**\n" + "\n".join(f"• {x}" for x in pool)
     await event.respond(out, parse_mode="markdown")
 
-@client.on(events.NewMessage(pattern=fr"^/resetlocations(@{BOT_USERNAME})?$"))
+@command("resetlocations")
 async def resetlocations_cmd(event):
     if await throttle(event, 'resetlocations'): return
 
@@ -302,14 +334,67 @@ async def resetlocations_cmd(event):
         await event.respond("❌ Only group admins can reset custom locations.")
         return
 
-    reset_custom_locations_db(event.chat_id)
+    await reset_custom_locations(event.chat_id)
     await event.respond("♻️ Custom locations cleared for this chat. Using defaults now.")
 
 
-# Catch minutes when setup_state == waiting_time
-@client.on(events.NewMessage)
-async def catch_minutes(event):
-    s = get_state(event.chat_id)
+async def _document_message(event):
+    """The message holding the file: this one (file + caption) or the one it replies to."""
+    msg = event.message
+    if not msg.document and msg.is_reply:
+        msg = await event.get_reply_message()
+    return msg if msg is not None and msg.document else None
+
+@command("importlocations", args=True)
+async def importlocations_cmd(event):
+    if await throttle(event, 'importlocations'): return
+
+    if not (await is_admin(event, event.sender_id)):
+        await event.respond("❌ Only group admins can import locations.")
+        return
+
+    msg = await _document_message(event)
+    if msg is None:
+        await event.respond("⚠️ Send a .txt (one location per line) or .csv file with the caption "
+                            "/importlocations, or reply to such a file with /importlocations.")
+        return
+    if (msg.file.size or 0) > LOCATION_FILE_MAX_BYTES:
+        await event.respond(f"⚠️ File is too large (max {LOCATION_FILE_MAX_BYTES // 1024} KB).")
+        return
+
+    data = await client.download_media(msg, file=bytes)
+    names, rejected = parse_location_file(data, msg.file.name or "")
+    if not names:
+        await event.respond("⚠️ No locations found in that file.")
+        return
+
+    added, present = await import_custom_locations(event.chat_id, names)
+    text = f"✅ Imported {len(added)} location(s)."
+    if present:
+        text += f"\n↩️ {present} already in this chat's list."
+    if rejected:
+        text += f"\n🚫 {rejected} skipped (empty, duplicate, too long or over the limit)."
+    await event.respond(text)
+
+@command("exportlocations")
+async def exportlocations_cmd(event):
+    if await throttle(event, 'exportlocations'): return
+
+    pool = await build_locations_for_chat(event.chat_id)
+    await client.send_file(event.chat_id, export_location_file(pool),
+                           caption=f"🧭 {len(pool)} locations for this chat")
+
+
+def _is_int(text: str) -> bool:
+    try:
+        int(text)
+        return True
+    except ValueError:
+        return False
+
+
+# Catch minutes when setup_state == waiting_time (called by the dispatcher)
+async def catch_minutes(event, s: GameState):
     if s.setup_state == "waiting_time":
         try:
             minutes = int(event.raw_text.strip())
@@ -321,6 +406,7 @@ async def catch_minutes(event):
 
             s.discussion_time = minutes * 60
             s.setup_state = "waiting_mode"
+            save_state(event.chat_id, s)
             await event.respond(
                 f"✅ Discussion time set to {minutes} minutes!\n\nNow choose Game Mode:",
                 buttons=[
@@ -335,7 +421,14 @@ async def catch_minutes(event):
 
 
 @client.on(events.CallbackQuery)
+@timed(HANDLER_SECONDS, "callback", HANDLER_ERRORS)
 async def callback_handler(event):
+    if first_update_pending:
+        note_first_update()
+    if shard_router:
+        shard_router.forward(event)
+        return
+    entity_cache.remember(event.sender)
     if await throttle_cb(event, 'cb'): return
     s = get_state(event.chat_id)
     data = event.data.decode()
@@ -357,6 +450,7 @@ async def callback_handler(event):
             s.game_mode = "Chaos"
 
         s.setup_state = None
+        save_state(event.chat_id, s)
         await event.edit(f"🎮 Game Mode selected: {s.game_mode}\n\n"
                          "Players can now join using /join.\n"
                          "When ready, use /begin to start.")
@@ -366,48 +460,133 @@ async def callback_handler(event):
         voter = event.sender_id
         vote_for = int(data.split(":", 1)[1])
 
-        if voter in s.votes:
+        if s.game_stage != "voting":
+            await event.answer("⚠️ Voting is closed.", alert=True)
+            return
+        if not record_vote(s, voter, vote_for):
             await event.answer("⚠️ You already voted!", alert=True)
             return
 
-        s.votes[voter] = vote_for
+        save_state(event.chat_id, s)
         await event.answer("✅ Vote registered!")
 
         # If all voted
-        if len(s.votes) == len(s.players):
-            await finish_voting(event)
+        if len(s.votes) >= len(s.players):
+            await finish_voting(event.chat_id)
+        else:
+            touch_tally(event.chat_id)
 
 
-@client.on(events.NewMessage(pattern=fr"^/join(@{BOT_USERNAME})?$"))
+@command("join")
 async def join_game(event):
     if await throttle(event, 'join'): return
     s = get_state(event.chat_id)
     if not s.game_started:
         await event.respond("❌ No active game! Start with /startgame")
         return
+    if s.game_stage != "joining":
+        # includes /begin sending the role DMs: the player list is fixed by then
+        await event.respond("❌ This game has already begun. Join the next one!")
+        return
     if event.sender_id in s.players:
-        await event.respond("⚠️ You already joined!")
+        await event.respond("⚠️ You already joined!", priority=NOTICE, coalesce=True)
     else:
         s.players.append(event.sender_id)
+        player_chats.set(event.sender_id, event.chat_id)
+        if SHARD_WORKER:
+            client.notify("player_chat", event.sender_id, event.chat_id)   # the front answers inline queries
+        save_state(event.chat_id, s)
         await event.respond(
-            f"✅ {mention_name(await client.get_entity(event.sender_id))} joined the game!",
+            f"✅ {(await entity_cache.get(event.sender_id)).mention} joined the game!",
             parse_mode="html"
         )
 
 
-@client.on(events.NewMessage(pattern=fr"^/players(@{BOT_USERNAME})?$"))
+@command("players")
 async def players_cmd(event):
     if await throttle(event, 'players'): return
     s = get_state(event.chat_id)
     if not s.players:
         await event.respond("⚠️ No players have joined yet.")
     else:
-        entities = [await client.get_entity(p) for p in s.players]
-        names = [f"- {mention_name(e)}" for e in entities]
+        names = [f"- {m}" for m in await entity_cache.mentions(s.players)]
         await event.respond("👥 Current Players:\n" + "\n".join(names), parse_mode="html")
 
 
-@client.on(events.NewMessage(pattern=fr"^/begin(@{BOT_USERNAME})?$"))
+# ---- Stats ----
+def _rate(part: int, whole: int) -> str:
+    return f"{100 * part / whole:.0f}%" if whole else "–"
+
+
+@command("stats")
+async def stats_cmd(event):
+    if await throttle(event, 'stats'): return
+    # read from the user_stats / chat_stats aggregates: one primary-key lookup each
+    mine = await get_user_stats(event.sender_id)
+    if mine:
+        text = (
+            "📊 **Your stats**\n"
+            f"🎮 Games: {mine['games']}\n"
+            f"🏆 Wins: {mine['wins']} ({_rate(mine['wins'], mine['games'])})\n"
+            f"🕵️ As Spy: {mine['spy_games']} games, {mine['spy_wins']} won ({_rate(mine['spy_wins'], mine['spy_games'])})\n"
+            f"🎯 Correct guesses: {mine['correct_guesses']}"
+        )
+    else:
+        text = "📊 You haven't finished a game yet."
+    if not event.is_private:
+        chat = await get_chat_stats(event.chat_id)
+        if chat:
+            avg = chat['total_seconds'] // chat['games']
+            text += (
+                "\n\n👥 **This group**\n"
+                f"🎮 Games: {chat['games']}\n"
+                f"🕵️ Spy wins: {chat['spy_wins']} ({_rate(chat['spy_wins'], chat['games'])})\n"
+                f"👥 Civilian wins: {chat['civilian_wins']}\n"
+                f"🎯 Correct guesses: {chat['correct_guesses']}\n"
+                f"⏱️ Average game: {avg // 60}:{avg % 60:02d} minutes"
+            )
+    await event.respond(text, parse_mode="markdown")
+
+
+@command("leaderboard")
+async def leaderboard_cmd(event):
+    if await throttle(event, 'leaderboard'): return
+    top = await top_players()
+    if not top:
+        await event.respond("🏆 No games have been finished yet.")
+        return
+    names = await entity_cache.mentions([user_id for user_id, _, _ in top])
+    lines = [f"{i}. {name} - {wins} wins / {games} games"
+             for i, (name, (_, wins, games)) in enumerate(zip(names, top), 1)]
+    await event.respond(f"🏆 Top {LEADERBOARD_SIZE} players:\n" + "\n".join(lines), parse_mode="html")
+
+
+# ---- Role DMs ----
+ROLE_DM_CONCURRENCY = int(os.environ.get("ROLE_DM_CONCURRENCY", 10))   # DMs in flight per /begin
+ROLE_DM_MAX_FLOOD_WAIT = 10   # longest FloodWait (seconds) worth waiting out before giving up
+
+
+async def send_role_dms(messages: Dict[int, str]) -> list:
+    """Send every player their role concurrently; return the players that could not be reached."""
+    # bounded per /begin, so one big game can't take every outbox slot
+    sem = asyncio.Semaphore(ROLE_DM_CONCURRENCY)
+
+    async def deliver(pid, text):
+        # urgent: queued ahead of everything else; the outbox waits out short FloodWaits
+        async with sem:
+            try:
+                await client.send_message(pid, text, parse_mode="markdown",
+                                          priority=URGENT, max_wait=ROLE_DM_MAX_FLOOD_WAIT)
+                return True
+            except Exception:
+                return False
+
+    pids = list(messages)
+    results = await asyncio.gather(*(deliver(pid, messages[pid]) for pid in pids))
+    return [pid for pid, ok in zip(pids, results) if not ok]
+
+
+@command("begin")
 async def begin_game(event):
     if await throttle(event, 'begin'): return
     s = get_state(event.chat_id)
@@ -419,7 +598,7 @@ async def begin_game(event):
         await event.respond("⚠️ Need at least 3 players to start!")
         return
 
-    loc_pool = build_locations_for_chat(event.chat_id)
+    loc_pool = await build_locations_for_chat(event.chat_id)
     location = random.choice(loc_pool)
     spy_list = []
     fake_civilian = None
@@ -439,54 +618,43 @@ async def begin_game(event):
         if random.choice([True, False]):
             fake_civilian = random.choice([p for p in s.players if p not in spy_list])
 
-    # Step 1: test-send role messages (without committing)
-    failed = []
+    # Step 1: build every role message, then test-send them all at once (without committing)
     temp_roles = {}
+    messages = {}
     for p in s.players:
-        try:
-            if p in spy_list:
-                msg = (
-                    "🕵️‍♂️ **Secret Role Assigned!**\n\n"
-                    "You are the *SPY* 😈\n"
-                    "❓ Your mission: Blend in, ask smart questions, and try to *guess the location*.\n\n"
-                    "🗣️ Be careful… if they find you, civilians win!"
-                )
-                await client.send_message(p, msg, parse_mode="markdown")
-                temp_roles[p] = "Spy"
-
-            elif fake_civilian == p:
-                wrong_location = random.choice([loc for loc in loc_pool if loc != location])
-                msg = (
-                    "👥 **Secret Role Assigned!**\n\n"
-                    "You are a **Civilian** 🙌\n"
-                    f"📍 The secret location is: **{wrong_location}**\n\n"
-                    "🎯 Your mission: Spot the Spy by asking tricky questions and defending yourself."
-                )
-                await client.send_message(p, msg, parse_mode="markdown")
-                temp_roles[p] = "Fake Civilian"
+        if p in spy_list:
+            messages[p] = (
+                "🕵️‍♂️ **Secret Role Assigned!**\n\n"
+                "You are the *SPY* 😈\n"
+                "❓ Your mission: Blend in, ask smart questions, and try to *guess the location*.\n\n"
+                "🗣️ Be careful… if they find you, civilians win!"
+            )
+            temp_roles[p] = "Spy"
+
+        elif fake_civilian == p:
+            wrong_location = random.choice([loc for loc in loc_pool if loc != location])
+            messages[p] = (
+                "👥 **Secret Role Assigned!**\n\n"
+                "You are a **Civilian** 🙌\n"
+                f"📍 The secret location is: **{wrong_location}**\n\n"
+                "🎯 Your mission: Spot the Spy by asking tricky questions and defending yourself."
+            )
+            temp_roles[p] = "Fake Civilian"
 
-            else:
-                msg = (
-                    "👥 **Secret Role Assigned!**\n\n"
-                    "You are a **Civilian** 🙌\n"
-                    f"📍 The secret location is: **{location}**\n\n"
-                    "🎯 Your mission: Spot the Spy by asking tricky questions and defending yourself."
-                )
-                await client.send_message(p, msg, parse_mode="markdown")
-                temp_roles[p] = "Civilian"
-
-        except Exception:
-            failed.append(p)
+        else:
+            messages[p] = (
+                "👥 **Secret Role Assigned!**\n\n"
+                "You are a **Civilian** 🙌\n"
+                f"📍 The secret location is: **{location}**\n\n"
+                "🎯 Your mission: Spot the Spy by asking tricky questions and defending yourself."
+            )
+            temp_roles[p] = "Civilian"
+
+    failed = await send_role_dms(messages)
 
     # Step 2: if failed → abort and reset only this chat
     if failed:
-        names = []
-        for pid in failed:
-            try:
-                ent = await client.get_entity(pid)
-                names.append(f"- {mention_name(ent)}")
-            except:
-                names.append(f"- <a href='tg://user?id={pid}'>Unknown</a>")
+        names = [f"- {m}" for m in await entity_cache.mentions(failed)]
 
         await event.respond(
             "⚠️ The following players must /start the bot in PM before the game can begin:\n" +
@@ -509,32 +677,15 @@ async def begin_game(event):
         parse_mode="markdown"
     )
 
-    # Start per-chat discussion timer
-    async def discussion_timer():
-        while s.discussion_time > 0 and s.game_stage == "discussion":
-            await asyncio.sleep(1)
-            s.discussion_time -= 1
-            if s.discussion_time % 60 == 0 and s.discussion_time > 0:
-                await event.respond(f"⏳ {s.discussion_time // 60} minutes left for discussion!")
-
-        if s.game_stage == "discussion":  # time up -> voting
-            buttons = [
-                [Button.inline(f"Vote {(await client.get_entity(p)).first_name}", data=f"vote:{p}".encode())]
-                for p in s.players
-            ]
-            await event.respond("🗳️ Discussion ended! Voting starts now (2 minutes):", buttons=buttons)
-            s.game_stage = "voting"
-            await asyncio.sleep(120)
-            await finish_voting(event)
-
-    # cancel old task if any, then create
-    if s.discussion_task:
-        try: s.discussion_task.cancel()
-        except: pass
-    s.discussion_task = asyncio.create_task(discussion_timer())
-
-
-@client.on(events.NewMessage(pattern=fr"^/status(@{BOT_USERNAME})?$"))
+    # Arm this chat's countdown on the shared scheduler
+    timers.cancel_chat(event.chat_id)
+    s.started_at = time.time()
+    s.discussion_end = s.started_at + s.discussion_time
+    schedule_discussion(event.chat_id, s)
+    save_state(event.chat_id, s)
+
+
+@command("status")
 async def status_cmd(event):
     if await throttle(event, 'status'): return
     s = get_state(event.chat_id)
@@ -542,8 +693,7 @@ async def status_cmd(event):
         await event.respond("⚠️ No active game.")
         return
 
-    entities = [await client.get_entity(p) for p in s.players]
-    names = [mention_name(e) for e in entities]
+    names = await entity_cache.mentions(s.players)
     await event.respond(
         f"📊 Game Status:\n"
         f"Mode: {s.game_mode}\n"
@@ -554,18 +704,25 @@ async def status_cmd(event):
     )
 
 
-@client.on(events.NewMessage(pattern=fr"^/extend(@{BOT_USERNAME})?$"))
+@command("extend")
 async def extend_cmd(event):
     if await throttle(event, 'extend'): return
     s = get_state(event.chat_id)
     if s.game_stage != "discussion":
         await event.respond("❌ You can only extend time during discussion phase.")
         return
-    s.discussion_time += 60
-    await event.respond(f"⏳ Discussion extended by 1 minute! (Now {s.discussion_time//60}:{s.discussion_time%60:02d} remaining)")
+    if s.discussion_end is None:
+        # /begin is still sending role DMs; the countdown starts once they're out
+        await event.respond("⏳ Roles are still being assigned, try again in a moment.")
+        return
+    s.discussion_end += 60
+    schedule_discussion(event.chat_id, s)
+    save_state(event.chat_id, s)
+    left = discussion_left(s)
+    await event.respond(f"⏳ Discussion extended by 1 minute! (Now {left//60}:{left%60:02d} remaining)")
 
 
-@client.on(events.NewMessage(pattern=fr'^/guess(@{BOT_USERNAME})?($| )'))
+@command("guess", args=True)
 async def guess_cmd(event):
     if await throttle(event, 'guess'): return
     s = get_state(event.chat_id)
@@ -583,51 +740,172 @@ async def guess_cmd(event):
         await event.respond("⚠️ Usage: /guess <location>")
         return
 
-    guess = args[1].strip().lower()
-    correct_location = (s.current_location or "").lower()
+    # emoji, case and small typos don't matter; unknown/ambiguous guesses cost nothing
+    index = await location_index_for_chat(event.chat_id)
+    resolved = index.resolve(args[1])
+    correct = resolved == s.current_location or (
+        normalize_location(args[1]) == normalize_location(s.current_location or "")
+    )
+    if resolved is None and not correct:
+        hints = index.suggest(args[1], 3)
+        if hints:
+            await event.respond(f"❓ Which location do you mean? {', '.join(hints)}")
+        else:
+            await event.respond("❓ I don't know that location.")
+        return
 
-    if guess == correct_location:
+    if correct:
         await event.respond(f"🎉 Spy guessed the location correctly ({s.current_location})!\nSpy wins! 🕵️")
+        record_game(event.chat_id, s, "spy", "guess", guessed_by=user_id)
         await reset_game(event.chat_id)
     else:
         await event.respond("❌ Wrong guess! Game continues...")
 
 
-async def finish_voting(event):
-    s = get_state(event.chat_id)
-    if s.game_stage == "finished":
+# ---- Inline autocomplete (@bot <text> -> "/guess <location>") ----
+INLINE_RESULTS = 20
+# user -> chat they last joined a game in (inline queries don't say which chat they come from)
+player_chats = LRUCache(max_items=ENTITY_CACHE_MAX)
+if shard_router:
+    # inline queries reach the front, but /join and location edits run in the workers
+    shard_router.on_notice("player_chat", player_chats.set)
+    shard_router.on_notice("locations_changed", forget_chat_locations)
+elif SHARD_WORKER:
+    on_locations_changed(lambda chat_id: client.notify("locations_changed", chat_id))
+
+
+@client.on(events.InlineQuery)
+@timed(HANDLER_SECONDS, "inline", HANDLER_ERRORS)
+async def inline_handler(event):
+    chat_id = player_chats.get(event.sender_id)
+    index = await location_index_for_chat(chat_id) if chat_id is not None else DEFAULT_INDEX
+    builder = event.builder
+    await event.answer(
+        [builder.article(title=name, text=f"/guess {name}") for name in index.suggest(event.text, INLINE_RESULTS)],
+        cache_time=0, private=True
+    )
+
+
+# ---- Discussion / voting timers ----
+VOTING_TIME = 120   # seconds
+TALLY_DEBOUNCE = float(os.environ.get("TALLY_DEBOUNCE", 2.0))   # seconds between live tally edits
+
+# every chat's countdowns live on this one scheduler
+timers = TimerScheduler()
+
+
+def discussion_left(s: GameState) -> int:
+    if s.discussion_end is None:
+        return s.discussion_time
+    return max(round(s.discussion_end - time.time()), 0)
+
+
+def schedule_discussion(chat_id: int, s: GameState):
+    """(Re)arm discussion end and the next whole-minute warning from s.discussion_end."""
+    timers.schedule(chat_id, "discussion_end", s.discussion_end, end_discussion, chat_id)
+    minutes = math.ceil((s.discussion_end - time.time()) / 60) - 1
+    if minutes >= 1:
+        timers.schedule(chat_id, "minute", s.discussion_end - minutes * 60, announce_minutes, chat_id, minutes)
+    else:
+        timers.cancel(chat_id, "minute")
+
+
+async def announce_minutes(chat_id: int, minutes: int):
+    s = game_states.get(chat_id)
+    if s is None or s.game_stage != "discussion":
+        return
+    if minutes > 1:
+        timers.schedule(chat_id, "minute", s.discussion_end - (minutes - 1) * 60,
+                        announce_minutes, chat_id, minutes - 1)
+    await client.send_message(chat_id, f"⏳ {minutes} minutes left for discussion!")
+
+
+async def end_discussion(chat_id: int):
+    s = game_states.get(chat_id)
+    if s is None or s.game_stage != "discussion":
+        return
+    users = await entity_cache.get_many(s.players)
+    msg = await client.send_message(chat_id, tally_text(s, users), buttons=vote_buttons(s, users), priority=URGENT)
+    if game_states.get(chat_id) is not s:
+        return   # game was stopped while the prompt was being sent
+    s.game_stage = "voting"
+    s.tally_msg_id = msg.id
+    s.voting_end = time.time() + VOTING_TIME
+    timers.schedule(chat_id, "voting_end", s.voting_end, finish_voting, chat_id)
+    save_state(chat_id, s)
+
+
+def vote_buttons(s: GameState, users) -> list:
+    return [
+        [Button.inline(f"Vote {users[p].first_name}", data=f"vote:{p}".encode())]
+        for p in s.players
+    ]
+
+
+def tally_text(s: GameState, users) -> str:
+    text = "🗳️ Discussion ended! Voting starts now (2 minutes):"
+    if not s.tally:
+        return text
+    # most votes first; equal counts keep the order they were first voted for
+    lines = [
+        f"{'👑' if target == s.leader else '•'} {users[target].first_name} — {n}"
+        for target, n in sorted(s.tally.items(), key=lambda kv: -kv[1])
+    ]
+    return text + f"\n\n📊 Votes so far ({len(s.votes)}/{len(s.players)}):\n" + "\n".join(lines)
+
+
+def touch_tally(chat_id: int):
+    """Queue a live tally edit; taps within TALLY_DEBOUNCE share one edit."""
+    if timers.deadline(chat_id, "tally") is None:
+        timers.schedule(chat_id, "tally", time.time() + TALLY_DEBOUNCE, refresh_tally, chat_id)
+
+
+async def refresh_tally(chat_id: int):
+    s = game_states.get(chat_id)
+    if s is None or s.game_stage != "voting" or s.tally_msg_id is None:
+        return
+    users = await entity_cache.get_many([*s.players, *s.tally])
+    try:
+        await client.edit_message(chat_id, s.tally_msg_id, tally_text(s, users), buttons=vote_buttons(s, users))
+    except errors.MessageNotModifiedError:
+        pass
+
+
+async def finish_voting(chat_id: int):
+    # a deadline or last vote landing just after a reset must not conjure up a game
+    s = game_states.get(chat_id)
+    if s is None or s.game_stage != "voting":
         return
     s.game_stage = "finished"
+    timers.cancel(chat_id, "tally")
 
     if not s.votes:
-        await event.respond("⚠️ No votes were cast. Spy wins by default 😈")
-        await reset_game(event.chat_id)
+        await client.send_message(chat_id, "⚠️ No votes were cast. Spy wins by default 😈")
+        record_game(chat_id, s, "spy", "no_votes")
+        await reset_game(chat_id)
         return
 
-    # Count votes
-    counts = {}
-    for v in s.votes.values():
-        counts[v] = counts.get(v, 0) + 1
-    accused = max(counts, key=counts.get)
+    # counted as the votes came in; ties go to the first target to reach the top count
+    accused = s.leader
 
-    accused_ent = await client.get_entity(accused)
-    accused_name = mention_name(accused_ent)
+    # one lookup for everyone involved (players, plus anyone removed mid-vote)
+    player_entities = await entity_cache.get_many([*s.players, *s.votes, *s.votes.values()])
+    accused_name = player_entities[accused].mention
 
-    player_entities = {p: await client.get_entity(p) for p in s.players}
-    civilians = [mention_name(ent) for pid, ent in player_entities.items() if s.roles.get(pid) == "Civilian"]
-    spies = [mention_name(ent) for pid, ent in player_entities.items() if s.roles.get(pid) == "Spy"]
-    fake_civilians = [mention_name(ent) for pid, ent in player_entities.items() if s.roles.get(pid) == "Fake Civilian"]
+    civilians = [player_entities[pid].mention for pid in s.players if s.roles.get(pid) == "Civilian"]
+    spies = [player_entities[pid].mention for pid in s.players if s.roles.get(pid) == "Spy"]
+    fake_civilians = [player_entities[pid].mention for pid in s.players if s.roles.get(pid) == "Fake Civilian"]
 
     breakdown = []
     for voter, target in s.votes.items():
-        voter_name = mention_name(player_entities[voter])
-        target_name = mention_name(player_entities[target])
+        voter_name = player_entities[voter].mention
+        target_name = player_entities[target].mention
         breakdown.append(f"{voter_name} ➝ {target_name}")
 
     if s.roles.get(accused) == "Spy":
         result = (
             f"🎉 Civilians win!\n"
-            f"🕵️ Spy was {mention_name(player_entities[accused])}\n\n"
+            f"🕵️ Spy was {accused_name}\n\n"
             f"👥 Civilians: {', '.join(civilians)}"
         )
     else:
@@ -644,23 +922,17 @@ async def finish_voting(event):
     if breakdown:
         result += "\n\n🗳️ *Voting Breakdown:*\n" + "\n".join(breakdown)
 
-    await event.respond(result, parse_mode="html")
-    await reset_game(event.chat_id)
+    await client.send_message(chat_id, result, parse_mode="html")
+    record_game(chat_id, s, "civilians" if s.roles.get(accused) == "Spy" else "spy", "vote")
+    await reset_game(chat_id)
 
 
 async def is_admin(event, user_id):
-    participants = await event.client.get_participants(
-        event.chat_id,
-        filter=ChannelParticipantsAdmins
-    )
-    admin_ids = [p.id for p in participants]
+    # cached per chat; refreshed on TTL expiry or when admins change
+    return await admin_cache.is_admin(event, user_id)
 
-    chat = await event.get_chat()
-    # check if user is in admins or is group creator
-    return user_id in admin_ids or getattr(chat, "creator", False)
 
-
-@client.on(events.NewMessage(pattern=fr"^/stopgame(@{BOT_USERNAME})?$"))
+@command("stopgame")
 async def stop_game(event):
     if await throttle(event, 'stopgame'): return
     s = get_state(event.chat_id)
@@ -675,7 +947,7 @@ async def stop_game(event):
         await event.respond("❌ Only group admins or game starter can stop the game.")
 
 
-@client.on(events.NewMessage(pattern=fr'^/remove(@{BOT_USERNAME})?($| )'))
+@command("remove", args=True)
 async def remove_cmd(event):
     if await throttle(event, 'remove'): return
     s = get_state(event.chat_id)
@@ -691,8 +963,10 @@ async def remove_cmd(event):
 
     try:
         entity = await client.get_entity(target)
+        entity_cache.remember(entity)
         if entity.id in s.players:
             s.players.remove(entity.id)
+            save_state(event.chat_id, s)
             await event.respond(f"🚫 {mention_name(entity)} has been removed from the game.", parse_mode="html")
         else:
             await event.respond("⚠️ That user is not in the game.")
@@ -700,7 +974,7 @@ async def remove_cmd(event):
         await event.respond("❌ Could not find that user.")
 
 
-@client.on(events.NewMessage(pattern='/broadcast'))
+@command("broadcast", args=True)
 async def broadcast_cmd(event):
     if await throttle(event, 'broadcast'): return
 
@@ -714,69 +988,343 @@ async def broadcast_cmd(event):
         await event.respond("⚠️ Usage: /broadcast <message>")
         return
 
-    msg = args[1].strip()
-    sent = 0
-    failed = 0
+    running = current_broadcast()
+    if running:
+        await event.respond("⚠️ A broadcast is already running:\n\n" + running.report())
+        return
 
-    user_ids = await asyncio.to_thread(get_all_users)
-    for uid in user_ids:
-        try:
-            await client.send_message(uid, msg)
-            sent += 1
-            await asyncio.sleep(0.1)  # small delay, avoid flood
-        except:
-            failed += 1
+    # Runs in the background; progress is posted (and edited) in the owner's PM
+    await start_broadcast(client, OWNER_ID, args[1].strip())
 
-    await event.respond(f"✅ Broadcast complete!\n📨 Sent: {sent}\n❌ Failed: {failed}")
 
+@command("stopbroadcast")
+async def stopbroadcast_cmd(event):
+    if await throttle(event, 'stopbroadcast'): return
+    if event.sender_id != OWNER_ID:
+        await event.respond("❌ Only the bot owner can use this command.")
+        return
 
-async def reset_game(chat_id: int):
-    s = get_state(chat_id)
-    if s.discussion_task:
-        try:
-            s.discussion_task.cancel()
-        except:
-            pass
-        s.discussion_task = None
+    running = current_broadcast()
+    if not running:
+        await event.respond("ℹ️ No broadcast is running.")
+        return
+    running.stop()
+    await event.respond("🛑 Stopping broadcast after messages already in flight…")
+
+
+@command("timers")
+async def timers_cmd(event):
+    if await throttle(event, 'timers'): return
+    if event.sender_id != OWNER_ID:
+        await event.respond("❌ Only the bot owner can use this command.")
+        return
 
-    # Re-initialize only this chat's state
-    game_states[chat_id] = GameState()
+    pending = timers.snapshot()
+    lines = [f"⏱️ Pending timers: {len(pending)} (fired so far: {timers.fired})"]
+    lines += [f"• chat {cid} · {name} · in {left:.0f}s" for left, cid, name in pending[:20]]
+    if len(pending) > 20:
+        lines.append(f"… and {len(pending) - 20} more")
+    await event.respond("\n".join(lines))
 
 
-# ---------------- FLASK KEEP-ALIVE + MAIN LOOP ----------------
-import multiprocessing, asyncio
-import aiohttp
-from flask import Flask
+@command("memory")
+async def memory_cmd(event):
+    if await throttle(event, 'memory'): return
+    if event.sender_id != OWNER_ID:
+        await event.respond("❌ Only the bot owner can use this command.")
+        return
+
+    m = state_memory()
+    await event.respond(
+        f"🧠 Game states: {m['chats']} ({m['active']} active)\n"
+        f"📦 ~{m['bytes'] / 1024:.1f} KiB total, ~{m['bytes_per_chat']} B per chat"
+    )
+
+
+# ---- Diagnostics (owner only; nothing runs until asked) ----
+cpu_profiler = None          # the SamplingProfiler of a running /profile
+memory_profiling = False
+_diagnostics = set()         # report tasks still running
 
-# Dummy Flask app for Render health-check
-app = Flask(__name__)
 
-@app.route('/')
-def home():
-    return "Bot is running!"
+def _diagnostic_window(event, default: int = 30) -> int:
+    arg = event.raw_text.partition(" ")[2].strip()
+    seconds = int(arg) if arg.isdigit() else default
+    return max(1, min(seconds, PROFILE_MAX_SECONDS))
 
-def run_web():
-    # Run flask on separate process (not thread, avoids asyncio loop conflicts)
-    app.run(host="0.0.0.0", port=10000)
 
-async def keep_alive():
-    """Periodically ping the Render URL to prevent sleeping"""
-    while True:
+def _run_diagnostic(coro):
+    """Run a report in the background (handlers return at once) and DM it to the owner."""
+    async def deliver():
         try:
-            async with aiohttp.ClientSession() as session:
-                await session.get("https://spygame-bjok.onrender.com")
-                print("🌍 Keep-alive ping sent!")
+            report = await coro
         except Exception as e:
-            print(f"⚠️ Keep-alive failed: {e}")
-        await asyncio.sleep(300)  # every 5 minutes
+            report = f"⚠️ Diagnostics failed: {e}"
+        await client.send_message(OWNER_ID, f"<pre>{html.escape(report)}</pre>", parse_mode="html")
+    task = asyncio.ensure_future(deliver())
+    _diagnostics.add(task)
+    task.add_done_callback(_diagnostics.discard)
 
-if __name__ == "__main__":
-    # Run Flask in separate process
-    multiprocessing.Process(target=run_web, daemon=True).start()
 
-    # Start keep-alive inside Telethon loop
-    client.loop.create_task(keep_alive())
+@command("profile", args=True)
+async def profile_cmd(event):
+    global cpu_profiler
+    if await throttle(event, 'profile'): return
+    if event.sender_id != OWNER_ID:
+        await event.respond("❌ Only the bot owner can use this command.")
+        return
+
+    if event.raw_text.partition(" ")[2].strip().lower() == "stop":
+        if cpu_profiler is None:
+            await event.respond("ℹ️ No profile is running.")
+        else:
+            cpu_profiler.stop()
+            await event.respond("🛑 Profiler stopped, report on its way.")
+        return
+    if cpu_profiler is not None:
+        await event.respond("⚠️ A profile is already running. Use /profile stop")
+        return
+
+    seconds = _diagnostic_window(event)
+    profiler = cpu_profiler = SamplingProfiler()
+
+    async def run():
+        global cpu_profiler
+        try:
+            return await profiler.run(seconds)
+        finally:
+            cpu_profiler = None
+
+    _run_diagnostic(run())
+    await event.respond(f"🔬 Sampling the event loop for {seconds}s; the report will arrive in DM.")
+
+
+@command("memprofile", args=True)
+async def memprofile_cmd(event):
+    global memory_profiling
+    if await throttle(event, 'memprofile'): return
+    if event.sender_id != OWNER_ID:
+        await event.respond("❌ Only the bot owner can use this command.")
+        return
+    if memory_profiling:
+        await event.respond("⚠️ A memory trace is already running.")
+        return
+
+    seconds = _diagnostic_window(event)
+    memory_profiling = True
+
+    async def run():
+        global memory_profiling
+        try:
+            return await profile_memory(seconds)
+        finally:
+            memory_profiling = False
+
+    _run_diagnostic(run())
+    await event.respond(f"🧪 Tracing allocations for {seconds}s; the report will arrive in DM.")
+
+
+def start_watchdog():
+    # logs the loop's stack when it's blocked longer than LOOP_BLOCK_THRESHOLD_MS
+    if LOOP_BLOCK_THRESHOLD_MS:
+        BlockWatchdog(LOOP_BLOCK_THRESHOLD_MS / 1000).start()
+
+
+async def reset_game(chat_id: int):
+    timers.cancel_chat(chat_id)
+
+    # Forget only this chat's state; the next game command starts a fresh one
+    drop_state(chat_id)
+    forget_state(chat_id)
+
+
+async def restore_games(owns=None):
+    """Bring back games that were running before a restart and rearm their timers."""
+    restored = await restore_states(owns)
+    for chat_id, s in restored:
+        if s.game_stage == "discussion" and s.discussion_end is None:
+            # checkpointed while /begin was still sending role DMs
+            if s.roles:
+                s.discussion_end = time.time() + s.discussion_time
+                schedule_discussion(chat_id, s)
+            else:
+                # nobody has a committed role: back to the lobby, with the same players
+                s.game_stage = "joining"
+                s.current_location = None
+                try:
+                    await client.send_message(chat_id, "⚠️ The bot restarted while assigning roles. Send /begin again.")
+                except Exception as e:
+                    print(f"⚠️ Could not notify chat {chat_id}: {e}")
+            save_state(chat_id, s)
+        elif s.game_stage == "discussion":
+            schedule_discussion(chat_id, s)   # overdue deadlines fire right away
+        elif s.game_stage == "voting" and s.voting_end is not None:
+            timers.schedule(chat_id, "voting_end", s.voting_end, finish_voting, chat_id)
+            touch_tally(chat_id)
+    if restored:
+        print(f"♻️ Restored {len(restored)} game(s) from checkpoints")
+
+
+# ---- Metrics gauges (read at scrape time) ----
+Observed("spygame_active_games", "Chats with a game in progress.",
+         lambda: sum(s.game_started for s in game_states.values()))
+Observed("spygame_players", "Players in games in progress.",
+         lambda: sum(len(s.players) for s in game_states.values() if s.game_started))
+Observed("spygame_game_states", "Chats with game state in memory.", lambda: len(game_states))
+Observed("spygame_pending_timers", "Discussion/voting timers waiting to fire.", lambda: len(timers))
+Observed("spygame_throttled_total", "Presses rejected by the rate limiters.",
+         lambda: [((name,), lim.stats()["throttled"]) for name, lim in
+                  (("command", command_limiter), ("button", button_limiter))],
+         labels=("limiter",), kind="counter")
+def _cache_stats():
+    return {"entity": entity_cache.stats(), "admin": admin_cache.stats(), "location": location_cache_stats()}
+
+Observed("spygame_cache_hits_total", "Cache hits.",
+         lambda: [((name,), st["hits"]) for name, st in _cache_stats().items()],
+         labels=("cache",), kind="counter")
+Observed("spygame_cache_misses_total", "Cache misses.",
+         lambda: [((name,), st["misses"]) for name, st in _cache_stats().items()],
+         labels=("cache",), kind="counter")
+if outbox:
+    Observed("spygame_outbox", "Outbox state (lanes, queued, sent, failed, coalesced, flood_waits).",
+             lambda: [((k,), v) for k, v in outbox.stats().items()], labels=("stat",))
+Observed("spygame_db_pool", "Connection pool state (psycopg_pool get_stats()).",
+         lambda: [((k,), v) for k, v in pool_stats().items() if k.startswith("pool_") or k == "requests_waiting"],
+         labels=("stat",))
+
+
+# ---------------- HEALTH + MAIN LOOP ----------------
+def telegram_health() -> tuple:
+    connected = client.is_connected()
+    return connected, {"connected": connected}
+
+
+def health_checks() -> dict:
+    checks = {"telegram": telegram_health, "db": pool_health}
+    if shard_router:
+        checks["shards"] = shard_router.health
+    return checks
+
+
+# ---- Startup ----
+first_update_pending = True
+
+
+def note_first_update():
+    global first_update_pending
+    first_update_pending = False
+    print(f"⏱️ first update after {(time.perf_counter() - BOOT) * 1000:.0f} ms")
+
+
+async def phase(name: str, aw):
+    """Await ``aw`` and log how long the startup phase took."""
+    start = time.perf_counter()
+    result = await aw
+    print(f"⏱️ {name}: {(time.perf_counter() - start) * 1000:.0f} ms")
+    return result
+
+
+async def startup(health: HealthServer):
+    """Bring the front process up: Telegram connects while the DB migrates and caches fill."""
+    print(f"⏱️ imports: {(time.perf_counter() - BOOT) * 1000:.0f} ms")
+    await health.start(HEALTH_PORT)
+    start_watchdog()
+
+    migrated = asyncio.ensure_future(phase("db pool + migrations", init_db()))
+
+    async def prepare_db():
+        applied = await migrated
+        if applied:
+            print(f"🗄️ Applied schema migrations {applied}")
+        if not shard_router:
+            # Preload every chat's location pool so /begin never waits on Postgres
+            await phase("location cache", warm_location_cache())
+
+    async def login():
+        session = client.session
+        if isinstance(session, CachedSession):
+            if isinstance(session.store, PostgresStore):
+                await migrated   # the session lives in the telethon_* tables
+            entities = await phase(f"session load ({SESSION_BACKEND})", session.load())
+            session.restore_into(client)   # the client was built with the session still empty
+            print(f"🔑 Session restored with {entities} entities")
+        await phase("telegram login", client.start(bot_token=BOT_TOKEN))
+
+    await asyncio.gather(login(), prepare_db())
+
+    if shard_router:
+        # game state lives in the workers; this process only talks to Telegram
+        shard_router.start(run_shard_worker)
+        print(f"🧩 Started {SHARD_WORKERS} shard workers")
+    else:
+        await phase("restore games", start_game_services())
+    print(f"🚀 Ready after {(time.perf_counter() - BOOT) * 1000:.0f} ms")
+
+
+async def start_game_services(owns=None, resume_broadcast=True):
+    """Restore checkpointed games, start the idle sweeper and resume a broadcast."""
+    # Resume games that were running when the last process stopped
+    await restore_games(owns)
+
+    # Drop state of chats that have gone quiet (and checkpoints of abandoned lobbies)
+    asyncio.get_running_loop().create_task(sweep_states(forget_state))
+
+    # Pick up a broadcast that was interrupted by the last restart
+    if resume_broadcast:
+        asyncio.get_running_loop().create_task(resume_broadcasts(client))
+
+
+async def stop_game_services():
+    await flush_users()
+    await flush_checkpoints()
+    await flush_history()
+    await close_pool()
+
+
+def run_shard_worker(index: int, count: int, conn):
+    """Entry point of a shard worker process: owns the chats with shard_of(chat_id) == index."""
+    def owns(chat_id):
+        return shard_of(chat_id, count) == index
+
+    async def on_event(event):
+        if event.kind == "callback":
+            await callback_handler(event)
+        else:
+            await dispatch(event)
+
+    async def run():
+        client.attach(conn, on_event, {"invalidate_admins": admin_cache.invalidate})
+        # each worker reports its own loop, pool and metrics next to the front's port
+        health = HealthServer(health_checks())
+        await health.start(HEALTH_PORT + 1 + index)
+        start_watchdog()
+        await phase(f"shard {index}: db pool", open_pool())
+        await phase(f"shard {index}: location cache", warm_location_cache())
+        # /broadcast runs in the worker that owns the owner's private chat
+        await phase(f"shard {index}: restore games", start_game_services(owns, resume_broadcast=owns(OWNER_ID)))
+        client.ready()
+        await client.wait_stopped()
+        await stop_game_services()
+        await health.stop()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    # Health/metrics server and keep-alive pings share Telethon's loop
+    health = HealthServer(health_checks())
+    keep_alive = KeepAlive()
+    client.loop.run_until_complete(startup(health))
+    client.loop.create_task(keep_alive.run())
 
     # Run bot (manages its own event loop)
-    print("🤖 Connecting bot...")
-    client.run_until_disconnected()
\ No newline at end of file
+    print("🤖 Bot is running")
+    try:
+        client.run_until_disconnected()
+    finally:
+        if shard_router:
+            shard_router.stop()
+        client.loop.run_until_complete(stop_game_services())
+        client.loop.run_until_complete(outbox.stop())
+        client.loop.run_until_complete(keep_alive.close())
+        client.loop.run_until_complete(health.stop())
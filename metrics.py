@@ -0,0 +1,187 @@
+import time
+import bisect
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# ---- Metrics (Prometheus text exposition) ----
+# seconds; Telegram round trips sit around 50-300 ms, FloodWaits far above
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# every metric, in registration order
+REGISTRY: List["_Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names: Tuple[str, ...], values: tuple, le: str = None) -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if le is not None:
+        parts.append(f'le="{le}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        REGISTRY.append(self)
+
+    def samples(self) -> Iterable[str]:
+        return ()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, v in self._values.items():
+            yield f"{self.name}{_fmt_labels(self.labels, labels)} {_fmt_value(v)}"
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; ``observe`` is a bisect and three additions."""
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels) -> "_Timer":
+        """``with hist.time(label):`` — also fine around ``await``."""
+        return _Timer(self, labels)
+
+    def samples(self):
+        for labels, (counts, total, n) in self._series.items():
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                yield f"{self.name}_bucket{_fmt_labels(self.labels, labels, bound)} {cumulative}"
+            yield f"{self.name}_bucket{_fmt_labels(self.labels, labels, '+Inf')} {n}"
+            yield f"{self.name}_sum{_fmt_labels(self.labels, labels)} {_fmt_value(total)}"
+            yield f"{self.name}_count{_fmt_labels(self.labels, labels)} {n}"
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "start")
+
+    def __init__(self, hist: Histogram, labels: tuple):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Observed(_Metric):
+    """A value read from elsewhere at scrape time (sizes, existing stats counters).
+
+    ``fn`` returns a number, or [(label values, number)] when ``labels`` is set.
+    """
+
+    def __init__(self, name, help, fn: Callable, labels=(), kind: str = "gauge"):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self.fn = fn
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        if not self.labels:
+            yield f"{self.name} {_fmt_value(value)}"
+            return
+        for labels, v in value:
+            yield f"{self.name}{_fmt_labels(self.labels, labels)} {_fmt_value(v)}"
+
+
+def render() -> str:
+    return "\n".join(m.render() for m in REGISTRY) + "\n"
+
+
+# ---- Shared instruments ----
+HANDLER_SECONDS = Histogram("spygame_handler_seconds", "Time spent in a command/button handler.", ("command",))
+HANDLER_ERRORS = Counter("spygame_handler_errors_total", "Handlers that raised.", ("command",))
+API_SECONDS = Histogram("spygame_api_seconds", "Telegram API call latency.", ("method",))
+API_ERRORS = Counter("spygame_api_errors_total", "Telegram API calls that raised.", ("method", "error"))
+DB_SECONDS = Histogram("spygame_db_seconds", "Database query latency.", ("query",))
+DB_ERRORS = Counter("spygame_db_errors_total", "Database queries that raised.", ("query",))
+
+
+def timed(hist: Histogram, label: str, errors: Counter = None, error_labels: bool = False):
+    """Decorate a coroutine function so every call is observed in ``hist``."""
+    def wrap(fn):
+        @wraps(fn)
+        async def inner(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                if errors is not None:
+                    if error_labels:
+                        errors.inc(label, type(e).__name__)
+                    else:
+                        errors.inc(label)
+                raise
+            finally:
+                hist.observe(time.perf_counter() - start, label)
+        return inner
+    return wrap
+
+
+def db_timed(fn):
+    return timed(DB_SECONDS, fn.__name__, DB_ERRORS)(fn)
+
+
+# event.respond()/reply() go through client.send_message, so they land under send_message
+API_METHODS = ("send_message", "edit_message", "send_file", "get_entity", "get_participants")
+
+def instrument_client(client, methods: Tuple[str, ...] = API_METHODS):
+    """Time the client's API methods (patched on this instance only)."""
+    for name in methods:
+        setattr(client, name, timed(API_SECONDS, name, API_ERRORS, error_labels=True)(getattr(client, name)))
+    return client
+
+
+# ---- Serving ----
+async def metrics_handler(request):
+    from aiohttp import web
+    return web.Response(body=render().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
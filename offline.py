@@ -0,0 +1,136 @@
+import os
+import asyncio
+import itertools
+from types import SimpleNamespace
+from typing import Optional
+
+# ---- Offline mode ----
+# BOT_OFFLINE=1 swaps the Telegram client for FakeClient, so main.py can be
+# imported and its handlers driven without an account or network
+# (see bench/loadtest.py).
+BOT_OFFLINE = os.environ.get("BOT_OFFLINE") == "1"
+
+
+def fake_user(user_id: int) -> SimpleNamespace:
+    return SimpleNamespace(id=user_id, first_name=f"User{user_id}", title=None, username=None, creator=False)
+
+
+class FakeClient:
+    """Answers the TelegramClient calls the bot makes, locally.
+
+    ``latency`` adds a simulated round trip to every call; counters record
+    how many calls of each kind the handlers made. ``on_send``, if set, is
+    called with (entity, text) for every message sent.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.on_send = None
+        self._ids = itertools.count(1)
+        self.sent = 0
+        self.edited = 0
+        self.answered = 0
+        self.lookups = 0
+
+    def on(self, *args, **kwargs):
+        # handlers are called directly by whoever feeds events
+        return lambda fn: fn
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def _round_trip(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send_message(self, entity, message="", **kwargs):
+        await self._round_trip()
+        self.sent += 1
+        if self.on_send:
+            self.on_send(entity, message)
+        return SimpleNamespace(id=next(self._ids), chat_id=entity, text=message)
+
+    async def edit_message(self, entity, message, text=None, **kwargs):
+        await self._round_trip()
+        self.edited += 1
+        return SimpleNamespace(id=getattr(message, "id", message), chat_id=entity, text=text)
+
+    async def get_entity(self, entity):
+        await self._round_trip()
+        self.lookups += 1
+        if isinstance(entity, list):
+            return [fake_user(e) for e in entity]
+        if isinstance(entity, int):
+            return fake_user(entity)
+        raise ValueError(f'No user has "{entity}" as username')
+
+    async def send_file(self, entity, file, **kwargs):
+        await self._round_trip()
+        self.sent += 1
+        return SimpleNamespace(id=next(self._ids), chat_id=entity, file=file)
+
+    async def download_media(self, message, file=bytes):
+        await self._round_trip()
+        return getattr(message, "data", b"")
+
+    async def get_participants(self, entity, filter=None):
+        await self._round_trip()
+        return []   # nobody is an admin; the game starter still has host rights
+
+    async def __call__(self, request):
+        # raw requests; the only one the bot makes is answering a button tap for a shard worker
+        await self._round_trip()
+        self.answered += 1
+
+
+class FakeEvent:
+    """A message or button press with the event methods the handlers call."""
+
+    def __init__(self, client: FakeClient, kind: str, chat_id: int, sender_id: int,
+                 raw_text: str = "", data: Optional[bytes] = None, msg_id: Optional[int] = None):
+        self.client = client
+        self.kind = kind
+        self.chat_id = chat_id
+        self.sender_id = sender_id
+        self.sender = fake_user(sender_id)
+        self.is_private = chat_id == sender_id
+        self.raw_text = raw_text
+        self.data = data
+        self.id = self.message_id = msg_id
+        # attach a document by setting message.document/file/data
+        self.message = SimpleNamespace(id=msg_id, chat_id=chat_id, is_reply=False, reply_to_msg_id=None,
+                                       document=None, file=None)
+        self.query = SimpleNamespace(query_id=msg_id or 0)
+
+    async def respond(self, message="", **kwargs):
+        return await self.client.send_message(self.chat_id, message, **kwargs)
+
+    async def reply(self, message="", **kwargs):
+        return await self.client.send_message(self.chat_id, message, reply_to=self.id, **kwargs)
+
+    async def edit(self, message=None, **kwargs):
+        return await self.client.edit_message(self.chat_id, self.message_id, message, **kwargs)
+
+    async def answer(self, message=None, alert=False):
+        await self.client._round_trip()
+        self.client.answered += 1
+
+    async def get_reply_message(self):
+        return None
+
+    async def get_chat(self):
+        return SimpleNamespace(id=self.chat_id, title=f"Chat{self.chat_id}", creator=False)
+
+
+class EventFactory:
+    """Builds FakeEvents for one client."""
+
+    def __init__(self, client: FakeClient):
+        self.client = client
+        self._ids = itertools.count(1)
+
+    def message(self, chat_id: int, sender_id: int, text: str) -> FakeEvent:
+        return FakeEvent(self.client, "message", chat_id, sender_id, raw_text=text, msg_id=next(self._ids))
+
+    def callback(self, chat_id: int, sender_id: int, data: bytes, msg_id: int = 0) -> FakeEvent:
+        return FakeEvent(self.client, "callback", chat_id, sender_id, data=data, msg_id=msg_id)
@@ -0,0 +1,274 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from collections import deque
+from typing import Dict, Hashable, Optional
+from telethon import errors, utils
+from ratelimit import TokenBucket
+from metrics import Counter, Histogram
+
+# ---- Outgoing message scheduler ----
+# Telegram allows about one message per second per chat (bursts are tolerated)
+# and ~30 per second across the bot; past that it answers with FloodWait.
+OUTBOX_GLOBAL_RATE = float(os.environ.get("OUTBOX_GLOBAL_RATE", 25))   # messages per second, all chats
+OUTBOX_CHAT_RATE = float(os.environ.get("OUTBOX_CHAT_RATE", 1))        # messages per second, one chat
+OUTBOX_CHAT_BURST = float(os.environ.get("OUTBOX_CHAT_BURST", 4))      # back-to-back messages in one chat
+OUTBOX_CONCURRENCY = int(os.environ.get("OUTBOX_CONCURRENCY", 20))     # sends in flight at once
+OUTBOX_MAX_FLOOD_WAIT = 30   # longest FloodWait (seconds) a queued message waits out before failing
+
+# priorities, most urgent first
+URGENT = 0   # role DMs, vote prompts: the game cannot go on without them
+NORMAL = 1   # regular replies and announcements
+NOTICE = 2   # low-value notices ("⚠️ Slow down a bit."), usually coalesced
+BULK = 3     # broadcasts: only what's left after game traffic
+PRIORITY_NAMES = ("urgent", "normal", "notice", "bulk")
+
+OUTBOX_WAIT = Histogram("spygame_outbox_wait_seconds", "Time a message spent queued before sending.", ("priority",))
+OUTBOX_COALESCED = Counter("spygame_outbox_coalesced_total", "Messages merged into an identical queued one.")
+OUTBOX_FLOOD_WAITS = Counter("spygame_outbox_flood_waits_total", "FloodWaits received (each pauses one chat).")
+
+
+def lane_key(entity) -> Hashable:
+    """Chat id of whatever Telethon accepts as an entity (ids, peers, users, chats)."""
+    if isinstance(entity, int):
+        return entity
+    try:
+        return utils.get_peer_id(entity)
+    except (TypeError, ValueError):
+        return entity if isinstance(entity, str) else id(entity)
+
+
+class _Item:
+    __slots__ = ("entity", "message", "kwargs", "priority", "max_wait", "key", "future", "queued")
+
+    def __init__(self, entity, message, kwargs, priority, max_wait, key, future):
+        self.entity = entity
+        self.message = message
+        self.kwargs = kwargs
+        self.priority = priority
+        self.max_wait = max_wait
+        self.key = key
+        self.future = future
+        self.queued = time.monotonic()
+        # nobody may be left to read a failure (the caller was cancelled); don't warn about it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+class _Lane:
+    """Pending messages of one chat, one deque per priority, sent one at a time."""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.queues = [deque() for _ in PRIORITY_NAMES]
+        self.size = 0
+        self.coalesce: Dict[Hashable, _Item] = {}   # key -> queued item
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.busy = False   # a caller is sending inline (the lane was idle)
+
+    def __len__(self):
+        return self.size
+
+    def push(self, item: _Item, front: bool = False):
+        if front:
+            self.queues[item.priority].appendleft(item)
+        else:
+            self.queues[item.priority].append(item)
+        if item.key is not None:
+            self.coalesce[item.key] = item
+        self.size += 1
+
+    def pop(self) -> Optional[_Item]:
+        if not self.size:
+            return None
+        for q in self.queues:
+            if q:
+                item = q.popleft()
+                self.size -= 1
+                if item.key is not None:
+                    self.coalesce.pop(item.key, None)
+                return item
+
+
+class _PriorityGate:
+    """The global token bucket, handed out in priority order across chats."""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self._waiters = []   # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._waiters)
+
+    async def acquire(self, priority: int):
+        if not self._waiters and self.bucket.try_acquire():
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.get_running_loop().create_task(self._run())
+        await fut
+
+    async def _run(self):
+        while self._waiters:
+            if not self.bucket.try_acquire():
+                await asyncio.sleep(self.bucket.delay())
+                continue
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                self.bucket.tokens += 1   # waiter went away: give the token back
+            else:
+                fut.set_result(None)
+
+
+class Outbox:
+    """Every ``client.send_message`` goes through here once ``install()`` is called.
+
+    Each chat is a lane with its own token bucket; at most one message per
+    lane is in flight, so a chat's messages keep their order within a
+    priority. Lanes then share a global bucket that serves the most urgent
+    waiting message first. A FloodWait pauses only the lane it came from.
+
+    Extra keyword arguments accepted by the patched ``send_message``
+    (``respond``/``reply`` pass them through):
+
+    ``priority``  URGENT, NORMAL (default), NOTICE or BULK.
+    ``coalesce``  True: if the same text is already queued for the chat,
+                  don't queue it again; the caller gets the queued message.
+    ``max_wait``  longest FloodWait to wait out (seconds) before the call
+                  raises FloodWaitError; 0 raises at once.
+    """
+
+    def __init__(self, client, global_rate: float = OUTBOX_GLOBAL_RATE, chat_rate: float = OUTBOX_CHAT_RATE,
+                 chat_burst: float = OUTBOX_CHAT_BURST, concurrency: int = OUTBOX_CONCURRENCY):
+        self.client = client
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._send = client.send_message   # the real (instrumented) call
+        self._gate = _PriorityGate(TokenBucket(global_rate, global_rate))
+        self._inflight = asyncio.Semaphore(concurrency)
+        self._lanes: Dict[Hashable, _Lane] = {}
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.flood_waits = 0
+
+    def install(self) -> "Outbox":
+        self.client.send_message = self.send_message
+        return self
+
+    @property
+    def queued(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def stats(self) -> dict:
+        return {
+            "lanes": len(self._lanes), "queued": self.queued, "sent": self.sent, "failed": self.failed,
+            "coalesced": self.coalesced, "flood_waits": self.flood_waits,
+        }
+
+    async def send_message(self, entity, message="", *, priority: int = NORMAL, coalesce: bool = False,
+                           max_wait: float = OUTBOX_MAX_FLOOD_WAIT, **kwargs):
+        key = lane_key(entity)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane(TokenBucket(self.chat_rate, self.chat_burst))
+        if coalesce:
+            queued = lane.coalesce.get(message)
+            if queued is not None:
+                self.coalesced += 1
+                OUTBOX_COALESCED.inc()
+                return await asyncio.shield(queued.future)
+        item = _Item(entity, message, kwargs, priority, max_wait, message if coalesce else None,
+                     asyncio.get_running_loop().create_future())
+        if not lane.busy and not len(lane) and (lane.task is None or lane.task.done()):
+            # idle chat: send from the caller's task instead of hopping through the lane's
+            lane.busy = True
+            try:
+                await self._process(lane, item)
+            except asyncio.CancelledError:
+                item.future.cancel()
+                raise
+            finally:
+                lane.busy = False
+                self._kick(key, lane)   # anything queued meanwhile (or requeued by a FloodWait)
+        else:
+            lane.push(item)
+            self._kick(key, lane)
+        # shielded: a caller that gives up doesn't unsend a message others may be waiting on
+        return await asyncio.shield(item.future)
+
+    def _kick(self, key, lane: _Lane):
+        """Make sure the lane's queue is being drained, or drop the lane if it has nothing left to do."""
+        if lane.busy:
+            return   # the inline sender kicks again when it's done
+        if lane.task is not None and not lane.task.done():
+            lane.wakeup.set()
+        elif len(lane) or lane.bucket.delay(lane.bucket.capacity) > 0:
+            lane.task = asyncio.get_running_loop().create_task(self._drain(key, lane))
+        elif self._lanes.get(key) is lane:
+            del self._lanes[key]
+
+    async def _drain(self, key, lane: _Lane):
+        while True:
+            item = lane.pop()
+            if item is None:
+                # stay around until the bucket is full again, so a chat can't burst
+                # past its limit by letting its lane be dropped and recreated
+                linger = lane.bucket.delay(lane.bucket.capacity)
+                if linger <= 0:
+                    if self._lanes.get(key) is lane:
+                        del self._lanes[key]
+                    return
+                lane.wakeup.clear()
+                timer = asyncio.get_running_loop().call_later(linger, lane.wakeup.set)
+                await lane.wakeup.wait()   # a new message, or the bucket is full
+                timer.cancel()
+                continue
+            await self._process(lane, item)
+
+    async def _process(self, lane: _Lane, item: _Item):
+        if lane.bucket.paused_for() > item.max_wait:
+            # the chat is under a FloodWait longer than this message may wait
+            self.failed += 1
+            item.future.set_exception(errors.FloodWaitError(request=None, capture=int(lane.bucket.paused_for())))
+            return
+        await lane.bucket.acquire()
+        await self._gate.acquire(item.priority)
+        async with self._inflight:
+            await self._deliver(lane, item)
+
+    async def _deliver(self, lane: _Lane, item: _Item):
+        OUTBOX_WAIT.observe(time.monotonic() - item.queued, PRIORITY_NAMES[item.priority])
+        try:
+            result = await self._send(item.entity, item.message, **item.kwargs)
+        except errors.FloodWaitError as e:
+            self.flood_waits += 1
+            OUTBOX_FLOOD_WAITS.inc()
+            lane.bucket.pause(e.seconds + 1)
+            if e.seconds > item.max_wait:
+                self.failed += 1
+                item.future.set_exception(e)
+            else:
+                lane.push(item, front=True)   # first in line once the pause is over
+            return
+        except Exception as e:
+            self.failed += 1
+            item.future.set_exception(e)
+            return
+        self.sent += 1
+        item.future.set_result(result)
+
+    async def stop(self):
+        """Cancel the lanes; callers still waiting get CancelledError."""
+        for lane in list(self._lanes.values()):
+            if lane.task:
+                lane.task.cancel()
+            for q in lane.queues:
+                for item in q:
+                    item.future.cancel()
+        self._lanes.clear()
@@ -0,0 +1,145 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+import tracemalloc
+from collections import Counter
+from typing import Optional
+
+# ---- Loop-block watchdog + on-demand profilers (all off unless started) ----
+LOOP_BLOCK_THRESHOLD_MS = float(os.environ.get("LOOP_BLOCK_THRESHOLD_MS", 0))   # 0 = watchdog off
+PROFILE_INTERVAL = 0.005     # seconds between CPU samples
+PROFILE_MAX_SECONDS = 300    # longest window /profile and /memprofile accept
+PROFILE_TOP = 15             # lines per report
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}"
+
+
+class BlockWatchdog:
+    """Logs the loop thread's stack whenever the event loop stays blocked past a threshold.
+
+    The loop only reschedules a cheap heartbeat callback; a daemon thread
+    notices when the heartbeat stops and prints where the loop is stuck.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.blocks = 0
+        self._beat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat()
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _heartbeat(self):
+        self._beat = time.monotonic()
+        if not self._stop.is_set():
+            self._loop.call_later(self.threshold / 4, self._heartbeat)
+
+    def _watch(self):
+        reported = None   # heartbeat of the block already logged
+        while not self._stop.wait(self.threshold / 4):
+            beat = self._beat
+            stalled = time.monotonic() - beat
+            if stalled < self.threshold or beat == reported:
+                continue
+            reported = beat
+            self.blocks += 1
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(no frame)\n"
+            print(f"🐢 Event loop blocked for {stalled * 1000:.0f} ms, stack:\n{stack}", end="")
+
+
+class SamplingProfiler:
+    """Samples the event-loop thread's stack from a side thread for a fixed window.
+
+    Only the loop thread is profiled (that's where handlers run); overhead
+    while running is one ``sys._current_frames()`` per interval.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self._self = Counter()      # leaf function -> samples
+        self._total = Counter()     # any function on the stack -> samples
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    async def run(self, seconds: float, top: int = PROFILE_TOP) -> str:
+        """Profile the calling loop's thread for ``seconds`` (or until stop()) and report."""
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._sample, args=(threading.get_ident(), seconds),
+                                        name="profiler", daemon=True)
+        self._thread.start()
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+        return self.report(top)
+
+    def stop(self):
+        self._stop.set()
+
+    def _sample(self, target: int, seconds: float):
+        deadline = time.monotonic() + seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(target)
+            if frame is None:
+                continue
+            self.samples += 1
+            self._self[_frame_label(frame)] += 1
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                label = f"{os.path.basename(code.co_filename)} {code.co_name}"
+                if label not in seen:   # count recursive functions once per sample
+                    seen.add(label)
+                    self._total[label] += 1
+                frame = frame.f_back
+
+    def report(self, top: int = PROFILE_TOP) -> str:
+        elapsed = time.monotonic() - self.started
+        n = self.samples or 1
+        lines = [f"🔬 CPU profile: {self.samples} samples over {elapsed:.0f}s (loop thread)", "", "Self time:"]
+        lines += [f"{c * 100 / n:5.1f}%  {label}" for label, c in self._self.most_common(top)]
+        lines += ["", "Inclusive time:"]
+        lines += [f"{c * 100 / n:5.1f}%  {label}" for label, c in self._total.most_common(top)]
+        return "\n".join(lines)
+
+
+async def profile_memory(seconds: float, top: int = PROFILE_TOP) -> str:
+    """Trace allocations for ``seconds`` and report what grew, by source line."""
+    already = tracemalloc.is_tracing()
+    if not already:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        await asyncio.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not already:
+            tracemalloc.stop()
+    filters = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen *>"))
+    stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+    lines = [f"🧪 Allocations over {seconds:.0f}s (traced now {current / 1024:.0f} KiB, peak {peak / 1024:.0f} KiB)", ""]
+    for stat in stats[:top]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size_diff / 1024:+8.1f} KiB  {stat.count_diff:+6d}  "
+                     f"{os.path.basename(frame.filename)}:{frame.lineno}")
+    return "\n".join(lines)
@@ -0,0 +1,144 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, Hashable, NamedTuple, Optional, Tuple
+
+
+class TokenBucket:
+    """Async token bucket: ``rate`` tokens per second, bursts up to ``capacity``.
+
+    ``pause(seconds)`` stops handing out tokens until the pause expires, which
+    is how a server-imposed FloodWait is honoured by every waiter at once.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        # resume with an empty bucket rather than a burst
+        self.tokens = 0
+        self._last = self._paused_until
+
+    def paused_for(self) -> float:
+        """Seconds left of the current pause (0 if not paused)."""
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def delay(self, tokens: float = 1) -> float:
+        """Seconds until ``tokens`` could be acquired (0 if they can be now)."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now + tokens / self.rate
+        self._refill(now)
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class Budget(NamedTuple):
+    """``burst`` requests at once, refilled at one request per ``interval`` seconds."""
+    burst: float
+    interval: float
+
+    @property
+    def refill_time(self) -> float:
+        return self.burst * self.interval
+
+
+class KeyedRateLimiter:
+    """Token buckets keyed by (command, identity), with per-command budgets.
+
+    Buckets live in two generations that rotate every ``window`` seconds
+    (the longest full-refill time): a bucket untouched for a whole window
+    is full again and carries no information, so dropping the old
+    generation wholesale forgets nothing. ``max_entries`` forces an early
+    rotation, capping memory under a flood of new identities.
+    """
+
+    def __init__(self, default: Budget, budgets: Optional[Dict[str, Budget]] = None,
+                 max_entries: int = 100_000):
+        self.default = default
+        self.budgets = budgets or {}
+        self.max_entries = max_entries
+        self.window = max([default.refill_time, *(b.refill_time for b in self.budgets.values())])
+        self._current: Dict[Hashable, Tuple[float, float]] = {}   # key -> (tokens, last refill)
+        self._previous: Dict[Hashable, Tuple[float, float]] = {}
+        self._rotated_at = time.monotonic()
+        self.admitted: Dict[str, int] = defaultdict(int)
+        self.throttled: Dict[str, int] = defaultdict(int)
+
+    def __len__(self):
+        return len(self._current) + len(self._previous)
+
+    def _rotate(self, now: float):
+        self._previous = self._current
+        self._current = {}
+        self._rotated_at = now
+
+    def hit(self, command: str, ident: Hashable) -> bool:
+        """Spend one token for ``ident`` on ``command``; False means throttled."""
+        now = time.monotonic()
+        if now - self._rotated_at >= self.window:
+            # everything in the previous generation is at least a window old
+            if now - self._rotated_at >= 2 * self.window:
+                self._current = {}
+            self._rotate(now)
+        elif len(self._current) >= self.max_entries:
+            self._rotate(now)
+
+        budget = self.budgets.get(command, self.default)
+        key = (command, ident)
+        entry = self._current.get(key)
+        if entry is None:
+            entry = self._previous.pop(key, None)
+        if entry is None:
+            tokens = budget.burst
+        else:
+            tokens = min(budget.burst, entry[0] + (now - entry[1]) / budget.interval)
+
+        if tokens >= 1:
+            self._current[key] = (tokens - 1, now)
+            self.admitted[command] += 1
+            return True
+        self._current[key] = (tokens, now)
+        self.throttled[command] += 1
+        return False
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self),
+            "admitted": sum(self.admitted.values()),
+            "throttled": sum(self.throttled.values()),
+            "by_command": {
+                cmd: {"admitted": self.admitted[cmd], "throttled": self.throttled.get(cmd, 0)}
+                for cmd in self.admitted.keys() | self.throttled.keys()
+            },
+        }
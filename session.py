@@ -0,0 +1,237 @@
+import os
+import json
+import base64
+import asyncio
+import datetime
+from typing import Dict, Optional
+from telethon import utils
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession
+from telethon.tl.types import PeerUser, PeerChat, PeerChannel
+from telethon.tl.types.updates import State
+
+# ---- Telethon session storage ----
+# postgres: kept in memory, persisted to the telethon_* tables (survives redeploys)
+# memory:   kept in memory, snapshotted to SESSION_FILE ("" = never persisted)
+# sqlite:   Telethon's default <SESSION_NAME>.session file, written while handling updates
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "postgres")
+SESSION_NAME = os.environ.get("SESSION_NAME", "game_bot")
+SESSION_FILE = os.environ.get("SESSION_FILE", SESSION_NAME + ".session.json")
+SESSION_ENTITY_BATCH = 500   # new/changed entities that trigger a snapshot before the next save()
+
+
+class FileStore:
+    """The whole session as one JSON file, replaced atomically off the event loop."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return data["state"], [tuple(r) for r in data["entities"]]
+
+    def _write(self, state: dict, rows: list):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"state": state, "entities": rows}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)   # readers see the old snapshot or the new one, never half of one
+
+    async def load(self):
+        return await asyncio.to_thread(self._read)
+
+    async def save(self, session: "CachedSession", rows: list):
+        # the file is rewritten whole, so every entity goes in, not just the changed ones;
+        # encoding happens in the thread too
+        await asyncio.to_thread(self._write, session.state(), list(session._rows.values()))
+
+    async def delete(self):
+        try:
+            await asyncio.to_thread(os.remove, self.path)
+        except FileNotFoundError:
+            pass
+
+
+class PostgresStore:
+    """Session state and entities in Postgres, through the shared db.py pool."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    async def load(self):
+        from db import load_session
+        return await load_session(self.name)
+
+    async def save(self, session: "CachedSession", rows: list):
+        from db import save_session
+        # state and changed entities in one transaction
+        await save_session(self.name, json.dumps(session.state()), rows)
+
+    async def delete(self):
+        from db import delete_session
+        await delete_session(self.name)
+
+
+class CachedSession(MemorySession):
+    """Telethon session held in memory and persisted by ``store`` in the background.
+
+    Handling updates only touches dicts: entities are indexed by id,
+    username, phone and name (MemorySession scans a set), and only new or
+    changed entities are written, in one batch per snapshot. A snapshot is
+    taken whenever Telethon calls ``save()`` (on connect and about once a
+    minute), on ``close()``, and early once SESSION_ENTITY_BATCH entities
+    are waiting. Call ``load()`` and then ``restore_into(client)`` before
+    connecting.
+    """
+
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+        self._rows: Dict[int, tuple] = {}   # id -> (id, hash, username, phone, name)
+        self._by_username: Dict[str, int] = {}
+        self._by_phone: Dict[str, int] = {}
+        self._by_name: Dict[str, int] = {}
+        self._dirty: Dict[int, tuple] = {}
+        self._saved_state: Optional[dict] = None
+        self._lock = asyncio.Lock()
+        self._pending: Optional[asyncio.Task] = None
+        self.snapshots = 0
+
+    # ---- state ----
+    def state(self) -> dict:
+        return {
+            "dc_id": self._dc_id,
+            "server_address": self._server_address,
+            "port": self._port,
+            "auth_key": base64.b64encode(self._auth_key.key).decode() if self._auth_key and self._auth_key.key else None,
+            "takeout_id": self._takeout_id,
+            "update_states": {
+                str(entity_id): [s.pts, s.qts, int(s.date.timestamp()), s.seq]
+                for entity_id, s in self._update_states.items()
+            },
+        }
+
+    def _apply_state(self, state: dict):
+        self.set_dc(state["dc_id"], state["server_address"], state["port"])
+        if state["auth_key"]:
+            self._auth_key = AuthKey(base64.b64decode(state["auth_key"]))
+        self._takeout_id = state["takeout_id"]
+        for entity_id, (pts, qts, date, seq) in state["update_states"].items():
+            self._update_states[int(entity_id)] = State(
+                pts, qts, datetime.datetime.fromtimestamp(date, tz=datetime.timezone.utc), seq, unread_count=0)
+
+    async def load(self) -> int:
+        """Restore the last snapshot; returns how many entities it held."""
+        loaded = await self.store.load()
+        if not loaded:
+            return 0
+        state, rows = loaded
+        self._apply_state(state)
+        for row in rows:
+            self._index(tuple(row))
+        self._saved_state = self.state()
+        return len(rows)
+
+    def restore_into(self, client):
+        """Hand the loaded auth key to a client that was built before ``load()``.
+
+        TelegramClient gives its MTProtoSender the session's key once, at
+        construction, and the sender (and its MTProtoState) keep that
+        AuthKey object. The key is copied into it in place, the way
+        Telethon itself clears it; without this every restart would run a
+        new key exchange and sign in again.
+        """
+        if self._auth_key:
+            client._sender.auth_key.key = self._auth_key.key
+            self._auth_key = client._sender.auth_key   # one object from here on, as after connect()
+
+    # ---- entities ----
+    def _index(self, row: tuple):
+        entity_id, _, username, phone, name = row
+        old = self._rows.get(entity_id)
+        if old is not None:
+            for index, value in ((self._by_username, old[2]), (self._by_phone, old[3]), (self._by_name, old[4])):
+                if value is not None and index.get(value) == entity_id:
+                    del index[value]
+        self._rows[entity_id] = row
+        if username:
+            self._by_username[username] = entity_id
+        if phone:
+            self._by_phone[phone] = entity_id
+        if name:
+            self._by_name[name] = entity_id
+
+    def process_entities(self, tlo):
+        for row in self._entities_to_rows(tlo):
+            if self._rows.get(row[0]) != row:
+                self._index(row)
+                self._dirty[row[0]] = row
+        if len(self._dirty) >= SESSION_ENTITY_BATCH and (self._pending is None or self._pending.done()):
+            self._pending = asyncio.get_running_loop().create_task(self.snapshot())
+
+    def _found(self, entity_id):
+        return None if entity_id is None else (entity_id, self._rows[entity_id][1])
+
+    def get_entity_rows_by_phone(self, phone):
+        return self._found(self._by_phone.get(phone))
+
+    def get_entity_rows_by_username(self, username):
+        return self._found(self._by_username.get(username))
+
+    def get_entity_rows_by_name(self, name):
+        return self._found(self._by_name.get(name))
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            return self._found(id if id in self._rows else None)
+        for marked in (utils.get_peer_id(PeerUser(id)), utils.get_peer_id(PeerChat(id)),
+                       utils.get_peer_id(PeerChannel(id))):
+            if marked in self._rows:
+                return self._found(marked)
+        return None
+
+    # ---- persistence ----
+    async def snapshot(self) -> bool:
+        """Write what changed since the last snapshot; False if nothing had (or the write failed)."""
+        async with self._lock:
+            state = self.state()
+            if state == self._saved_state and not self._dirty:
+                return False
+            rows, self._dirty = list(self._dirty.values()), {}
+            try:
+                await self.store.save(self, rows)
+            except Exception as e:
+                print(f"⚠️ Session snapshot failed: {e}")
+                for row in rows:
+                    self._dirty.setdefault(row[0], row)   # retried with the next snapshot
+                return False
+            self._saved_state = state
+            self.snapshots += 1
+            return True
+
+    async def save(self):
+        await self.snapshot()
+
+    async def close(self):
+        if self._pending is not None:
+            await self._pending
+        await self.snapshot()
+
+    async def delete(self):
+        await self.store.delete()
+
+
+def make_session():
+    """What to pass to TelegramClient as its session, per SESSION_BACKEND."""
+    if SESSION_BACKEND == "sqlite":
+        return SESSION_NAME
+    if SESSION_BACKEND == "memory":
+        return CachedSession(FileStore(SESSION_FILE)) if SESSION_FILE else MemorySession()
+    if SESSION_BACKEND == "postgres":
+        return CachedSession(PostgresStore(SESSION_NAME))
+    raise ValueError(f"Unknown SESSION_BACKEND {SESSION_BACKEND!r} (use postgres, memory or sqlite)")
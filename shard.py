@@ -0,0 +1,398 @@
+import io
+import os
+import queue
+import asyncio
+import itertools
+import threading
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict, Optional
+from telethon import errors, events
+from telethon.tl import functions
+from telethon.tl.types import ChannelParticipantsAdmins
+
+# ---- Sharded worker mode ----
+# SHARD_WORKERS=N runs game logic in N worker processes, each owning the chats
+# with shard_of(chat_id) == its index. The front process keeps the only
+# Telegram connection: it forwards updates to workers over a pipe and executes
+# the API calls they send back.
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", 0))
+# set in the environment of spawned workers so main.py skips front-only setup
+SHARD_WORKER = os.environ.get("SHARD_WORKER") == "1"
+
+
+def shard_of(chat_id: int, count: int) -> int:
+    return hash(chat_id) % count
+
+
+def _light_entity(entity) -> SimpleNamespace:
+    """The parts of a user/chat the game reads, in a form that pickles cheaply."""
+    return SimpleNamespace(
+        id=entity.id,
+        first_name=getattr(entity, "first_name", None),
+        title=getattr(entity, "title", None),
+        username=getattr(entity, "username", None),
+        creator=bool(getattr(entity, "creator", False)),
+    )
+
+
+def _light_message(msg) -> Optional[SimpleNamespace]:
+    """A message's id, reply link and attached file details (not the file itself)."""
+    if msg is None:
+        return None
+    f = msg.file if msg.document is not None else None
+    return SimpleNamespace(
+        id=msg.id,
+        chat_id=msg.chat_id,
+        is_reply=msg.is_reply,
+        reply_to_msg_id=msg.reply_to_msg_id,
+        document=bool(f),
+        file=SimpleNamespace(name=f.name, size=f.size, mime_type=f.mime_type) if f else None,
+    )
+
+
+def snapshot_event(event) -> dict:
+    """Everything a worker needs to run handlers for this update."""
+    sender = event.sender
+    data = {
+        "chat_id": event.chat_id,
+        "sender_id": event.sender_id,
+        "sender": _light_entity(sender) if sender is not None else None,
+        "is_private": event.is_private,
+    }
+    if isinstance(event, events.CallbackQuery.Event) or getattr(event, "kind", None) == "callback":
+        data.update(kind="callback", data=event.data, msg_id=event.message_id, query_id=event.query.query_id)
+    else:
+        data.update(kind="message", raw_text=event.raw_text, msg_id=event.id, message=_light_message(event.message))
+    return data
+
+
+class PipeWriter:
+    """Sends on a Connection without blocking the event loop.
+
+    Messages are pickled on the loop, so later changes to the objects don't
+    leak into them, and written by a thread. A full pipe (a busy reader)
+    then only stalls that thread, never the loop that would drain the other
+    direction.
+    """
+
+    def __init__(self, conn, name: str):
+        from multiprocessing.reduction import ForkingPickler   # what Connection.send uses
+        self._dumps = ForkingPickler.dumps
+        self._conn = conn
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self.closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def send(self, obj):
+        if not self.closed:
+            self._queue.put(bytes(self._dumps(obj)))
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            try:
+                self._conn.send_bytes(data)
+            except (EOFError, OSError):
+                self.closed = True   # the other side is gone; drop the rest
+                return
+
+    def close(self, timeout: Optional[float] = None):
+        """Send what's queued, then stop the thread."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+# ---------------- FRONT PROCESS ----------------
+class ShardRouter:
+    """Owns the worker processes; routes updates to them and runs their API calls."""
+
+    def __init__(self, client, count: int):
+        self.client = client
+        self.count = count
+        self._conns = []
+        self._writers = []
+        self._procs = []
+        self._early = []        # (chat_id, message) routed before the workers were started
+        self._notices: Dict[str, Callable] = {}   # name -> handler of WorkerClient.notify()
+        self._running = set()   # API calls being executed for workers
+        self._stopping = False
+        self.forwarded = 0
+        self.calls = 0
+
+    def start(self, target: Callable):
+        """Spawn ``target(index, count, conn)`` once per shard."""
+        import multiprocessing   # only the sharded front process needs it
+        ctx = multiprocessing.get_context("spawn")
+        os.environ["SHARD_WORKER"] = "1"
+        try:
+            for i in range(self.count):
+                parent, child = ctx.Pipe()
+                proc = ctx.Process(target=target, args=(i, self.count, child), name=f"shard-{i}", daemon=True)
+                proc.start()
+                child.close()
+                self._conns.append(parent)
+                self._procs.append(proc)
+        finally:
+            del os.environ["SHARD_WORKER"]
+        self._writers = [PipeWriter(conn, f"shard-{i}-writer") for i, conn in enumerate(self._conns)]
+        loop = asyncio.get_event_loop()
+        for i, conn in enumerate(self._conns):
+            loop.add_reader(conn.fileno(), self._on_readable, i)
+        # updates that came in while Telegram connected; workers hold them until they're ready
+        early, self._early = self._early, []
+        for chat_id, msg in early:
+            self._send(chat_id, msg)
+
+    def _send(self, chat_id: int, msg: tuple):
+        if not self._writers:
+            self._early.append((chat_id, msg))
+            return
+        self._writers[shard_of(chat_id, self.count)].send(msg)
+
+    def forward(self, event):
+        """Hand an update to the chat's worker; one pipe per worker keeps per-chat order."""
+        self.forwarded += 1
+        self._send(event.chat_id, ("event", snapshot_event(event)))
+
+    def control(self, chat_id: int, name: str, *args):
+        self._send(chat_id, ("control", name, args))
+
+    def on_notice(self, name: str, handler: Callable):
+        """Run ``handler(*args)`` here whenever a worker calls ``client.notify(name, *args)``."""
+        self._notices[name] = handler
+
+    def stop(self, timeout: float = 10.0):
+        self._stopping = True
+        for writer in self._writers:
+            writer.send(("stop",))
+            writer.close(timeout)
+        for proc in self._procs:
+            proc.join(timeout)
+
+    def health(self) -> tuple:
+        alive = sum(p.is_alive() for p in self._procs)
+        return alive == self.count, {"alive": alive, "count": self.count}
+
+    def _on_readable(self, index: int):
+        conn = self._conns[index]
+        try:
+            while conn.poll():
+                msg = conn.recv()
+                if msg[0] == "notice":
+                    handler = self._notices.get(msg[1])
+                    if handler:
+                        handler(*msg[2])
+                    continue
+                _, call_id, op, args, kwargs = msg
+                task = asyncio.ensure_future(self._execute(index, call_id, op, args, kwargs))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+        except (EOFError, OSError):
+            asyncio.get_event_loop().remove_reader(conn.fileno())
+            if not self._stopping:
+                print(f"⚠️ Shard worker {index} exited")
+
+    async def _execute(self, index, call_id, op, args, kwargs):
+        self.calls += 1
+        try:
+            reply = ("result", call_id, True, await getattr(self, "_op_" + op)(*args, **kwargs))
+        except errors.FloodWaitError as e:
+            reply = ("result", call_id, False, ("flood", e.seconds))
+        except Exception as e:
+            reply = ("result", call_id, False, ("error", f"{type(e).__name__}: {e}"))
+        self._writers[index].send(reply)
+
+    # ---- API calls workers may make ----
+    async def _op_send_message(self, entity, message, **kwargs):
+        msg = await self.client.send_message(entity, message, **kwargs)
+        return SimpleNamespace(id=msg.id)
+
+    async def _op_edit_message(self, entity, message_id, text, **kwargs):
+        await self.client.edit_message(entity, message_id, text, **kwargs)
+
+    async def _op_get_entity(self, entity):
+        result = await self.client.get_entity(entity)
+        if isinstance(result, list):
+            return [_light_entity(e) for e in result]
+        return _light_entity(result)
+
+    async def _op_get_participants(self, entity, admins=False):
+        kwargs = {"filter": ChannelParticipantsAdmins} if admins else {}
+        return [p.id for p in await self.client.get_participants(entity, **kwargs)]
+
+    async def _op_get_message(self, entity, message_id):
+        return _light_message(await self.client.get_messages(entity, ids=message_id))
+
+    async def _op_download_media(self, entity, message_id):
+        msg = await self.client.get_messages(entity, ids=message_id)
+        return await self.client.download_media(msg, file=bytes)
+
+    async def _op_send_file(self, entity, name, data, **kwargs):
+        buf = io.BytesIO(data)
+        buf.name = name
+        msg = await self.client.send_file(entity, buf, **kwargs)
+        return SimpleNamespace(id=msg.id)
+
+    async def _op_answer_callback(self, query_id, message=None, alert=False):
+        await self.client(functions.messages.SetBotCallbackAnswerRequest(
+            query_id=query_id, cache_time=0, alert=alert, message=message
+        ))
+
+
+# ---------------- WORKER PROCESS ----------------
+class WorkerClient:
+    """Stands in for TelegramClient inside a worker: calls run in the front process."""
+
+    def __init__(self):
+        self._conn = None
+        self._writer: Optional[PipeWriter] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ids = itertools.count()
+        self._calls: Dict[int, asyncio.Future] = {}
+        self._tails: Dict[int, asyncio.Task] = {}
+        self._ready = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self._on_event: Optional[Callable[[object], Awaitable]] = None
+        self._controls: Dict[str, Callable] = {}
+
+    def on(self, *args, **kwargs):
+        # updates arrive over the pipe, so handler registration is a no-op here
+        return lambda fn: fn
+
+    def attach(self, conn, on_event: Callable[[object], Awaitable], controls: Dict[str, Callable]):
+        """Start reading the pipe (call from the running loop); events wait for ready()."""
+        self._conn = conn
+        self._writer = PipeWriter(conn, "front-writer")
+        self._loop = asyncio.get_running_loop()
+        self._on_event = on_event
+        self._controls = controls
+        self._loop.add_reader(conn.fileno(), self._on_readable)
+
+    def ready(self):
+        self._ready.set()
+
+    async def wait_stopped(self):
+        await self._stopped.wait()
+
+    def is_connected(self) -> bool:
+        # "connected" for a worker means its pipe to the front process is open
+        return self._conn is not None and not self._stopped.is_set()
+
+    def _on_readable(self):
+        try:
+            while self._conn.poll():
+                msg = self._conn.recv()
+                kind = msg[0]
+                if kind == "result":
+                    _, call_id, ok, value = msg
+                    fut = self._calls.pop(call_id, None)
+                    if fut is not None and not fut.done():
+                        if ok:
+                            fut.set_result(value)
+                        else:
+                            fut.set_exception(_rebuild_error(value))
+                elif kind == "event":
+                    self._schedule(RemoteEvent(msg[1], self))
+                elif kind == "control":
+                    handler = self._controls.get(msg[1])
+                    if handler:
+                        handler(*msg[2])
+                elif kind == "stop":
+                    self._stopped.set()
+        except (EOFError, OSError):
+            self._loop.remove_reader(self._conn.fileno())
+            self._stopped.set()
+
+    def _schedule(self, event):
+        # events of one chat run one after another, in arrival order
+        chat_id = event.chat_id
+        task = self._loop.create_task(self._run_after(self._tails.get(chat_id), event))
+        self._tails[chat_id] = task
+        task.add_done_callback(lambda t: self._tails.pop(chat_id, None) if self._tails.get(chat_id) is t else None)
+
+    async def _run_after(self, previous: Optional[asyncio.Task], event):
+        await self._ready.wait()
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self._on_event(event)
+        except Exception as e:
+            print(f"⚠️ Handler failed in chat {event.chat_id}: {e}")
+
+    def notify(self, name: str, *args):
+        """Tell the front process something, without waiting (see ShardRouter.on_notice)."""
+        self._writer.send(("notice", name, args))
+
+    async def _call(self, op: str, *args, **kwargs):
+        call_id = next(self._ids)
+        fut = self._loop.create_future()
+        self._calls[call_id] = fut
+        self._writer.send(("call", call_id, op, args, kwargs))
+        return await fut
+
+    # ---- the TelegramClient surface the bot uses ----
+    async def send_message(self, entity, message="", **kwargs):
+        return await self._call("send_message", entity, message, **kwargs)
+
+    async def edit_message(self, entity, message, text=None, **kwargs):
+        return await self._call("edit_message", entity, getattr(message, "id", message), text, **kwargs)
+
+    async def get_entity(self, entity):
+        return await self._call("get_entity", entity)
+
+    async def get_participants(self, entity, filter=None):
+        ids = await self._call("get_participants", entity, admins=filter is ChannelParticipantsAdmins)
+        return [SimpleNamespace(id=i) for i in ids]
+
+    async def download_media(self, message, file=bytes):
+        # only downloads into memory are supported across the pipe
+        return await self._call("download_media", message.chat_id, message.id)
+
+    async def send_file(self, entity, file, **kwargs):
+        name = getattr(file, "name", "file")
+        data = file.getvalue() if hasattr(file, "getvalue") else file
+        return await self._call("send_file", entity, name, data, **kwargs)
+
+
+def _rebuild_error(value) -> Exception:
+    kind, detail = value
+    if kind == "flood":
+        return errors.FloodWaitError(request=None, capture=detail)
+    return RuntimeError(detail)
+
+
+class RemoteEvent:
+    """A forwarded update with the event methods the handlers call."""
+
+    def __init__(self, data: dict, client: WorkerClient):
+        self.client = client
+        self.kind = data["kind"]
+        self.chat_id = data["chat_id"]
+        self.sender_id = data["sender_id"]
+        self.sender = data["sender"]
+        self.is_private = data["is_private"]
+        self.raw_text = data.get("raw_text", "")
+        self.data = data.get("data")
+        self.id = self.message_id = data.get("msg_id")
+        self.message = data.get("message")
+        self._query_id = data.get("query_id")
+
+    async def respond(self, message="", **kwargs):
+        return await self.client.send_message(self.chat_id, message, **kwargs)
+
+    async def edit(self, message=None, **kwargs):
+        return await self.client.edit_message(self.chat_id, self.message_id, message, **kwargs)
+
+    async def answer(self, message=None, alert=False):
+        return await self.client._call("answer_callback", self._query_id, message, alert)
+
+    async def get_chat(self):
+        return await self.client.get_entity(self.chat_id)
+
+    async def get_reply_message(self):
+        if self.message is None or not self.message.is_reply:
+            return None
+        return await self.client._call("get_message", self.chat_id, self.message.reply_to_msg_id)
@@ -0,0 +1,131 @@
+import os
+import sys
+import time
+import asyncio
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional
+
+# ---- Per-Chat Game State ----
+STATE_IDLE_TIMEOUT = float(os.environ.get("STATE_IDLE_TIMEOUT", 900))        # no game: drop after 15 min
+STATE_LOBBY_TIMEOUT = float(os.environ.get("STATE_LOBBY_TIMEOUT", 6 * 3600))  # lobby never begun: drop after 6 h
+STATE_SWEEP_INTERVAL = 60.0
+
+
+@dataclass(slots=True)
+class GameState:
+    players: list = field(default_factory=list)
+    roles: dict = field(default_factory=dict)
+    votes: dict = field(default_factory=dict)
+    game_started: bool = False
+    discussion_time: int = 60          # configured discussion length (seconds)
+    game_mode: Optional[str] = None
+    setup_state: Optional[str] = None
+    game_stage: str = "waiting"
+    game_starter: Optional[int] = None
+    current_location: Optional[str] = None
+    discussion_end: Optional[float] = None   # absolute deadline (time.time())
+    voting_end: Optional[float] = None       # absolute deadline (time.time())
+    started_at: Optional[float] = None       # when /begin assigned roles (time.time())
+    tally: dict = field(default_factory=dict)   # target -> votes, kept in step with votes
+    leader: Optional[int] = None               # current top target (see record_vote)
+    tally_msg_id: Optional[int] = None         # the live tally message being edited
+    last_active: float = field(default_factory=time.monotonic)
+
+# fields that survive a restart (last_active is process-local)
+PERSISTED_FIELDS = (
+    "players", "roles", "votes", "game_started", "discussion_time", "game_mode",
+    "setup_state", "game_stage", "game_starter", "current_location",
+    "discussion_end", "voting_end", "tally_msg_id", "started_at",
+)
+
+def state_to_dict(s: GameState) -> dict:
+    return {name: getattr(s, name) for name in PERSISTED_FIELDS}
+
+def state_from_dict(data: dict) -> GameState:
+    s = GameState(**{k: v for k, v in data.items() if k in PERSISTED_FIELDS})
+    # JSON object keys come back as strings
+    s.roles = {int(k): v for k, v in s.roles.items()}
+    s.votes = {int(k): v for k, v in s.votes.items()}
+    retally(s)
+    return s
+
+
+def record_vote(s: GameState, voter: int, target: int) -> bool:
+    """Count one vote in O(1); False if ``voter`` already voted.
+
+    Ties go to whoever reached the top count first, so the leader only
+    changes when a target strictly overtakes it.
+    """
+    if voter in s.votes:
+        return False
+    s.votes[voter] = target
+    n = s.tally[target] = s.tally.get(target, 0) + 1
+    if s.leader is None or n > s.tally[s.leader]:
+        s.leader = target
+    return True
+
+def retally(s: GameState):
+    """Rebuild tally/leader from votes (in cast order, so ties resolve the same way)."""
+    votes = s.votes
+    s.votes, s.tally, s.leader = {}, {}, None
+    for voter, target in votes.items():
+        record_vote(s, voter, target)
+
+def clear_votes(s: GameState):
+    s.votes.clear()
+    s.tally.clear()
+    s.leader = None
+    s.tally_msg_id = None
+
+# chat_id -> GameState (only chats with a game or recent game commands)
+game_states: Dict[int, GameState] = {}
+
+def get_state(chat_id: int) -> GameState:
+    s = game_states.get(chat_id)
+    if s is None:
+        s = game_states[chat_id] = GameState()
+    s.last_active = time.monotonic()
+    return s
+
+def drop_state(chat_id: int):
+    game_states.pop(chat_id, None)
+
+
+def evict_idle_states(now: Optional[float] = None) -> list:
+    """Drop states with no running game (or a lobby that was never begun) after their timeout;
+    returns the evicted (chat_id, state) pairs."""
+    now = time.monotonic() if now is None else now
+    stale = [
+        (chat_id, s) for chat_id, s in game_states.items()
+        if (not s.game_started and now - s.last_active > STATE_IDLE_TIMEOUT)
+        or (s.game_stage == "joining" and now - s.last_active > STATE_LOBBY_TIMEOUT)
+    ]
+    for chat_id, _ in stale:
+        del game_states[chat_id]
+    return stale
+
+
+async def sweep_states(on_abandoned: Optional[Callable[[int], None]] = None):
+    """Periodically evict idle chats; ``on_abandoned`` is told about dropped lobbies."""
+    while True:
+        await asyncio.sleep(STATE_SWEEP_INTERVAL)
+        for chat_id, s in evict_idle_states():
+            if on_abandoned and s.game_started:
+                on_abandoned(chat_id)
+
+
+def state_memory() -> dict:
+    """Approximate memory held by game_states (the dict plus every state's containers)."""
+    total = sys.getsizeof(game_states)
+    active = 0
+    for s in game_states.values():
+        total += sys.getsizeof(s) + sys.getsizeof(s.players) + sys.getsizeof(s.roles) + sys.getsizeof(s.votes)
+        total += sys.getsizeof(s.tally)
+        total += 32 * (len(s.players) + len(s.roles) + len(s.votes) + len(s.tally))   # boxed ids/role refs
+        active += s.game_started
+    return {
+        "chats": len(game_states),
+        "active": active,
+        "bytes": total,
+        "bytes_per_chat": total // len(game_states) if game_states else 0,
+    }
@@ -0,0 +1,60 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batcher import WriteBehindQueue
+
+
+def make_queue(delay: float, **kwargs):
+    written = []
+
+    async def flush(batch):
+        await asyncio.sleep(delay)
+        written.extend(batch)
+
+    return WriteBehindQueue(flush, **kwargs), written
+
+
+def test_stop_during_slow_flush_keeps_the_batch():
+    async def run():
+        q, written = make_queue(0.2, max_batch=2, max_delay=0.01)
+        q.add(1)
+        q.add(2)          # full batch: the writer starts flushing it at once
+        await asyncio.sleep(0.05)
+        q.add(3)          # queued while the flush is in flight
+        await q.stop()
+        return written, len(q)
+
+    written, pending = asyncio.run(run())
+    assert sorted(written) == [1, 2, 3]
+    assert pending == 0
+
+
+def test_stop_flushes_a_batch_still_waiting_for_its_delay():
+    async def run():
+        q, written = make_queue(0, max_batch=100, max_delay=60)
+        q.add("a")
+        await asyncio.sleep(0)
+        await q.stop()    # must not wait out max_delay
+        return written
+
+    assert asyncio.run(asyncio.wait_for(run(), timeout=5)) == ["a"]
+
+
+def test_cancelled_flush_requeues_the_batch():
+    async def run():
+        q, written = make_queue(0.2, max_batch=2, max_delay=0.01)
+        q.add(1)
+        q.add(2)
+        await asyncio.sleep(0.05)
+        q._task.cancel()  # e.g. the loop shutting down around the writer
+        await asyncio.gather(q._task, return_exceptions=True)
+        pending = len(q)
+        await q.stop()
+        return pending, written
+
+    pending, written = asyncio.run(run())
+    assert pending == 2
+    assert sorted(written) == [1, 2]
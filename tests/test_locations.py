@@ -0,0 +1,75 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import locations
+from locations import LocationIndex, normalize_location, parse_location_file
+
+POOL = ["Bank 🏦", "Bakery", "Bank", "Tea House", "Steak House"]
+
+
+def test_normalize_drops_emoji_punctuation_and_case():
+    assert normalize_location("Hospital 🏥") == "hospital"
+    assert normalize_location("  train-STATION ") == "train station"
+    assert normalize_location("🏦") == ""
+
+
+def test_duplicate_keys_keep_the_first_name():
+    index = LocationIndex(POOL)
+    assert len(index) == 4
+    assert index.resolve("BANK") == "Bank 🏦"
+
+
+def test_resolve_exact_prefix_and_word_prefix():
+    index = LocationIndex(POOL)
+    assert index.resolve("bank 🏦") == "Bank 🏦"
+    assert index.resolve("bak") == "Bakery"
+    assert index.resolve("tea") == "Tea House"
+    assert index.resolve("stea") == "Steak House"
+
+
+def test_resolve_refuses_ambiguous_or_short_prefixes():
+    index = LocationIndex(POOL)
+    assert index.resolve("house") is None   # a word of two names
+    assert index.resolve("ba") is None      # shorter than GUESS_MIN_PREFIX
+    assert index.resolve("") is None
+    assert index.resolve("🏦") is None
+
+
+def test_resolve_typos_by_trigram_score():
+    index = LocationIndex(POOL)
+    assert index.resolve("bakry") == "Bakery"
+    assert index.resolve("zzz") is None
+    # an equal best score for two names is not a match
+    tied = LocationIndex(["Cart", "Card"])
+    score = tied._fuzzy("carx", 2)
+    assert score[0][0] == score[1][0] >= locations.GUESS_FUZZY_MIN
+    assert tied.resolve("carx") is None
+
+
+def test_suggest_ranks_whole_names_then_words_then_spellings():
+    index = LocationIndex(POOL)
+    assert index.suggest("ba") == ["Bakery", "Bank 🏦"]
+    assert index.suggest("house") == ["Tea House", "Steak House"]
+    assert index.suggest("zzz") == []
+    assert index.suggest("bakry") == ["Bakery", "Bank 🏦"]   # best score first
+    assert index.suggest("", limit=2) == ["Bank 🏦", "Bakery"]
+    assert locations.DEFAULT_INDEX.suggest("sta", limit=2) == ["Stadium 🏟️", "Train Station 🚉"]
+
+
+def test_parse_text_file():
+    data = "\ufeffMoon\n  Deep   Sea \nmoon\n\n" + "x" * (locations.LOCATION_NAME_MAX + 1) + "\n"
+    assert parse_location_file(data.encode(), "list.txt") == (["Moon", "Deep Sea"], 2)
+
+
+def test_parse_csv_takes_the_first_column_after_a_header():
+    data = b'Location,notes\nMoon,1\n"Deep, Sea",2\n\n'
+    assert parse_location_file(data, "LIST.CSV") == (["Moon", "Deep, Sea"], 0)
+    # without a header the first row is a name
+    assert parse_location_file(b"Moon,1\n", "list.csv") == (["Moon"], 0)
+
+
+def test_parse_caps_the_number_of_names(monkeypatch):
+    monkeypatch.setattr(locations, "LOCATION_IMPORT_MAX", 2)
+    assert parse_location_file(b"a\nb\nc\nd\n") == (["a", "b"], 2)
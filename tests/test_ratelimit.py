@@ -0,0 +1,67 @@
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ratelimit
+from ratelimit import Budget, KeyedRateLimiter
+
+
+def fake_clock(monkeypatch, start: float = 1000.0):
+    clock = types.SimpleNamespace(now=start)
+    monkeypatch.setattr(ratelimit, "time", types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_burst_then_refill(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    limiter = KeyedRateLimiter(Budget(burst=2, interval=10))
+    assert [limiter.hit("start", 1) for _ in range(3)] == [True, True, False]
+    assert limiter.hit("start", 2)   # identities are independent
+    clock.now += 10
+    assert limiter.hit("start", 1)
+    assert not limiter.hit("start", 1)
+    assert limiter.stats()["by_command"]["start"] == {"admitted": 4, "throttled": 2}
+
+
+def test_per_command_budgets_and_window(monkeypatch):
+    fake_clock(monkeypatch)
+    limiter = KeyedRateLimiter(Budget(1, 5), {"begin": Budget(3, 20)})
+    assert limiter.window == 60   # longest full refill: 3 * 20
+    assert [limiter.hit("begin", 1) for _ in range(4)] == [True, True, True, False]
+    assert limiter.hit("join", 1)
+    assert not limiter.hit("join", 1)
+
+
+def test_rotation_keeps_state_for_one_window(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    limiter = KeyedRateLimiter(Budget(burst=2, interval=10))   # window 20 s
+    limiter.hit("start", 1)
+    limiter.hit("start", 1)
+    clock.now += 20
+    limiter.hit("start", 2)          # rotates: user 1 moves to the previous generation
+    assert len(limiter) == 2
+    assert limiter.hit("start", 1)   # carried over, refilled by two tokens
+    assert limiter.hit("start", 1)
+    assert not limiter.hit("start", 1)
+
+
+def test_two_idle_windows_drop_everything(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    limiter = KeyedRateLimiter(Budget(burst=1, interval=10))   # window 10 s
+    limiter.hit("start", 1)
+    limiter.hit("start", 2)
+    clock.now += 20
+    limiter.hit("start", 3)
+    assert len(limiter) == 1
+
+
+def test_max_entries_forces_an_early_rotation(monkeypatch):
+    fake_clock(monkeypatch)
+    limiter = KeyedRateLimiter(Budget(burst=1, interval=60), max_entries=3)
+    for ident in range(10):
+        limiter.hit("start", ident)
+        assert len(limiter) <= 2 * limiter.max_entries
+    # the throttled state of a recent identity survives the rotation
+    assert not limiter.hit("start", 9)
@@ -0,0 +1,63 @@
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telethon import TelegramClient
+from telethon.crypto import AuthKey
+from telethon.tl.types import User
+
+from session import CachedSession, FileStore
+
+KEY = bytes(range(256))
+
+
+def saved_session(path) -> CachedSession:
+    """A session with a DC, an auth key and one user, snapshotted to ``path``."""
+    session = CachedSession(FileStore(str(path)))
+    session.set_dc(2, "149.154.167.51", 443)
+    session.auth_key = AuthKey(KEY)
+    session.process_entities([User(id=42, access_hash=99, username="alice", first_name="Alice")])
+    asyncio.run(session.snapshot())
+    return session
+
+
+def test_load_restores_state_and_entities(tmp_path):
+    path = tmp_path / "s.json"
+    saved_session(path)
+
+    session = CachedSession(FileStore(str(path)))
+    assert asyncio.run(session.load()) == 1
+    assert (session.dc_id, session.server_address, session.port) == (2, "149.154.167.51", 443)
+    assert session.auth_key.key == KEY
+    assert session.get_entity_rows_by_username("alice") == (42, 99)
+    assert session.get_entity_rows_by_id(42) == (42, 99)
+
+
+def test_snapshot_writes_only_when_something_changed(tmp_path):
+    session = saved_session(tmp_path / "s.json")
+    assert asyncio.run(session.snapshot()) is False
+    session.process_entities([User(id=42, access_hash=99, username="alice2", first_name="Alice")])
+    assert asyncio.run(session.snapshot()) is True
+    assert session.get_entity_rows_by_username("alice") is None
+    assert session.get_entity_rows_by_username("alice2") == (42, 99)
+
+
+def test_loaded_key_reaches_the_sender(tmp_path):
+    path = tmp_path / "s.json"
+    saved_session(path)
+
+    async def run():
+        # built first, with the session still empty, as main.py does at import time
+        session = CachedSession(FileStore(str(path)))
+        client = TelegramClient(session, 1, "hash")
+        await session.load()
+        session.restore_into(client)
+        return client, session
+
+    client, session = asyncio.run(run())
+    assert client._sender.auth_key.key == KEY
+    # the sender's MTProtoState encrypts with the same object
+    assert client._sender._state.auth_key is client._sender.auth_key
+    assert session.auth_key is client._sender.auth_key
@@ -0,0 +1,62 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from state import GameState, record_vote, retally, clear_votes, state_to_dict, state_from_dict
+
+
+def test_ties_stay_with_the_first_to_reach_the_top():
+    s = GameState()
+    assert record_vote(s, 1, 10)
+    assert record_vote(s, 2, 20)     # 1-1: 10 got there first
+    assert s.leader == 10
+    assert record_vote(s, 3, 20)     # 20 overtakes
+    assert s.leader == 20
+    assert record_vote(s, 4, 10)     # 2-2: the leader stays
+    assert s.leader == 20
+    assert s.tally == {10: 2, 20: 2}
+
+
+def test_a_second_vote_is_refused():
+    s = GameState()
+    assert record_vote(s, 1, 10)
+    assert not record_vote(s, 1, 20)
+    assert s.votes == {1: 10} and s.tally == {10: 1}
+
+
+def test_retally_replays_votes_in_cast_order():
+    s = GameState()
+    for voter, target in [(1, 10), (2, 20), (3, 20), (4, 10)]:
+        record_vote(s, voter, target)
+    s.tally, s.leader = {}, None
+    retally(s)
+    assert (s.tally, s.leader) == ({10: 2, 20: 2}, 20)
+    clear_votes(s)
+    assert (s.votes, s.tally, s.leader) == ({}, {}, None)
+
+
+def test_checkpoint_round_trip():
+    s = GameState(
+        players=[1, 2, 3], roles={1: "Spy", 2: "Civilian", 3: "Fake Civilian"},
+        game_started=True, game_mode="chaos", game_stage="voting", game_starter=1,
+        current_location="Bank 🏦", discussion_end=100.5, voting_end=160.5,
+        started_at=40.0, tally_msg_id=7,
+    )
+    record_vote(s, 2, 1)
+    record_vote(s, 3, 2)
+
+    restored = state_from_dict(json.loads(json.dumps(state_to_dict(s))))
+    assert state_to_dict(restored) == state_to_dict(s)
+    assert restored.roles[1] == "Spy"                 # int keys again after JSON
+    assert (restored.tally, restored.leader) == (s.tally, s.leader)
+    assert "last_active" not in state_to_dict(s)
+
+
+def test_restore_ignores_unknown_fields():
+    data = state_to_dict(GameState(game_stage="joining", players=[5]))
+    data["tally"] = {"5": 9}   # derived: rebuilt from votes, never read back
+    data["removed_field"] = 1
+    s = state_from_dict(data)
+    assert (s.game_stage, s.players, s.tally) == ("joining", [5], {})
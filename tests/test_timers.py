@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timers import TimerScheduler
+
+
+def test_cancelled_timer_never_fires():
+    async def run():
+        timers, fired = TimerScheduler(), []
+
+        async def fire(tag):
+            fired.append(tag)
+
+        now = time.time()
+        timers.schedule(1, "discussion", now + 0.05, fire, "a")
+        timers.schedule(2, "discussion", now + 0.05, fire, "b")
+        assert timers.cancel(1, "discussion")
+        assert not timers.cancel(1, "discussion")
+        assert len(timers) == 1
+        assert len(timers._heap) == 2   # removed lazily, when it reaches the top
+        await asyncio.sleep(0.15)
+        return fired, timers
+
+    fired, timers = asyncio.run(run())
+    assert fired == ["b"]
+    assert timers.fired == 1
+    assert timers._heap == [] and timers._by_chat == {}
+
+
+def test_rescheduling_replaces_the_old_deadline():
+    async def run():
+        timers, fired = TimerScheduler(), []
+
+        async def fire(tag):
+            fired.append((tag, time.time()))
+
+        start = time.time()
+        timers.schedule(1, "voting", start + 0.02, fire, "old")
+        timers.schedule(1, "voting", start + 0.1, fire, "new")
+        assert timers.deadline(1, "voting") == start + 0.1
+        await asyncio.sleep(0.2)
+        return fired, start
+
+    fired, start = asyncio.run(run())
+    assert [tag for tag, _ in fired] == ["new"]
+    assert fired[0][1] >= start + 0.1
+
+
+def test_cancel_chat_and_compaction():
+    async def run():
+        timers = TimerScheduler()
+
+        async def fire():
+            pass
+
+        later = time.time() + 60
+        for chat_id in range(100):
+            timers.schedule(chat_id, "discussion", later, fire)
+            timers.schedule(chat_id, "voting", later, fire)
+        timers.cancel_chat(0)
+        assert timers.deadline(0, "voting") is None and 0 not in timers._by_chat
+        for chat_id in range(1, 80):
+            timers.cancel_chat(chat_id)
+        # cancelled entries outnumber live ones two to one: the heap is rebuilt
+        assert len(timers) == 40
+        assert len(timers._heap) <= 2 * len(timers)
+        timers._task.cancel()
+
+    asyncio.run(run())
@@ -0,0 +1,119 @@
+import time
+import heapq
+import asyncio
+from itertools import count
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+Key = Tuple[int, str]   # (chat_id, timer name)
+
+
+class TimerScheduler:
+    """One task, one heap of absolute (wall-clock) deadlines for every chat.
+
+    Scheduling is O(log n); cancelling is O(1) with lazy removal from the
+    heap. The task only wakes up when the earliest deadline is due or the
+    earliest deadline changes.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, Key]] = []
+        self._entries: Dict[Key, Tuple[float, int, Callable[..., Awaitable], tuple]] = {}
+        self._by_chat: Dict[int, Set[str]] = {}
+        self._seq = count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._firing: Set[asyncio.Task] = set()   # callbacks still running
+        self.fired = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def schedule(self, chat_id: int, name: str, deadline: float,
+                 callback: Callable[..., Awaitable], *args):
+        """Run ``await callback(*args)`` at ``deadline`` (time.time()); replaces a timer of the same name."""
+        key = (chat_id, name)
+        seq = next(self._seq)
+        self._entries[key] = (deadline, seq, callback, args)
+        self._by_chat.setdefault(chat_id, set()).add(name)
+        heapq.heappush(self._heap, (deadline, seq, key))
+        self._ensure_running()
+        if self._heap[0][1] == seq:
+            self._wakeup.set()   # new earliest deadline
+
+    def cancel(self, chat_id: int, name: str) -> bool:
+        if self._entries.pop((chat_id, name), None) is None:
+            return False
+        names = self._by_chat.get(chat_id)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self._by_chat[chat_id]
+        self._maybe_compact()
+        return True
+
+    def cancel_chat(self, chat_id: int):
+        for name in list(self._by_chat.get(chat_id, ())):
+            self.cancel(chat_id, name)
+
+    def deadline(self, chat_id: int, name: str) -> Optional[float]:
+        entry = self._entries.get((chat_id, name))
+        return entry[0] if entry else None
+
+    def snapshot(self) -> List[Tuple[float, int, str]]:
+        """Pending timers as (seconds left, chat_id, name), soonest first."""
+        now = time.time()
+        return sorted((d - now, k[0], k[1]) for k, (d, _, _, _) in self._entries.items())
+
+    def _maybe_compact(self):
+        # cancelled entries stay in the heap until popped; rebuild if they dominate
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._entries):
+            self._heap = [(d, seq, k) for k, (d, seq, _, _) in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def _live(self, item) -> bool:
+        entry = self._entries.get(item[2])
+        return entry is not None and entry[1] == item[1]
+
+    def _pop_due(self, now: float):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            item = heapq.heappop(self._heap)
+            if not self._live(item):
+                continue   # cancelled or rescheduled
+            key = item[2]
+            entry = self._entries.pop(key)
+            names = self._by_chat.get(key[0])
+            if names is not None:
+                names.discard(key[1])
+                if not names:
+                    del self._by_chat[key[0]]
+            due.append((key, entry[2], entry[3]))
+        return due
+
+    async def _fire(self, key: Key, callback, args):
+        try:
+            await callback(*args)
+        except Exception as e:
+            print(f"⚠️ Timer {key[1]} for chat {key[0]} failed: {e}")
+
+    async def _run(self):
+        while True:
+            for key, callback, args in self._pop_due(time.time()):
+                self.fired += 1
+                task = asyncio.create_task(self._fire(key, callback, args))
+                self._firing.add(task)
+                task.add_done_callback(self._firing.discard)
+            # drop stale heads so the sleep targets a live deadline
+            while self._heap and not self._live(self._heap[0]):
+                heapq.heappop(self._heap)
+            self._wakeup.clear()
+            timeout = max(self._heap[0][0] - time.time(), 0) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
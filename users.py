@@ -0,0 +1,38 @@
+import os
+from typing import Set
+from batcher import WriteBehindQueue
+from db import add_users
+
+# ---- Write-behind user registration ----
+USER_FLUSH_BATCH = int(os.environ.get("USER_FLUSH_BATCH", 500))
+USER_FLUSH_DELAY = float(os.environ.get("USER_FLUSH_DELAY", 5))
+KNOWN_USERS_MAX = int(os.environ.get("KNOWN_USERS_MAX", 200_000))
+
+# users already written (or queued) by this process
+_known_users: Set[int] = set()
+
+
+async def _flush_users(user_ids):
+    await add_users(user_ids)
+
+
+_user_writer = WriteBehindQueue(
+    _flush_users, max_batch=USER_FLUSH_BATCH, max_delay=USER_FLUSH_DELAY,
+    key=lambda uid: uid, name="users"
+)
+
+
+def register_user(user_id: int):
+    """Remember a user for /broadcast; repeat calls cost a set lookup."""
+    if user_id in _known_users:
+        return
+    if len(_known_users) >= KNOWN_USERS_MAX:
+        # the insert is idempotent, so forgetting only costs a few redundant rows
+        _known_users.clear()
+    _known_users.add(user_id)
+    _user_writer.add(user_id)
+
+
+async def flush_users():
+    """Flush pending registrations and stop the writer (call on shutdown)."""
+    await _user_writer.stop()